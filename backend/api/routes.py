@@ -2,11 +2,20 @@
 
 import logging
 import os
+from datetime import datetime
+from typing import Literal
 
-from fastapi import APIRouter, HTTPException, UploadFile, File, Form
-from pydantic import BaseModel
+from fastapi import APIRouter, HTTPException, UploadFile, File, Form, Query, Request, Response
+from pydantic import BaseModel, Field
 
-from config import DEFAULT_SAVE_DIR, DEVICE_NAME
+from config import (
+    DEFAULT_SAVE_DIR,
+    DEVICE_NAME,
+    HISTORY_PAGE_SIZE_MAX,
+    MAX_PROGRESS_TICK_INTERVAL,
+    MIN_PROGRESS_TICK_INTERVAL,
+)
+from transfer.models import TransferDirection, TransferPriority, TransferState
 
 logger = logging.getLogger(__name__)
 
@@ -47,12 +56,79 @@ async def list_transfers():
     return {"transfers": [t.model_dump() for t in transfers]}
 
 
+def _history_headers(request: Request, response: Response) -> Response | None:
+    """
+    Tag ``response`` with the history's version as its ETag. Returns a
+    304 response instead if the client's copy is of that version.
+    """
+    etag = f'"{_transfer_manager.history_version}"'
+    # Cached copies are revalidated, which costs a 304 while nothing changed
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    tags = [t.strip().removeprefix("W/") for t in request.headers.get("if-none-match", "").split(",")]
+    if etag in tags or "*" in tags:
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
+
+
 @router.get("/history")
-async def get_history(limit: int = 50):
-    """Return global transfer history."""
-    history = _transfer_manager.get_history(limit)
-    return {"history": history}
+async def get_history(
+    request: Request,
+    response: Response,
+    limit: int = Query(default=50, ge=1, le=HISTORY_PAGE_SIZE_MAX),
+    cursor: str | None = None,
+    peer: str | None = None,
+    direction: TransferDirection | None = None,
+    status: list[TransferState] | None = Query(default=None),
+    since: datetime | None = None,
+    until: datetime | None = None,
+):
+    """
+    Return global transfer history, newest first, a page at a time.
 
+    Pass ``next_cursor`` from one page as ``cursor`` to get the next;
+    it is null on the last page. ``status`` may be repeated.
+    """
+    not_modified = _history_headers(request, response)
+    if not_modified:
+        return not_modified
+    try:
+        history, next_cursor = await _transfer_manager.get_history(
+            limit=limit,
+            cursor=cursor,
+            peer=peer,
+            direction=direction.value if direction else None,
+            status=[s.value for s in status] if status else None,
+            since=since,
+            until=until,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"history": history, "next_cursor": next_cursor}
+
+
+@router.get("/history/stats")
+async def get_history_stats(
+    request: Request,
+    response: Response,
+    group: Literal["peer", "day"] = "day",
+    peer: str | None = None,
+    direction: TransferDirection | None = None,
+    since: datetime | None = None,
+    until: datetime | None = None,
+):
+    """Return transfer totals per peer or per day, newest day first."""
+    not_modified = _history_headers(request, response)
+    if not_modified:
+        return not_modified
+    stats = await _transfer_manager.get_history_stats(
+        group=group,
+        peer=peer,
+        direction=direction.value if direction else None,
+        since=since,
+        until=until,
+    )
+    return {"stats": stats}
 
 
 @router.post("/select-files")
@@ -72,9 +148,28 @@ async def select_files():
     return {"files": list(file_paths)}
 
 
+@router.post("/select-folder")
+async def select_folder():
+    """Open a native folder picker dialog on the host machine."""
+    import tkinter as tk
+    from tkinter import filedialog
+
+    root = tk.Tk()
+    root.withdraw()
+    root.attributes("-topmost", True)
+
+    folder_path = filedialog.askdirectory(title="Select a folder to transfer")
+    root.destroy()
+
+    return {"files": [folder_path] if folder_path else []}
+
+
 class CreateTransferBody(BaseModel):
     peer_id: str
     file_paths: list[str]
+    stripes: int | None = Field(default=None, ge=1)  # Parallel connections per file
+    compress: bool | None = None  # None follows COMPRESSION_ENABLED
+    priority: TransferPriority = TransferPriority.NORMAL  # Order in the send queue
 
 
 @router.post("/transfers")
@@ -82,6 +177,7 @@ async def create_transfer(body: CreateTransferBody):
     """Initiate a file transfer to the specified peer using absolute file paths.
     
     No file upload is required; the backend reads files directly from disk.
+    A folder path sends the whole folder as one transfer.
     """
     # Find the peer
     peers = await _discovery_service.get_peers()
@@ -89,10 +185,10 @@ async def create_transfer(body: CreateTransferBody):
     if not peer:
         raise HTTPException(status_code=404, detail="Peer not found")
 
-    # Verify files exist
+    # Verify files and folders exist
     valid_paths = []
     for path in body.file_paths:
-        if os.path.isfile(path):
+        if os.path.isfile(path) or os.path.isdir(path):
             valid_paths.append(path)
         else:
             logger.warning(f"Skipping invalid file path: {path}")
@@ -107,6 +203,9 @@ async def create_transfer(body: CreateTransferBody):
         peer_device_id=peer.device_id,
         peer_device_name=peer.device_name,
         file_paths=valid_paths,
+        stripes=body.stripes,
+        compress=body.compress,
+        priority=body.priority,
     )
 
     return {
@@ -114,6 +213,8 @@ async def create_transfer(body: CreateTransferBody):
         "message": f"Queued {len(infos)} file(s) for transfer",
     }
 
+
+@router.post("/transfers/{transfer_id}/pause")
 async def pause_transfer(transfer_id: str):
     await _transfer_manager.pause_transfer(transfer_id)
     return {"status": "paused"}
@@ -143,18 +244,50 @@ async def reject_transfer(transfer_id: str):
     return {"status": "rejected"}
 
 
+class PriorityBody(BaseModel):
+    priority: TransferPriority
+
+
+@router.post("/transfers/{transfer_id}/priority")
+async def set_transfer_priority(transfer_id: str, body: PriorityBody):
+    """Move a queued send to another priority class."""
+    if not await _transfer_manager.set_priority(transfer_id, body.priority):
+        raise HTTPException(status_code=409, detail="Transfer is not waiting in the queue")
+    return {"status": "updated"}
+
+
 # --- Settings ---
 
 class SettingsBody(BaseModel):
     device_name: str | None = None
     save_dir: str | None = None
+    # Outgoing bandwidth limits in bytes/s; 0 removes a limit
+    rate_limit_global: int | None = Field(default=None, ge=0)
+    rate_limit_peer: int | None = Field(default=None, ge=0)
+    rate_limit_transfer: int | None = Field(default=None, ge=0)
+    background_mode: bool | None = None
+    # Send scheduler: transfers running at once, overall and per peer
+    max_active_transfers: int | None = Field(default=None, ge=1)
+    max_active_per_peer: int | None = Field(default=None, ge=1)
+    # Seconds between batched progress events on the WebSocket
+    progress_interval: float | None = Field(
+        default=None, ge=MIN_PROGRESS_TICK_INTERVAL, le=MAX_PROGRESS_TICK_INTERVAL
+    )
 
 
 @router.get("/settings")
 async def get_settings():
+    limiter = _transfer_manager.rate_limiter
     return {
         "device_name": _discovery_service.device_name,
         "save_dir": _transfer_manager.save_dir,
+        "rate_limit_global": limiter.global_rate,
+        "rate_limit_peer": limiter.peer_rate,
+        "rate_limit_transfer": limiter.transfer_rate,
+        "background_mode": limiter.background,
+        "max_active_transfers": _transfer_manager.scheduler.max_active,
+        "max_active_per_peer": _transfer_manager.scheduler.max_per_peer,
+        "progress_interval": _transfer_manager.progress.interval,
     }
 
 
@@ -171,4 +304,17 @@ async def update_settings(body: SettingsBody):
                     status_code=400, detail=f"Invalid directory: {e}"
                 )
         _transfer_manager.save_dir = body.save_dir
+    # Applies to transfers already running, too
+    _transfer_manager.rate_limiter.configure(
+        global_rate=body.rate_limit_global,
+        peer_rate=body.rate_limit_peer,
+        transfer_rate=body.rate_limit_transfer,
+        background=body.background_mode,
+    )
+    await _transfer_manager.scheduler.configure(
+        max_active=body.max_active_transfers,
+        max_per_peer=body.max_active_per_peer,
+    )
+    if body.progress_interval is not None:
+        _transfer_manager.progress.interval = body.progress_interval
     return {"status": "updated"}
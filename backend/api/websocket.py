@@ -3,43 +3,204 @@
 import asyncio
 import json
 import logging
+from collections import deque
 
 from fastapi import WebSocket, WebSocketDisconnect
 
+from config import WS_CLIENT_QUEUE, WS_SEND_TIMEOUT
+from transfer.progress import encode_tick
+
 logger = logging.getLogger(__name__)
 
+# Close code for clients too slow to keep up ("Try Again Later")
+_CLOSE_TOO_SLOW = 1013
+
+
+# Kinds of queued message, by what happens when a client falls behind
+TICK = "tick"  # Progress; may be dropped, the client resyncs on the gap
+STATE = "state"  # Transfer state; may be replaced by a snapshot
+OTHER = "other"  # Notifications, requests, peers; always delivered
+
+_EVENT_KINDS = {
+    "transfer_tick": TICK,
+    "transfer_state": STATE,
+    "transfer_queue": STATE,
+}
+
+
+class _Client:
+    """
+    One connected client: a bounded outbox drained by its own sender task.
+
+    When the outbox is full, the oldest progress tick is dropped; the
+    client notices the gap in tick numbers and asks for a snapshot. If
+    there is no tick to drop, every queued tick and state event is
+    replaced by one snapshot, built when it is sent. A client whose
+    outbox is still full after that, or whose socket accepts nothing for
+    WS_SEND_TIMEOUT, is disconnected.
+    """
+
+    def __init__(self, websocket: WebSocket, binary: bool, snapshot):
+        self.websocket = websocket
+        self.binary = binary  # Takes progress ticks as binary messages
+        self._snapshot = snapshot  # fn() -> str, a snapshot event
+        # (message, kind); a None message is a snapshot still to be built
+        self._outbox: deque[tuple[str | bytes | None, str]] = deque()
+        self._ready = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self.dropped = 0
+
+    @property
+    def backlog(self) -> int:
+        return len(self._outbox)
+
+    def start(self, on_gone) -> None:
+        self._task = asyncio.create_task(self._run(on_gone))
+
+    def stop(self) -> None:
+        if self._task is not None and self._task is not asyncio.current_task():
+            self._task.cancel()
+
+    def put(self, message: str | bytes | None, kind: str = OTHER) -> bool:
+        """Queue ``message`` without waiting. False if the client can't keep up."""
+        if len(self._outbox) >= WS_CLIENT_QUEUE:
+            if self._drop_tick():
+                pass
+            elif kind == TICK:
+                self.dropped += 1
+                return True
+            elif not self._resync():
+                return False
+            elif kind == STATE:
+                return True  # The snapshot covers it
+        self._outbox.append((message, kind))
+        self._ready.set()
+        return True
+
+    def _drop_tick(self) -> bool:
+        for index, (_, kind) in enumerate(self._outbox):
+            if kind == TICK:
+                del self._outbox[index]
+                self.dropped += 1
+                return True
+        return False
+
+    def _resync(self) -> bool:
+        """Replace queued state with a snapshot. False if that frees no room."""
+        kept = deque(entry for entry in self._outbox if entry[1] == OTHER)
+        if len(kept) + 1 >= WS_CLIENT_QUEUE:
+            return False
+        self.dropped += len(self._outbox) - len(kept)
+        kept.append((None, STATE))
+        self._outbox = kept
+        return True
+
+    async def _run(self, on_gone) -> None:
+        ws = self.websocket
+        try:
+            while True:
+                await self._ready.wait()
+                while self._outbox:
+                    message, _ = self._outbox.popleft()
+                    if message is None:
+                        message = self._snapshot()
+                    if isinstance(message, bytes):
+                        send = ws.send_bytes(message)
+                    else:
+                        send = ws.send_text(message)
+                    await asyncio.wait_for(send, WS_SEND_TIMEOUT)
+                self._ready.clear()
+        except asyncio.TimeoutError:
+            logger.warning("WebSocket client stalled; disconnecting it")
+            await self.close()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            pass
+        await on_gone(self)
+
+    async def close(self) -> None:
+        try:
+            await self.websocket.close(code=_CLOSE_TOO_SLOW)
+        except Exception:
+            pass
+
 
 class ConnectionManager:
-    """Manages WebSocket connections and broadcasts events."""
+    """
+    Manages WebSocket connections and broadcasts events.
+
+    Every client gets a ``snapshot`` event when it connects, and again
+    whenever it sends ``{"request": "snapshot"}``. A client connecting
+    with ``?encoding=binary`` gets progress ticks as binary messages
+    (see transfer.progress); all other events are JSON text.
 
-    def __init__(self) -> None:
-        self._connections: list[WebSocket] = []
-        self._lock = asyncio.Lock()
+    Broadcasting never waits on a socket: each message is encoded once
+    and queued for every client, whose own task sends it, so a slow UI
+    cannot hold up the transfers that emit events.
+    """
+
+    def __init__(self, snapshot=None) -> None:
+        self._clients: dict[WebSocket, _Client] = {}
+        self._snapshot = snapshot  # fn() -> dict, the state a new client starts from
 
     async def connect(self, websocket: WebSocket) -> None:
         await websocket.accept()
-        async with self._lock:
-            self._connections.append(websocket)
-        logger.info(f"WebSocket client connected. Total: {len(self._connections)}")
+        binary = websocket.query_params.get("encoding") == "binary"
+        client = _Client(websocket, binary, self._snapshot_message)
+        # Queued before any broadcast can reach the client
+        client.put(None, STATE)
+        self._clients[websocket] = client
+        client.start(self._gone)
+        logger.info(f"WebSocket client connected. Total: {len(self._clients)}")
+
+    async def handle_message(self, websocket: WebSocket, text: str) -> None:
+        """Answer a request sent by a client."""
+        try:
+            message = json.loads(text)
+        except ValueError:
+            return
+        client = self._clients.get(websocket)
+        if client and isinstance(message, dict) and message.get("request") == "snapshot":
+            if not client.put(None, STATE):
+                self._overloaded(client)
+
+    def _snapshot_message(self) -> str:
+        snapshot = self._snapshot() if self._snapshot is not None else {"seq": 0, "transfers": []}
+        return json.dumps({"event": "snapshot", "data": snapshot})
 
     async def disconnect(self, websocket: WebSocket) -> None:
-        async with self._lock:
-            if websocket in self._connections:
-                self._connections.remove(websocket)
-        logger.info(f"WebSocket client disconnected. Total: {len(self._connections)}")
+        client = self._clients.pop(websocket, None)
+        if client:
+            client.stop()
+        logger.info(f"WebSocket client disconnected. Total: {len(self._clients)}")
+
+    async def _gone(self, client: _Client) -> None:
+        """Called by a client's sender task once its socket is unusable."""
+        if self._clients.get(client.websocket) is client:
+            await self.disconnect(client.websocket)
+
+    def _overloaded(self, client: _Client) -> None:
+        logger.warning(
+            f"WebSocket client fell {client.backlog} events behind; disconnecting it"
+        )
+        self._clients.pop(client.websocket, None)
+        client.stop()
+        asyncio.create_task(client.close())
 
     async def broadcast(self, event: str, data: dict) -> None:
-        """Broadcast an event to all connected WebSocket clients."""
+        """Queue an event for all connected WebSocket clients."""
+        if not self._clients:
+            return
         message = json.dumps({"event": event, "data": data})
-        async with self._lock:
-            dead: list[WebSocket] = []
-            for ws in self._connections:
-                try:
-                    await ws.send_text(message)
-                except Exception:
-                    dead.append(ws)
-            for ws in dead:
-                self._connections.remove(ws)
+        kind = _EVENT_KINDS.get(event, OTHER)
+        # Each encoding is produced once, however many clients take it
+        binary = None
+        if kind == TICK and any(client.binary for client in self._clients.values()):
+            binary = encode_tick(data)
+        for client in list(self._clients.values()):
+            if not client.put(binary if binary is not None and client.binary else message, kind):
+                self._overloaded(client)
 
     async def handle_event(self, event_type: str, data: dict) -> None:
         """
@@ -0,0 +1,522 @@
+"""
+Micro-benchmarks for the transfer hot path.
+
+Usage:
+    python benchmark.py framing [--chunks N] [--chunk-size BYTES]
+    python benchmark.py receive [--chunks N] [--chunk-size BYTES]
+    python benchmark.py digest [--chunks N] [--chunk-size BYTES]
+    python benchmark.py cipher [--chunks N] [--chunk-size BYTES]
+    python benchmark.py read [--chunks N] [--chunk-size BYTES]
+
+framing
+    Encrypts, frames and writes DATA_CHUNK payloads over a local socket
+    pair, then decrypts them, comparing the original concatenating path
+    ("before") with the current path ("after"): vectored writes,
+    memoryview decryption and one counter-nonce SessionCipher per session
+    instead of a fresh AESGCM object and os.urandom() call per chunk.
+    Reports throughput and bytes copied per payload byte: every step's
+    tracemalloc peak beyond the output the cipher itself must produce.
+    Copies made inside the asyncio transport are reported separately,
+    since they depend on the Python version rather than on our code.
+
+receive
+    Streams encrypted DATA_CHUNK frames into the receiver and decrypts
+    them through a queue as deep as a session stream's, comparing
+    StreamReader.readexactly() with fresh buffers per frame ("before")
+    against FrameProtocol with pooled buffers ("after"). Each path runs in
+    its own process and reports throughput, peak RSS and page faults per
+    frame, the cost of mapping fresh memory for every chunk.
+
+digest
+    Cost of the end-to-end file digest. Runs the per-chunk CPU work of
+    the send pipeline (encryption) with and without feeding each chunk
+    to a FileDigest, and compares that with hashing the finished file in
+    a separate verification pass, which has to read it back from disk.
+
+cipher
+    Encrypt and decrypt throughput of each AEAD suite through
+    SessionCipher, next to the quick figures the handshake negotiates
+    with (security.crypto.cipher_speeds()).
+
+read
+    The send path's file reads: buffered seek() + read() ("buffered")
+    against memoryview slices of a memory-mapped file ("mmap"), each
+    feeding the file digest and the cipher as the send pipeline does.
+    Runs with the file in the page cache ("hot") and after evicting it
+    ("cold", Linux and other systems with posix_fadvise), and reports
+    throughput and the bytes allocated per chunk read.
+"""
+
+import argparse
+import asyncio
+import json
+import operator
+import os
+import socket
+import struct
+import subprocess
+import sys
+import threading
+import time
+import tempfile
+import tracemalloc
+
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+from config import CHUNK_SIZE, MAX_PIPELINE_BYTES, STREAM_QUEUE_DEPTH
+from security.crypto import CIPHER_SUITES, NONCE_SIZE, SessionCipher, cipher_speeds
+from transfer.models import MessageType
+from transfer.compression import RAW
+from transfer.delta import FileDigest, choose_block_size, hash_blocks
+from transfer.service import CHUNK_HEADER_FORMAT, CHUNK_HEADER_SIZE, _BufferedSource, _MappedSource, _read_chunks
+from transfer.protocol import FRAME_HEADER_FORMAT, FRAME_HEADER_SIZE, BufferPool, FrameProtocol
+from transfer.session import write_frame
+
+TAG_SIZE = 16
+
+
+class CopyMeter:
+    """Attributes the bytes each measured step allocates beyond its expected output."""
+
+    def __init__(self, enabled: bool):
+        self.enabled = enabled
+        self.copied = 0
+        self.transport = 0
+
+    def _run(self, fn, args, expected: int):
+        if not self.enabled:
+            return fn(*args), 0
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        result = fn(*args)
+        extra = tracemalloc.get_traced_memory()[1] - base - expected
+        return result, max(0, extra)
+
+    def step(self, fn, *args, expected: int = 0):
+        result, extra = self._run(fn, args, expected)
+        self.copied += extra
+        return result
+
+    async def write(self, coro_fn, *args):
+        if not self.enabled:
+            return await coro_fn(*args)
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        await coro_fn(*args)
+        self.transport += max(0, tracemalloc.get_traced_memory()[1] - base)
+
+
+# --- Reference implementation of the path before copy-free framing ---
+
+async def _legacy_write(writer, frame: bytes) -> None:
+    writer.write(frame)
+    await writer.drain()
+
+
+async def _legacy_send(meter: CopyMeter, writer, key: bytes, chunk: bytes, offset: int) -> bytes:
+    chunk_header = struct.pack(CHUNK_HEADER_FORMAT, offset, RAW)
+    nonce = os.urandom(NONCE_SIZE)
+    ciphertext = meter.step(AESGCM(key).encrypt, nonce, chunk, chunk_header, expected=len(chunk) + TAG_SIZE)
+    encrypted = meter.step(operator.add, nonce, ciphertext)
+    payload = meter.step(operator.add, chunk_header, encrypted)
+    header = struct.pack(FRAME_HEADER_FORMAT, MessageType.DATA_CHUNK, 1, len(payload))
+    frame = meter.step(operator.add, header, payload)
+    await meter.write(_legacy_write, writer, frame)
+    return payload
+
+
+def _legacy_receive(meter: CopyMeter, key: bytes, payload: bytes) -> None:
+    body = meter.step(operator.getitem, payload, slice(CHUNK_HEADER_SIZE, None))
+    ciphertext = meter.step(operator.getitem, body, slice(NONCE_SIZE, None))
+    nonce = body[:NONCE_SIZE]
+    meter.step(
+        AESGCM(key).decrypt, nonce, ciphertext, payload[:CHUNK_HEADER_SIZE],
+        expected=len(ciphertext) - TAG_SIZE,
+    )
+
+
+# --- Current path ---
+
+async def _current_send(meter: CopyMeter, writer, cipher: SessionCipher, chunk: bytes, offset: int) -> tuple:
+    chunk_header = struct.pack(CHUNK_HEADER_FORMAT, offset, RAW)
+    seq = cipher.next_send_seq(1)
+    ciphertext = meter.step(cipher.encrypt, 1, seq, chunk, chunk_header, expected=len(chunk) + TAG_SIZE)
+    seq_header = struct.pack(SessionCipher.SEQUENCE_FORMAT, seq)
+    await meter.write(write_frame, writer, MessageType.DATA_CHUNK, 1, chunk_header, seq_header, ciphertext)
+    return chunk_header, seq_header, ciphertext
+
+
+def _current_receive(meter: CopyMeter, cipher: SessionCipher, payload: bytes) -> None:
+    view = memoryview(payload)
+    seq_end = CHUNK_HEADER_SIZE + SessionCipher.SEQUENCE_SIZE
+    (seq,) = struct.unpack(SessionCipher.SEQUENCE_FORMAT, view[CHUNK_HEADER_SIZE:seq_end])
+    meter.step(
+        cipher.decrypt, 1, seq, view[seq_end:], view[:CHUNK_HEADER_SIZE],
+        expected=len(view) - seq_end - TAG_SIZE,
+    )
+
+
+PATHS = {
+    "before": (_legacy_send, _legacy_receive),
+    "after": (_current_send, _current_receive),
+}
+
+
+def _path_contexts(name: str, key: bytes) -> tuple:
+    """The legacy path works on the raw key; the current one on a session cipher per side."""
+    if name == "before":
+        return key, key
+    return SessionCipher(key, initiator=True), SessionCipher(key, initiator=False)
+
+
+def _drain_socket(sock: socket.socket) -> None:
+    while sock.recv(1 << 20):
+        pass
+
+
+async def _measure_path(name: str, chunk: bytes, chunks: int, samples: int = 4) -> dict:
+    send, receive = PATHS[name]
+    send_ctx, recv_ctx = _path_contexts(name, AESGCM.generate_key(bit_length=256))
+
+    rsock, wsock = socket.socketpair()
+    drainer = threading.Thread(target=_drain_socket, args=(rsock,), daemon=True)
+    drainer.start()
+    _, writer = await asyncio.open_connection(sock=wsock)
+
+    # Throughput, without tracing overhead
+    idle = CopyMeter(enabled=False)
+    sent = []
+    start = time.perf_counter()
+    for i in range(chunks):
+        sent.append(await send(idle, writer, send_ctx, chunk, i * len(chunk)))
+    send_elapsed = time.perf_counter() - start
+    # The receiver always sees a frame payload as one contiguous buffer
+    payloads = [p if isinstance(p, bytes) else b"".join(p) for p in sent]
+    del sent
+
+    start = time.perf_counter()
+    for payload in payloads:
+        receive(idle, recv_ctx, payload)
+    recv_elapsed = time.perf_counter() - start
+
+    # Copy accounting on a few chunks
+    samples = min(samples, chunks)
+    send_meter = CopyMeter(enabled=True)
+    recv_meter = CopyMeter(enabled=True)
+    tracemalloc.start()
+    for i in range(samples):
+        await send(send_meter, writer, send_ctx, chunk, i * len(chunk))
+        receive(recv_meter, recv_ctx, payloads[i])
+    tracemalloc.stop()
+
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except Exception:
+        pass
+    drainer.join(timeout=5)
+    rsock.close()
+
+    total = len(chunk) * chunks
+    sampled = len(chunk) * samples
+    return {
+        "send_mbps": total / send_elapsed / 1e6,
+        "recv_mbps": total / recv_elapsed / 1e6,
+        "send_copies": send_meter.copied / sampled,
+        "transport_copies": send_meter.transport / sampled,
+        "recv_copies": recv_meter.copied / sampled,
+    }
+
+
+def bench_framing(args) -> None:
+    chunk = os.urandom(args.chunk_size)
+    print(f"framing: {args.chunks} x {args.chunk_size} byte chunks, Python {sys.version.split()[0]}")
+    if sys.version_info < (3, 12):
+        print("note: asyncio only does vectored writelines() on Python 3.12+; older versions join the parts")
+    print(
+        f"{'path':<8}{'send MB/s':>11}{'recv MB/s':>11}"
+        f"{'send copies/B':>15}{'transport copies/B':>20}{'recv copies/B':>15}"
+    )
+    for name in PATHS:
+        r = asyncio.run(_measure_path(name, chunk, args.chunks))
+        print(
+            f"{name:<8}{r['send_mbps']:>11.0f}{r['recv_mbps']:>11.0f}"
+            f"{r['send_copies']:>15.2f}{r['transport_copies']:>20.2f}{r['recv_copies']:>15.2f}"
+        )
+
+
+# --- Receive path ---
+
+def _send_frames(sock: socket.socket, frame: bytes, count: int) -> None:
+    for _ in range(count):
+        sock.sendall(frame)
+    sock.shutdown(socket.SHUT_WR)
+
+
+async def _legacy_frames(sock: socket.socket):
+    reader, writer = await asyncio.open_connection(sock=sock)
+    try:
+        while True:
+            header = await reader.readexactly(FRAME_HEADER_SIZE)
+            _, _, length = struct.unpack(FRAME_HEADER_FORMAT, header)
+            yield await reader.readexactly(length)
+    except asyncio.IncompleteReadError:
+        writer.close()
+
+
+async def _receive_legacy(sock: socket.socket, cipher: SessionCipher, queue: asyncio.Queue) -> None:
+    async def consume():
+        while (payload := await queue.get()) is not None:
+            view = memoryview(payload)
+            cipher.decrypt(1, 0, view[CHUNK_HEADER_SIZE + SessionCipher.SEQUENCE_SIZE:], view[:CHUNK_HEADER_SIZE])
+
+    consumer = asyncio.create_task(consume())
+    async for payload in _legacy_frames(sock):
+        await queue.put(payload)
+    await queue.put(None)
+    await consumer
+
+
+async def _receive_pooled(sock: socket.socket, cipher: SessionCipher, queue: asyncio.Queue) -> None:
+    loop = asyncio.get_running_loop()
+    _, conn = await loop.create_connection(
+        lambda: FrameProtocol(BufferPool(max_free_bytes=MAX_PIPELINE_BYTES)), sock=sock
+    )
+
+    async def consume():
+        while (view := await queue.get()) is not None:
+            out = conn.pool.acquire(len(view))
+            cipher.decrypt_into(
+                1, 0, view[CHUNK_HEADER_SIZE + SessionCipher.SEQUENCE_SIZE:], out, view[:CHUNK_HEADER_SIZE]
+            )
+            conn.release(view)
+            conn.pool.release(out)
+
+    consumer = asyncio.create_task(consume())
+    try:
+        while True:
+            _, _, view = await conn.read_frame()
+            await queue.put(view)
+    except ConnectionError:
+        pass
+    await queue.put(None)
+    await consumer
+    conn.close()
+
+
+RECEIVE_PATHS = {
+    "before": _receive_legacy,
+    "after": _receive_pooled,
+}
+
+
+async def _measure_receive(name: str, chunk_size: int, chunks: int) -> dict:
+    import resource
+
+    key = AESGCM.generate_key(bit_length=256)
+    chunk_header = struct.pack(CHUNK_HEADER_FORMAT, 0, RAW)
+    ciphertext = SessionCipher(key, initiator=True).encrypt(1, 0, os.urandom(chunk_size), chunk_header)
+    payload = chunk_header + struct.pack(SessionCipher.SEQUENCE_FORMAT, 0) + ciphertext
+    frame = struct.pack(FRAME_HEADER_FORMAT, MessageType.DATA_CHUNK, 1, len(payload)) + payload
+
+    rsock, wsock = socket.socketpair()
+    sender = threading.Thread(target=_send_frames, args=(wsock, frame, chunks), daemon=True)
+    faults = resource.getrusage(resource.RUSAGE_SELF).ru_minflt
+    start = time.perf_counter()
+    sender.start()
+    await RECEIVE_PATHS[name](rsock, SessionCipher(key, initiator=False), asyncio.Queue(STREAM_QUEUE_DEPTH))
+    elapsed = time.perf_counter() - start
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    sender.join()
+    wsock.close()
+    return {
+        "mbps": chunk_size * chunks / elapsed / 1e6,
+        "max_rss_mb": usage.ru_maxrss / 1024,
+        "faults_per_frame": (usage.ru_minflt - faults) / chunks,
+    }
+
+
+def bench_receive(args) -> None:
+    if args.path:
+        print(json.dumps(asyncio.run(_measure_receive(args.path, args.chunk_size, args.chunks))))
+        return
+
+    print(f"receive: {args.chunks} x {args.chunk_size} byte chunks, Python {sys.version.split()[0]}")
+    print(f"{'path':<8}{'recv MB/s':>11}{'peak RSS MB':>13}{'page faults/frame':>19}")
+    for name in RECEIVE_PATHS:
+        # Separate processes, so each peak RSS starts from a clean slate
+        out = subprocess.run(
+            [sys.executable, __file__, "receive", "--path", name,
+             "--chunks", str(args.chunks), "--chunk-size", str(args.chunk_size)],
+            check=True, capture_output=True, text=True,
+        ).stdout
+        r = json.loads(out)
+        print(f"{name:<8}{r['mbps']:>11.0f}{r['max_rss_mb']:>13.0f}{r['faults_per_frame']:>19.0f}")
+
+
+# --- File digest ---
+
+def _pipeline_mbps(cipher: SessionCipher, chunk: bytes, chunks: int, digest: FileDigest | None) -> float:
+    header = struct.pack(CHUNK_HEADER_FORMAT, 0, RAW)
+    started = time.perf_counter()
+    for index in range(chunks):
+        cipher.encrypt(1, index, chunk, header)
+        if digest:
+            digest.update(index * len(chunk), chunk)
+    return len(chunk) * chunks / (time.perf_counter() - started) / 1e6
+
+
+def bench_digest(args) -> None:
+    chunk = os.urandom(args.chunk_size)
+    total = args.chunk_size * args.chunks
+    block_size = choose_block_size(total)
+    cipher = SessionCipher(os.urandom(32), initiator=True)
+    print(f"digest: {args.chunks} x {args.chunk_size} byte chunks, {block_size} byte blocks")
+
+    plain = _pipeline_mbps(cipher, chunk, args.chunks, None)
+    digest = FileDigest(total, block_size)
+    hashed = _pipeline_mbps(cipher, chunk, args.chunks, digest)
+    assert digest.root() is not None
+
+    with tempfile.NamedTemporaryFile() as f:
+        for _ in range(args.chunks):
+            f.write(chunk)
+        f.flush()
+        started = time.perf_counter()
+        hash_blocks(f.name, total, block_size)
+        separate = total / (time.perf_counter() - started) / 1e6
+
+    print(f"{'encrypt only':<30}{plain:>9.0f} MB/s")
+    print(f"{'encrypt + in-pipeline digest':<30}{hashed:>9.0f} MB/s  ({(plain / hashed - 1) * 100:.0f}% more CPU per byte)")
+    print(f"{'separate pass (page cache)':<30}{separate:>9.0f} MB/s  (plus a disk read of the file when cold)")
+
+
+# --- Cipher suites ---
+
+def bench_cipher(args) -> None:
+    chunk = os.urandom(args.chunk_size)
+    header = struct.pack(CHUNK_HEADER_FORMAT, 0, RAW)
+    quick = cipher_speeds()
+    print(f"cipher: {args.chunks} x {args.chunk_size} byte chunks")
+    print(f"{'suite':<20}{'encrypt':>12}{'decrypt':>12}{'startup':>12}")
+    for suite in CIPHER_SUITES:
+        if suite not in quick:
+            print(f"{suite:<20}{'unavailable':>12}")
+            continue
+        key = os.urandom(32)
+        sender = SessionCipher(key, initiator=True, suite=suite)
+        receiver = SessionCipher(key, initiator=False, suite=suite)
+        started = time.perf_counter()
+        sealed = [sender.encrypt(1, seq, chunk, header) for seq in range(args.chunks)]
+        encrypt = len(chunk) * args.chunks / (time.perf_counter() - started) / 1e6
+        started = time.perf_counter()
+        for seq, ciphertext in enumerate(sealed):
+            receiver.decrypt(1, seq, ciphertext, header)
+        decrypt = len(chunk) * args.chunks / (time.perf_counter() - started) / 1e6
+        print(f"{suite:<20}{encrypt:>7.0f} MB/s{decrypt:>7.0f} MB/s{quick[suite]:>7.0f} MB/s")
+
+
+# --- File reads ---
+
+READ_SOURCES = {"buffered": _BufferedSource, "mmap": _MappedSource}
+
+
+def _evict(f) -> bool:
+    """Drop the file from the page cache; False where that isn't possible."""
+    if not hasattr(os, "posix_fadvise"):
+        return False
+    os.fsync(f.fileno())
+    os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+    return True
+
+
+def _measure_read(source_cls, f, chunk_size: int, chunks: int, cipher: SessionCipher | None) -> tuple[float, float]:
+    """(MB/s, bytes allocated per chunk) reading the whole file through ``source_cls``."""
+    total = chunk_size * chunks
+    header = struct.pack(CHUNK_HEADER_FORMAT, 0, RAW)
+    digest = FileDigest(total, choose_block_size(total))
+    source = source_cls(f)
+    allocated = 0
+    try:
+        started = time.perf_counter()
+        for index in range(chunks):
+            offset = index * chunk_size
+            if index == 1:
+                tracemalloc.start()
+            batch = _read_chunks(source, [(offset, chunk_size)], digest)
+            if index == 1:
+                allocated = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            if cipher:
+                cipher.encrypt(1, index, batch[0], header)
+            del batch
+        elapsed = time.perf_counter() - started
+    finally:
+        source.close()
+    assert digest.root() is not None
+    return total / elapsed / 1e6, allocated
+
+
+def bench_read(args) -> None:
+    total = args.chunk_size * args.chunks
+    cipher = SessionCipher(os.urandom(32), initiator=True)
+    print(f"read: {args.chunks} x {args.chunk_size} byte chunks ({total / 1e6:.0f} MB file)")
+    with tempfile.NamedTemporaryFile() as f:
+        for _ in range(args.chunks):
+            f.write(os.urandom(args.chunk_size))
+        f.flush()
+
+        print(f"{'source':<10}{'cache':<6}{'read + digest':>16}{'+ encrypt':>14}{'alloc/chunk':>14}")
+        for cache in ("hot", "cold"):
+            for name, source_cls in READ_SOURCES.items():
+                results = []
+                for step_cipher in (None, cipher):
+                    if cache == "cold":
+                        if not _evict(f):
+                            break
+                    else:
+                        _measure_read(source_cls, f, args.chunk_size, args.chunks, None)  # Warm up
+                    results.append(_measure_read(source_cls, f, args.chunk_size, args.chunks, step_cipher))
+                if not results:
+                    print(f"{name:<10}{cache:<6}{'unavailable':>16}")
+                    continue
+                (digest_mbps, allocated), (encrypt_mbps, _) = results
+                print(f"{name:<10}{cache:<6}{digest_mbps:>11.0f} MB/s{encrypt_mbps:>9.0f} MB/s{allocated:>12} B")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    framing = sub.add_parser("framing", help="DATA_CHUNK framing copies and throughput")
+    framing.add_argument("--chunks", type=int, default=64)
+    framing.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    framing.set_defaults(func=bench_framing)
+
+    receive = sub.add_parser("receive", help="Receive-side buffer reuse, RSS and page faults")
+    receive.add_argument("--chunks", type=int, default=256)
+    receive.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    receive.add_argument("--path", choices=list(RECEIVE_PATHS), help=argparse.SUPPRESS)
+    receive.set_defaults(func=bench_receive)
+
+    digest = sub.add_parser("digest", help="Cost of the end-to-end file digest")
+    digest.add_argument("--chunks", type=int, default=64)
+    digest.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    digest.set_defaults(func=bench_digest)
+
+    cipher = sub.add_parser("cipher", help="Throughput of each negotiable cipher suite")
+    cipher.add_argument("--chunks", type=int, default=32)
+    cipher.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    cipher.set_defaults(func=bench_cipher)
+
+    read = sub.add_parser("read", help="Buffered against memory-mapped file reads")
+    read.add_argument("--chunks", type=int, default=128)
+    read.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    read.set_defaults(func=bench_read)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -33,10 +33,92 @@ TRANSFER_PORT_MIN = 50000
 TRANSFER_PORT_MAX = 65000
 
 # --- Transfer ---
-CHUNK_SIZE = 4194304  # 4 MB
-MAX_RETRIES = 3
-RETRY_DELAY = 2  # seconds
+CHUNK_SIZE = 4194304  # 4 MB — starting size; the tuner adapts it per transfer
+
+# Reconnect: a transfer whose connection drops reconnects and resumes by itself
+MAX_RETRIES = 5  # Reconnect attempts in a row that make no progress before a transfer fails
+RETRY_DELAY = 2  # seconds before the first reconnect; doubles with each failed attempt
+MAX_RETRY_DELAY = 30  # seconds between reconnect attempts at most
+RECONNECT_WINDOW = 120  # seconds a receiver keeps an interrupted transfer for its sender to return
+CONNECT_TIMEOUT = 10  # seconds to open a TCP connection to a peer
+HEARTBEAT_INTERVAL = 5  # seconds a session may send nothing before it sends a PING
+HEARTBEAT_TIMEOUT = 20  # seconds without a byte from the peer before its session is dropped
+
+# Multi-stream striping: large files are split across parallel TCP connections
+DEFAULT_STRIPES = 4
+MAX_STRIPES = 8
+STRIPE_MIN_FILE_SIZE = 268435456  # 256 MB — below this a single stream saturates the link
+STRIPE_JOIN_TIMEOUT = 10  # seconds
+STRIPE_UNIT = 16777216  # 16 MB — contiguous span each stripe owns in turn; a multiple of every chunk size
+
+# Persistent sessions: one authenticated connection multiplexes many files
+SESSION_IDLE_TIMEOUT = 60  # seconds a session with no streams stays warm
+STREAM_QUEUE_DEPTH = 4  # Buffered DATA_CHUNK frames per stream, until tuned
+MAX_FRAME_SIZE = 67108864  # 64 MB — larger frames are a protocol violation
+
+# Adaptive chunking: chunk size and pipeline depth are re-tuned per transfer
+MIN_CHUNK_SIZE = 262144  # 256 KB
+MAX_CHUNK_SIZE = 16777216  # 16 MB
+CHUNK_TARGET_SECONDS = 0.05  # Time a chunk should take through the slowest stage
+MIN_PIPELINE_DEPTH = 2
+MAX_PIPELINE_DEPTH = 16
+MAX_PIPELINE_BYTES = 67108864  # 64 MB in flight per stream at most
+TUNE_INTERVAL = 1.0  # seconds between tuning decisions
+
+# Parallel crypto: chunks are encrypted on a shared worker pool
+CRYPTO_WORKERS = 0  # Worker threads for chunk encryption; 0 uses one per CPU core
+CRYPTO_BATCH_BYTES = 4194304  # 4 MB — chunks handed to a worker per thread hop
+MMAP_READS = True  # Send regular files from a memory map instead of read() copies
+MMAP_MIN_AGE = 10  # seconds since a file's last change before it is mapped; truncating a mapped file crashes
+
+# Resume: an existing partial file is verified block by block before reuse
+RESUME_BLOCK_SIZE = 1048576  # 1 MB — granularity of the block-hash comparison
+PART_SUFFIX = ".part"  # Received data goes to <name>.part, renamed once its digest is verified
+
+# Send scheduler: queued transfers wait for a slot
+MAX_ACTIVE_TRANSFERS = 4  # Sends running at once; the rest stay PENDING in order
+MAX_ACTIVE_PER_PEER = 2  # Sends running at once to any one peer
+SCHEDULER_SMALL_FILE = 16777216  # 16 MB — files up to this size go first within a priority
+
+# Folder transfers: member files are sent over the folder's session
+FOLDER_CONCURRENCY = 8  # Member files in flight at once, hiding per-file round trips
+PACK_FILE_SIZE = 65536  # 64 KB — smaller members are packed, many per frame
+PACK_FRAME_SIZE = 1048576  # 1 MB — file data per packed frame
+PACK_MAX_FILES = 4096  # Files per packed frame
+
+# Dedup: the receiver links files it already has instead of receiving them
+DEDUP_ENABLED = True  # Senders hash files not yet in their content index up front
+
+# Rate limits: outgoing bytes/s per transfer, per peer and overall; 0 = unlimited
+RATE_LIMIT_TRANSFER = 0
+RATE_LIMIT_PEER = 0
+RATE_LIMIT_GLOBAL = 0
+RATE_BURST_SECONDS = 0.1  # Bytes a limited bucket may send at once, in seconds of its rate
+
+# Background mode: yield to other traffic when the RTT to the peer inflates
+BACKGROUND_MODE = False  # Default for /api/settings
+BACKGROUND_TARGET_DELAY = 0.025  # seconds of queuing delay tolerated (LEDBAT's target)
+BACKGROUND_MIN_RATE = 131072  # 128 KB/s — never backs off below this
+BACKGROUND_PING_INTERVAL = 0.2  # seconds between RTT samples in background mode
+
+# Compression: codecs are negotiated per session, applied per chunk
+COMPRESSION_ENABLED = True  # Default for transfers that don't choose
+
+# Event channel: progress goes to the UI in batched ticks
+PROGRESS_TICK_INTERVAL = 0.25  # seconds between progress ticks; default for /api/settings
+MIN_PROGRESS_TICK_INTERVAL = 0.05
+MAX_PROGRESS_TICK_INTERVAL = 5.0
+WS_CLIENT_QUEUE = 1024  # Events queued per UI client; beyond this ticks are dropped, then state resynced
+WS_SEND_TIMEOUT = 10  # seconds a UI client may take to accept one message before it is dropped
 
 # --- Storage ---
 DEFAULT_SAVE_DIR = str(Path.home() / "Downloads" / "TransferBooth")
 os.makedirs(DEFAULT_SAVE_DIR, exist_ok=True)
+
+# Transfer history: written in batches by a background thread
+HISTORY_FLUSH_INTERVAL = 0.5  # seconds records may wait before they are committed together
+HISTORY_QUEUE_SIZE = 4096  # Transfers with records waiting; past this, records of running transfers are skipped
+HISTORY_RETENTION_DAYS = 365  # Older records are folded into daily totals and removed; 0 keeps them
+HISTORY_MAX_RECORDS = 100000  # Records kept at most, newest first; 0 = no cap
+HISTORY_COMPACT_INTERVAL = 86400  # seconds between retention passes, besides one at startup
+HISTORY_PAGE_SIZE_MAX = 500  # Records per /api/history page at most
@@ -33,7 +33,7 @@ trust_store = TrustStore()
 
 discovery_service = DiscoveryService(identity_service, trust_store)
 transfer_manager = TransferManager(identity_service, trust_store)
-ws_manager = ConnectionManager()
+ws_manager = ConnectionManager(snapshot=transfer_manager.snapshot)
 
 
 @asynccontextmanager
@@ -103,8 +103,8 @@ async def websocket_endpoint(websocket: WebSocket):
     await ws_manager.connect(websocket)
     try:
         while True:
-            # Keep the connection alive; we don't expect client messages
-            await websocket.receive_text()
+            # Clients only ever ask for a fresh snapshot
+            await ws_manager.handle_message(websocket, await websocket.receive_text())
     except WebSocketDisconnect:
         await ws_manager.disconnect(websocket)
     except Exception:
@@ -1,19 +1,28 @@
 """
-Security module: ECDH key exchange + AES-256-GCM encryption.
+Security module: ECDH key exchange + AEAD encryption.
 
-All keys are ephemeral (per-session) and never persisted.
+All keys are ephemeral (per-session) and never persisted. Sessions use
+AES-256-GCM or ChaCha20-Poly1305, whichever the two peers run fastest:
+each node measures both once (see cipher_speeds()) and the handshake
+picks the suite with the best throughput on the slower of the two.
 """
 
+import functools
+import hashlib
+import hmac
 import os
 import logging
+import struct
+import time
 
+from cryptography.exceptions import UnsupportedAlgorithm
 from cryptography.hazmat.primitives.asymmetric.x25519 import (
     X25519PrivateKey,
     X25519PublicKey,
 )
 from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from cryptography.hazmat.primitives.hashes import SHA256
-from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM, ChaCha20Poly1305
 from cryptography.hazmat.primitives.serialization import (
     Encoding,
     PublicFormat,
@@ -25,6 +34,25 @@ logger = logging.getLogger(__name__)
 NONCE_SIZE = 12
 # AES-256 key size
 KEY_SIZE = 32
+# AES-GCM authentication tag size
+TAG_SIZE = 16
+
+# AEAD suites by wire name; both take a 32-byte key and a 12-byte nonce
+# and produce a 16-byte tag. The first is the default for peers that do
+# not negotiate.
+AES_256_GCM = "aes-256-gcm"
+CHACHA20_POLY1305 = "chacha20-poly1305"
+CIPHER_SUITES = {
+    AES_256_GCM: AESGCM,
+    CHACHA20_POLY1305: ChaCha20Poly1305,
+}
+
+# AESGCM.decrypt_into only exists in newer cryptography releases
+_HAS_DECRYPT_INTO = all(hasattr(aead, "decrypt_into") for aead in CIPHER_SUITES.values())
+
+# Work per suite for the startup micro-benchmark
+_BENCH_CHUNK = 262144
+_BENCH_SECONDS = 0.05
 
 
 def generate_keypair() -> tuple[X25519PrivateKey, bytes]:
@@ -43,6 +71,52 @@ def generate_keypair() -> tuple[X25519PrivateKey, bytes]:
     return private_key, public_bytes
 
 
+@functools.cache
+def cipher_speeds() -> dict[str, float]:
+    """
+    Encryption throughput of each suite on this machine, in MB/s.
+
+    Measured once per process, on first use: a few hundred KB-sized
+    encryptions per suite, about 0.1 s in total. Without AES instructions
+    (many ARM boards, older laptops) ChaCha20-Poly1305 comes out ahead.
+    """
+    chunk = os.urandom(_BENCH_CHUNK)
+    nonce = bytes(NONCE_SIZE)
+    speeds = {}
+    for name, aead_class in CIPHER_SUITES.items():
+        try:
+            # A throwaway key: the fixed nonce only ever encrypts noise
+            aead = aead_class(bytes(KEY_SIZE))
+            aead.encrypt(nonce, chunk, None)  # Warm up
+        except UnsupportedAlgorithm:
+            logger.info(f"{name} is not available in this OpenSSL build")
+            continue
+        count = 0
+        started = time.perf_counter()
+        while True:
+            aead.encrypt(nonce, chunk, None)
+            count += 1
+            elapsed = time.perf_counter() - started
+            if elapsed >= _BENCH_SECONDS:
+                break
+        speeds[name] = round(count * _BENCH_CHUNK / elapsed / 1e6, 1)
+    logger.info(f"Cipher throughput: {speeds}")
+    return speeds
+
+
+def choose_cipher_suite(local: dict[str, float], remote: dict[str, float]) -> str:
+    """
+    The suite that runs fastest on the slower of two peers.
+
+    Each side's figures come from cipher_speeds(). Ties go to the
+    earlier suite in CIPHER_SUITES.
+    """
+    common = [name for name in CIPHER_SUITES if name in local and name in remote]
+    if not common:
+        return AES_256_GCM
+    return max(common, key=lambda name: min(local[name], remote[name]))
+
+
 def derive_shared_key(
     private_key: X25519PrivateKey,
     peer_public_bytes: bytes,
@@ -65,25 +139,141 @@ def derive_shared_key(
     return derived_key
 
 
-def encrypt_chunk(key: bytes, plaintext: bytes) -> bytes:
+def encrypt_chunk(
+    key: bytes, plaintext: bytes, associated_data: bytes | None = None
+) -> bytes:
     """
     Encrypt a data chunk using AES-256-GCM.
 
+    ``associated_data`` is authenticated but not encrypted, so it cannot
+    be altered in transit.
+
     Returns: nonce (12 bytes) || ciphertext || tag (16 bytes)
     """
     nonce = os.urandom(NONCE_SIZE)
     aesgcm = AESGCM(key)
-    ciphertext = aesgcm.encrypt(nonce, plaintext, None)
-    return nonce + ciphertext
+    return nonce + aesgcm.encrypt(nonce, plaintext, associated_data)
 
 
-def decrypt_chunk(key: bytes, data: bytes) -> bytes:
+def decrypt_chunk(
+    key: bytes, data: bytes, associated_data: bytes | None = None
+) -> bytes:
     """
     Decrypt a data chunk encrypted with AES-256-GCM.
 
-    Expects: nonce (12 bytes) || ciphertext || tag (16 bytes)
+    Expects: nonce (12 bytes) || ciphertext || tag (16 bytes). ``data``
+    may be any bytes-like object; it is sliced through a memoryview so
+    the ciphertext is handed to the cipher without an intermediate copy.
     """
-    nonce = data[:NONCE_SIZE]
-    ciphertext = data[NONCE_SIZE:]
+    view = memoryview(data)
     aesgcm = AESGCM(key)
-    return aesgcm.decrypt(nonce, ciphertext, None)
+    return aesgcm.decrypt(view[:NONCE_SIZE], view[NONCE_SIZE:], associated_data)
+
+
+class SequenceError(ValueError):
+    """A chunk arrived with a sequence number other than the expected one."""
+
+
+class SessionCipher:
+    """
+    AEAD context for one session, created once per handshake with the
+    negotiated suite.
+
+    Nonces are deterministic rather than random: a 4-byte prefix holding
+    the sending direction and the stream ID, followed by an 8-byte
+    per-stream sequence number. Within a session every (direction, stream,
+    sequence) triple is used exactly once, so nonces never repeat under
+    the key, and the receiver accepts only the next sequence number on each
+    stream, rejecting replayed, dropped or reordered frames before any
+    decryption work is spent on them.
+
+    Sequence numbers are reserved and checked on the event loop; encrypt()
+    and decrypt() themselves keep no state and are safe to run in worker
+    threads.
+    """
+
+    SEQUENCE_FORMAT = "!Q"
+    SEQUENCE_SIZE = struct.calcsize(SEQUENCE_FORMAT)
+
+    def __init__(self, key: bytes, initiator: bool, suite: str = AES_256_GCM):
+        self.suite = suite
+        self._aead = CIPHER_SUITES[suite](key)
+        self._send_direction = 0 if initiator else 1
+        self._send_seq: dict[int, int] = {}
+        self._recv_seq: dict[int, int] = {}
+
+    def next_send_seq(self, stream_id: int) -> int:
+        """Reserve the sequence number for the next chunk sent on a stream."""
+        seq = self._send_seq.get(stream_id, 0)
+        self._send_seq[stream_id] = seq + 1
+        return seq
+
+    def accept_recv_seq(self, stream_id: int, seq: int) -> None:
+        """Consume the next expected sequence number on a stream, or raise SequenceError."""
+        expected = self._recv_seq.get(stream_id, 0)
+        if seq != expected:
+            raise SequenceError(f"Expected chunk {expected} on stream {stream_id}, got {seq}")
+        self._recv_seq[stream_id] = expected + 1
+
+    def forget(self, stream_id: int) -> None:
+        """Drop the counters of a finished stream."""
+        self._send_seq.pop(stream_id, None)
+        self._recv_seq.pop(stream_id, None)
+
+    def encrypt(
+        self, stream_id: int, seq: int, plaintext: bytes, associated_data: bytes | None = None
+    ) -> bytes:
+        """Returns: ciphertext || tag (16 bytes). The nonce is implied by stream and seq."""
+        nonce = self._nonce(self._send_direction, stream_id, seq)
+        return self._aead.encrypt(nonce, plaintext, associated_data)
+
+    def decrypt(
+        self, stream_id: int, seq: int, data: bytes, associated_data: bytes | None = None
+    ) -> bytes:
+        """Decrypt a chunk the peer sent on ``stream_id`` with sequence number ``seq``."""
+        nonce = self._nonce(1 - self._send_direction, stream_id, seq)
+        return self._aead.decrypt(nonce, data, associated_data)
+
+    def decrypt_into(
+        self, stream_id: int, seq: int, data: bytes, out: bytearray,
+        associated_data: bytes | None = None,
+    ) -> memoryview | bytes:
+        """
+        Like decrypt(), but writes the plaintext into ``out`` (at least
+        ``len(data) - 16`` bytes) and returns a view of it.
+
+        Falls back to returning a new bytes object on cryptography
+        releases without decrypt_into.
+        """
+        if not _HAS_DECRYPT_INTO:
+            return self.decrypt(stream_id, seq, data, associated_data)
+        nonce = self._nonce(1 - self._send_direction, stream_id, seq)
+        plaintext = memoryview(out)[:len(data) - TAG_SIZE]
+        self._aead.decrypt_into(nonce, data, associated_data, plaintext)
+        return plaintext
+
+    @staticmethod
+    def _nonce(direction: int, stream_id: int, seq: int) -> bytes:
+        if not 0 <= stream_id < 1 << 31:
+            raise ValueError(f"Stream ID {stream_id} out of nonce range")
+        return struct.pack("!IQ", direction << 31 | stream_id, seq)
+
+
+def compute_join_tag(key: bytes, transfer_id: str, stripe_index: int) -> bytes:
+    """
+    HMAC-SHA256 proving that an additional connection belongs to an
+    already-authenticated transfer.
+
+    The tag is keyed with the control connection's session key, so only
+    the peer that completed that handshake can attach extra stripes.
+    """
+    message = f"{transfer_id}:{stripe_index}".encode("utf-8")
+    return hmac.new(key, message, hashlib.sha256).digest()
+
+
+def verify_join_tag(
+    key: bytes, transfer_id: str, stripe_index: int, tag: bytes
+) -> bool:
+    """Constant-time check of a tag produced by compute_join_tag."""
+    expected = compute_join_tag(key, transfer_id, stripe_index)
+    return hmac.compare_digest(expected, tag)
@@ -0,0 +1,146 @@
+"""Block-hash resume sends exactly the blocks that differ, and the file digest catches the rest."""
+
+import asyncio
+import os
+import uuid
+
+from transfer import service
+from transfer.delta import MIN_BLOCK_SIZE, FileDigest, hash_blocks, plan_spans
+from transfer.models import TransferDirection, TransferInfo, TransferState
+from transfer.session import PeerSession, SessionPool, start_session_server
+
+BLOCK = MIN_BLOCK_SIZE
+
+
+def _write(path, data: bytes) -> str:
+    with open(path, "wb") as f:
+        f.write(data)
+    return str(path)
+
+
+def _plan(tmp_path, sender: bytes, receiver: bytes) -> list[tuple[int, int]]:
+    source = _write(tmp_path / "source", sender)
+    partial = _write(tmp_path / "partial", receiver)
+    length = len(receiver)
+    return plan_spans(
+        hash_blocks(source, length, BLOCK), hash_blocks(partial, length, BLOCK),
+        BLOCK, length, len(sender),
+    )
+
+
+def test_only_mismatched_blocks_and_the_tail_are_sent(tmp_path):
+    sender = os.urandom(5 * BLOCK + BLOCK // 2)
+    # The receiver has the first four blocks, the second of them damaged
+    receiver = bytearray(sender[:4 * BLOCK])
+    receiver[BLOCK + 10] ^= 0xFF
+    spans = _plan(tmp_path, sender, bytes(receiver))
+    assert spans == [(BLOCK, 2 * BLOCK), (4 * BLOCK, len(sender))]
+
+    # Sending just those spans rebuilds the sender's file
+    for start, end in spans:
+        receiver[start:end] = sender[start:end]
+    assert bytes(receiver) == sender
+
+
+def test_block_cut_short_by_the_partial_file_is_sent_whole(tmp_path):
+    sender = os.urandom(4 * BLOCK)
+    spans = _plan(tmp_path, sender, sender[:2 * BLOCK + 100])
+    assert spans == [(2 * BLOCK, len(sender))]
+
+
+def test_identical_file_sends_nothing(tmp_path):
+    sender = os.urandom(3 * BLOCK + 7)
+    assert _plan(tmp_path, sender, sender) == []
+
+
+def test_unrelated_file_is_sent_in_full(tmp_path):
+    sender = os.urandom(3 * BLOCK)
+    assert _plan(tmp_path, sender, os.urandom(3 * BLOCK)) == [(0, len(sender))]
+
+
+def test_digest_is_independent_of_chunk_order():
+    data = os.urandom(4 * BLOCK + 123)
+    in_order = FileDigest(len(data), BLOCK)
+    in_order.update(0, data)
+    # Two stripes, each feeding whole blocks in order, interleaved
+    striped = FileDigest(len(data), BLOCK)
+    for start in (2 * BLOCK, 0, 3 * BLOCK, BLOCK, 4 * BLOCK):
+        striped.update(start, data[start:start + BLOCK])
+    assert in_order.root() is not None
+    assert striped.root() == in_order.root()
+
+
+def test_digest_notices_a_gap_or_a_changed_byte():
+    data = os.urandom(2 * BLOCK)
+    expected = FileDigest(len(data), BLOCK)
+    expected.update(0, data)
+
+    gap = FileDigest(len(data), BLOCK)
+    gap.update(0, data[:100])
+    gap.update(200, data[200:])  # Bytes 100..200 never arrived
+    assert gap.root() is None
+
+    changed = bytearray(data)
+    changed[BLOCK + 5] ^= 1
+    damaged = FileDigest(len(data), BLOCK)
+    damaged.update(0, changed)
+    assert damaged.root() not in (None, expected.root())
+
+
+async def _noop(info: TransferInfo) -> None:
+    pass
+
+
+async def _accept(info: TransferInfo) -> bool:
+    return True
+
+
+async def _send_over_loopback(source: str, save_dir: str) -> tuple[TransferInfo, TransferInfo]:
+    """Send ``source`` to a local receiver; returns the sender's and the receiver's TransferInfo."""
+    received = asyncio.get_running_loop().create_future()
+
+    async def on_stream(stream):
+        received.set_result(await service.receive_file(stream, save_dir, _accept, _noop, _noop))
+
+    async def handler(conn):
+        session = await PeerSession.accept(conn)
+        session.start(on_stream)
+
+    server = await start_session_server(handler, "127.0.0.1", 0)
+    pool = SessionPool()
+    info = TransferInfo(
+        transfer_id=str(uuid.uuid4()), file_name=os.path.basename(source), file_size=os.path.getsize(source),
+        direction=TransferDirection.SENDING, peer_device_id="peer", peer_device_name="peer",
+    )
+    try:
+        await service.send_file(pool, "127.0.0.1", server.sockets[0].getsockname()[1], source, info, _noop, _noop)
+        return info, await asyncio.wait_for(received, 10)
+    finally:
+        await pool.close()
+        server.close()
+
+
+def test_digest_mismatch_fails_the_transfer(tmp_path, monkeypatch):
+    source = _write(tmp_path / "source.bin", os.urandom(3 * 1024 * 1024))
+    save_dir = tmp_path / "received"
+    save_dir.mkdir()
+    write_chunk = service._write_chunk
+    damaged = []
+
+    def damage_first_chunk(target, digest, data, offset):
+        # Written and hashed as received, as a flipped bit on disk would be
+        if not damaged:
+            damaged.append(offset)
+            data = bytearray(data)
+            data[0] ^= 1
+        write_chunk(target, digest, data, offset)
+
+    monkeypatch.setattr(service, "_write_chunk", damage_first_chunk)
+    sent, received = asyncio.run(_send_over_loopback(source, str(save_dir)))
+
+    assert damaged
+    assert received.state == TransferState.FAILED
+    assert "digest mismatch" in received.error_message
+    assert sent.state == TransferState.FAILED
+    # The damaged data never takes the file's real name
+    assert not (save_dir / "source.bin").exists()
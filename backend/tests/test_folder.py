@@ -0,0 +1,47 @@
+"""Folder state reaches member files, including ones that start late."""
+
+import asyncio
+
+from transfer.folder import FolderProgress
+from transfer.models import TransferDirection, TransferInfo, TransferState
+
+
+def _info(transfer_id: str, state: TransferState) -> TransferInfo:
+    return TransferInfo(
+        transfer_id=transfer_id,
+        file_name=transfer_id,
+        file_size=1024,
+        state=state,
+        direction=TransferDirection.SENDING,
+        peer_device_id="peer",
+        peer_device_name="peer",
+    )
+
+
+async def _no_progress(byte_count: int) -> None:
+    pass
+
+
+async def _pause_while_member_connects() -> None:
+    folder_info = _info("folder", TransferState.TRANSFERRING)
+    folder = FolderProgress(folder_info, _no_progress)
+    member = _info("member", TransferState.CONNECTING)
+    await folder.on_state(member)
+
+    # Paused before the member moves any data: the pause can't reach it yet
+    folder_info.state = TransferState.PAUSED
+    folder.mirror(folder_info.state)
+    assert member.state == TransferState.CONNECTING
+
+    # Once it is ready to send, it joins the pause instead of sending
+    member.state = TransferState.TRANSFERRING
+    await folder.on_state(member)
+    assert member.state == TransferState.PAUSED
+
+    folder_info.state = TransferState.TRANSFERRING
+    folder.mirror(folder_info.state)
+    assert member.state == TransferState.TRANSFERRING
+
+
+def test_pause_reaches_a_member_still_connecting():
+    asyncio.run(_pause_while_member_connects())
@@ -0,0 +1,112 @@
+"""A PACKED frame is only written if every file in it is in the manifest and matches its digest."""
+
+import asyncio
+import os
+import struct
+
+import pytest
+
+from security.crypto import SessionCipher
+from transfer import service
+from transfer.folder import PACK_HEADER_FORMAT, pack_files
+
+STREAM_ID = 1
+SIZES = {"a.txt": 10, "docs/b.txt": 20}
+
+
+class _Progress:
+    def __init__(self):
+        self.files = 0
+
+    async def add_packed(self, file_count: int, byte_count: int) -> None:
+        self.files += file_count
+
+
+class _Stream:
+    def __init__(self, cipher: SessionCipher):
+        self.stream_id = STREAM_ID
+        self.session = type("Session", (), {"cipher": cipher})()
+
+
+class _Peer:
+    """Both ends of one stream's encryption."""
+
+    def __init__(self):
+        key = os.urandom(32)
+        self.sender = SessionCipher(key, initiator=True)
+        self.receiver = _Stream(SessionCipher(key, initiator=False))
+
+    def frame(self, body: bytes, count: int) -> bytes:
+        header = struct.pack(PACK_HEADER_FORMAT, count)
+        seq = self.sender.next_send_seq(STREAM_ID)
+        ciphertext = self.sender.encrypt(STREAM_ID, seq, body, header)
+        return header + struct.pack(SessionCipher.SEQUENCE_FORMAT, seq) + ciphertext
+
+
+def _source(tmp_path, sizes: dict[str, int]) -> str:
+    root = tmp_path / "source"
+    for relative, size in sizes.items():
+        path = root / relative
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(os.urandom(size))
+    return str(root)
+
+
+def _receive(tmp_path, peer: _Peer, frames: list[bytes]) -> tuple[str, _Progress]:
+    root = tmp_path / "received"
+    (root / "docs").mkdir(parents=True)
+    progress = _Progress()
+    group = service._FolderGroup(None, str(root), dict(SIZES), progress)
+
+    async def run():
+        for frame in frames:
+            await service._receive_packed(peer.receiver, group, frame)
+
+    asyncio.run(run())
+    return str(root), progress
+
+
+def test_files_in_the_manifest_are_written(tmp_path):
+    source = _source(tmp_path, SIZES)
+    peer = _Peer()
+    body, packed, _ = pack_files(source, list(SIZES.items()))
+    root, progress = _receive(tmp_path, peer, [peer.frame(body, len(packed))])
+    assert progress.files == 2
+    for relative in SIZES:
+        with open(os.path.join(source, relative), "rb") as f, open(os.path.join(root, relative), "rb") as g:
+            assert f.read() == g.read()
+
+
+@pytest.mark.parametrize("sizes", [
+    {"c.txt": 10},  # Not in the manifest
+    {"a.txt": 11},  # Another size than the manifest lists
+])
+def test_files_outside_the_manifest_are_rejected(tmp_path, sizes):
+    source = _source(tmp_path, sizes)
+    peer = _Peer()
+    body, packed, _ = pack_files(source, list(sizes.items()))
+    with pytest.raises(ConnectionError, match="not in the folder's manifest"):
+        _receive(tmp_path, peer, [peer.frame(body, len(packed))])
+    assert not os.listdir(tmp_path / "received" / "docs")
+    assert os.listdir(tmp_path / "received") == ["docs"]
+
+
+def test_a_file_is_accepted_only_once(tmp_path):
+    source = _source(tmp_path, SIZES)
+    peer = _Peer()
+    body, packed, _ = pack_files(source, [("a.txt", 10)])
+    with pytest.raises(ConnectionError, match="not in the folder's manifest"):
+        _receive(tmp_path, peer, [peer.frame(body, len(packed)), peer.frame(body, len(packed))])
+
+
+def test_file_not_matching_its_digest_is_rejected(tmp_path):
+    source = _source(tmp_path, SIZES)
+    peer = _Peer()
+    body, packed, _ = pack_files(source, list(SIZES.items()))
+    # The sender's digest, but other data: caught after decryption succeeds
+    body = body[:-1] + bytes([body[-1] ^ 1])
+    with pytest.raises(RuntimeError, match="digest mismatch"):
+        _receive(tmp_path, peer, [peer.frame(body, len(packed))])
+    # Nothing of the frame is written, not even its intact files
+    assert not os.path.exists(tmp_path / "received" / "a.txt")
+    assert not os.listdir(tmp_path / "received" / "docs")
@@ -0,0 +1,60 @@
+"""Rate limits stacked at several levels must not slow each other down."""
+
+import asyncio
+import time
+
+from transfer.ratelimit import RateLimiter
+
+RATE = 8 * 1024 * 1024  # bytes/s
+CHUNK = 2 * 1024 * 1024  # Larger than a bucket's burst, like real chunks
+TOTAL = 8 * 1024 * 1024
+
+
+async def _send_rate(global_rate: int, peer_rate: int, transfer_rate: int) -> float:
+    limiter = RateLimiter()
+    limiter.configure(global_rate=global_rate, peer_rate=peer_rate, transfer_rate=transfer_rate, background=False)
+    limit = limiter.for_transfer("transfer", "peer")
+    started = time.monotonic()
+    for _ in range(TOTAL // CHUNK):
+        await limit.consume(CHUNK)
+    return TOTAL / (time.monotonic() - started)
+
+
+def test_stacked_equal_limits_give_the_single_limit_rate():
+    single = asyncio.run(_send_rate(RATE, 0, 0))
+    double = asyncio.run(_send_rate(RATE, RATE, 0))
+    triple = asyncio.run(_send_rate(RATE, RATE, RATE))
+    # Each bucket starts with a small burst, so the rate is a little over the limit
+    assert RATE * 0.9 < single < RATE * 1.25
+    assert abs(double - single) < single * 0.1
+    assert abs(triple - single) < single * 0.1
+
+
+def test_unlimited_background_transfer_backs_off_from_its_send_rate():
+    limiter = RateLimiter()
+    limiter.configure(global_rate=0, peer_rate=0, transfer_rate=0, background=True)
+    limit = limiter.for_transfer("transfer", "peer")
+    limit.observe_rtt(0.01)  # Base delay
+    assert not limit.limited
+
+    started = time.monotonic()
+    time.sleep(0.5)
+    limit.record_sent(RATE // 2)
+    measured = (RATE // 2) / (time.monotonic() - started)
+    limit.observe_rtt(0.01 + 0.1)  # Queuing delay well over the target
+
+    assert abs(limit._background_bucket.rate - measured * 0.7) < measured * 0.07
+
+
+def test_background_ignores_delay_behind_its_own_backlog():
+    limiter = RateLimiter()
+    limiter.configure(global_rate=0, peer_rate=0, transfer_rate=0, background=True)
+    limit = limiter.for_transfer("transfer", "peer")
+    limit.observe_rtt(0.01)
+
+    time.sleep(0.5)
+    limit.record_sent(RATE // 2)
+    # The PING waited ~100 ms behind the transfer's own queued chunks
+    limit.observe_rtt(0.01 + 0.1, backlog=RATE // 10)
+
+    assert not limit.limited
@@ -0,0 +1,96 @@
+"""A receiver hands an interrupted transfer back only to its own sender, and only within RECONNECT_WINDOW."""
+
+import asyncio
+
+from transfer import service
+from transfer.models import FileMetadata, TransferDirection, TransferInfo, TransferState
+
+TRANSFER_ID = "transfer"
+
+
+class _Session:
+    def __init__(self, peer_public_key: str = "sender-key"):
+        self.peer_public_key = peer_public_key
+        self.closed_with: Exception | None = None
+        self.on_close = None
+
+    def close(self, error: Exception | None = None) -> None:
+        self.closed_with = error
+        if self.on_close:
+            self.on_close()
+
+
+def _metadata(device_id: str = "sender") -> FileMetadata:
+    return FileMetadata(
+        transfer_id=TRANSFER_ID, file_name="f", file_size=1,
+        sender_device_id=device_id, sender_device_name="sender",
+    )
+
+
+async def _noop(info: TransferInfo) -> None:
+    pass
+
+
+async def _held(tmp_path, released: bool = True) -> tuple[service._Resumable, TransferInfo, _Session]:
+    """A transfer accepted on one session, lost and held for its sender."""
+    old = _Session()
+    resumable = service._Resumable(old, _metadata(), str(tmp_path / "f"))
+    info = TransferInfo(
+        transfer_id=TRANSFER_ID, file_name="f", file_size=1, direction=TransferDirection.RECEIVING,
+        peer_device_id="sender", peer_device_name="sender", state=TransferState.TRANSFERRING,
+    )
+    service._resumables[TRANSFER_ID] = resumable
+    if released:
+        await service._hold_for_reconnect(TRANSFER_ID, resumable, info, _noop)
+        resumable.released.set()
+    return resumable, info, old
+
+
+async def _taken_over_by_its_sender(tmp_path) -> None:
+    resumable, info, _ = await _held(tmp_path)
+    # Someone else, or the same device under another identity, can't take it
+    assert await service._take_over(_Session("other-key"), _metadata()) is None
+    assert await service._take_over(_Session(), _metadata("other-device")) is None
+    assert service._resumables[TRANSFER_ID] is resumable
+
+    assert await service._take_over(_Session(), _metadata()) is resumable
+    assert TRANSFER_ID not in service._resumables
+    # Taken over in time: the window no longer fails it
+    await asyncio.sleep(0.3)
+    assert info.state == TransferState.RECONNECTING
+
+
+async def _expires_after_the_window(tmp_path) -> None:
+    _, info, _ = await _held(tmp_path)
+    await asyncio.sleep(0.3)
+    assert info.state == TransferState.FAILED
+    assert await service._take_over(_Session(), _metadata()) is None
+
+
+async def _drops_the_stale_session(tmp_path) -> None:
+    # The sender noticed the dead connection before we did
+    resumable, _, old = await _held(tmp_path, released=False)
+    old.on_close = resumable.released.set
+    assert await service._take_over(_Session(), _metadata()) is resumable
+    assert isinstance(old.closed_with, ConnectionError)
+
+
+def _run(coro) -> None:
+    try:
+        asyncio.run(coro)
+    finally:
+        service._resumables.pop(TRANSFER_ID, None)
+
+
+def test_taken_over_by_its_sender(tmp_path, monkeypatch):
+    monkeypatch.setattr(service, "RECONNECT_WINDOW", 0.1)
+    _run(_taken_over_by_its_sender(tmp_path))
+
+
+def test_expires_after_the_window(tmp_path, monkeypatch):
+    monkeypatch.setattr(service, "RECONNECT_WINDOW", 0.1)
+    _run(_expires_after_the_window(tmp_path))
+
+
+def test_reconnect_drops_the_stale_session(tmp_path):
+    _run(_drops_the_stale_session(tmp_path))
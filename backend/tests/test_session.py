@@ -0,0 +1,130 @@
+"""Streams of one session are independent: their messages, errors and stalls stay their own."""
+
+import asyncio
+
+import transfer.session as session_module
+from config import STREAM_QUEUE_DEPTH
+from transfer.models import MessageType
+from transfer.session import PeerSession, start_session_server
+
+CHUNK = b"x" * 65536
+
+
+async def _serve(on_stream) -> tuple[asyncio.Server, PeerSession]:
+    """A session to a local server that runs ``on_stream`` for every stream we open."""
+    async def handler(conn):
+        accepted = await PeerSession.accept(conn)
+        accepted.start(on_stream)
+
+    server = await start_session_server(handler, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    return server, await PeerSession.connect("127.0.0.1", port)
+
+
+async def _echo_until_failed(stream) -> None:
+    """Echo each message back; a b"fail" aborts the stream with an ERROR."""
+    while True:
+        msg_type, payload = await stream.recv()
+        if payload == b"fail":
+            await stream.send(MessageType.ERROR, b"failed on purpose")
+            stream.close()
+            return
+        await stream.send(msg_type, payload)
+
+
+async def _streams_are_isolated() -> None:
+    server, session = await _serve(_echo_until_failed)
+    try:
+        first, second = session.open_stream(), session.open_stream()
+        await first.send(MessageType.METADATA, b"1")
+        await second.send(MessageType.METADATA, b"2")
+        await first.send(MessageType.METADATA, b"fail")
+        await second.send(MessageType.METADATA, b"3")
+
+        assert await asyncio.wait_for(first.recv(), 2) == (MessageType.METADATA, b"1")
+        assert await asyncio.wait_for(first.recv(), 2) == (MessageType.ERROR, b"failed on purpose")
+        assert await asyncio.wait_for(second.recv(), 2) == (MessageType.METADATA, b"2")
+        assert await asyncio.wait_for(second.recv(), 2) == (MessageType.METADATA, b"3")
+
+        # Late frames for the aborted stream are dropped; the session carries on
+        await first.send(MessageType.DATA_CHUNK, CHUNK)
+        await second.send(MessageType.METADATA, b"4")
+        assert await asyncio.wait_for(second.recv(), 2) == (MessageType.METADATA, b"4")
+        assert not session.is_closed
+        assert session.active_streams == 2
+    finally:
+        session.close()
+        server.close()
+
+
+async def _stalled_stream_session():
+    streams: list = []
+
+    async def on_stream(stream):
+        streams.append(stream)
+        if len(streams) == 1:
+            return  # Never reads its data
+        while True:
+            msg_type, payload = await stream.recv()
+            await stream.send(msg_type, payload)
+
+    server, session = await _serve(on_stream)
+    stalled = session.open_stream()
+    for _ in range(STREAM_QUEUE_DEPTH):
+        await stalled.send(MessageType.DATA_CHUNK, CHUNK)
+    return server, session, stalled
+
+
+async def _stalled_stream_blocks_only_itself() -> None:
+    server, session, stalled = await _stalled_stream_session()
+    try:
+        # Out of credit: the next chunk waits for a consumer that never comes
+        assert not stalled.has_credit
+        assert session.peer_credit == STREAM_QUEUE_DEPTH
+        try:
+            await asyncio.wait_for(stalled.send(MessageType.DATA_CHUNK, CHUNK), 0.5)
+            raise AssertionError("Sent past the receiver's credit")
+        except asyncio.TimeoutError:
+            pass
+
+        # Other streams and the control stream still get through
+        other = session.open_stream()
+        await other.send(MessageType.TUNE, b"ping")
+        assert await asyncio.wait_for(other.recv(), 2) == (MessageType.TUNE, b"ping")
+        assert await session.ping(timeout=2) < 2
+    finally:
+        session.close()
+        server.close()
+
+
+async def _stalled_stream_keeps_session_alive() -> None:
+    server, session, stalled = await _stalled_stream_session()
+
+    async def keep_sending():
+        while True:
+            await stalled.send(MessageType.DATA_CHUNK, CHUNK)
+
+    sender = asyncio.create_task(keep_sending())
+    try:
+        # Far longer than HEARTBEAT_TIMEOUT with the stream's queue full
+        await asyncio.sleep(2)
+        assert not session.is_closed
+        assert await session.ping(timeout=1) < 1
+    finally:
+        sender.cancel()
+        session.close()
+        server.close()
+
+
+def test_streams_are_isolated():
+    asyncio.run(_streams_are_isolated())
+
+
+def test_stalled_stream_blocks_only_itself():
+    asyncio.run(_stalled_stream_blocks_only_itself())
+
+
+def test_stalled_stream_keeps_session_alive(monkeypatch):
+    monkeypatch.setattr(session_module, "HEARTBEAT_INTERVAL", 0.2)
+    monkeypatch.setattr(session_module, "HEARTBEAT_TIMEOUT", 1)
+    asyncio.run(_stalled_stream_keeps_session_alive())
@@ -0,0 +1,62 @@
+"""Extra stripes must prove they belong to the transfer they join."""
+
+import asyncio
+import json
+import os
+
+from security.crypto import compute_join_tag, verify_join_tag
+from transfer import service
+from transfer.models import MessageType, TransferDirection, TransferInfo
+
+TRANSFER_ID = "transfer"
+
+
+class _Stream:
+    def __init__(self):
+        self.sent: list[int] = []
+
+    async def send(self, msg_type: int, *parts: bytes) -> None:
+        self.sent.append(msg_type)
+
+
+def _join(key: bytes, transfer_id: str, stripe: int, tagged_stripe: int | None = None) -> bytes:
+    tag = compute_join_tag(key, transfer_id, stripe if tagged_stripe is None else tagged_stripe)
+    return json.dumps({"transfer_id": transfer_id, "stripe": stripe, "tag": tag.hex()}).encode()
+
+
+async def _forged_joins_are_rejected() -> None:
+    key = os.urandom(32)
+    info = TransferInfo(
+        transfer_id=TRANSFER_ID, file_name="f", file_size=1, direction=TransferDirection.RECEIVING,
+        peer_device_id="peer", peer_device_name="peer",
+    )
+    group = service._StripeGroup(info, key, 3, None, None)
+    service._stripe_groups[TRANSFER_ID] = group
+    try:
+        forged = [
+            _join(os.urandom(32), TRANSFER_ID, 1),  # Another session's key
+            _join(key, TRANSFER_ID, 2, tagged_stripe=1),  # Tag for another stripe
+            _join(key, "other", 1),  # Unknown transfer
+        ]
+        for join in forged:
+            stream = _Stream()
+            await service._join_stripe(stream, join, None)
+            assert stream.sent == [MessageType.REJECT]
+        # None of them took the stripe's slot
+        assert group.claim(1)
+        assert not group.claim(1)
+    finally:
+        service._stripe_groups.pop(TRANSFER_ID, None)
+
+
+def test_join_tag_is_bound_to_key_transfer_and_stripe():
+    key = os.urandom(32)
+    tag = compute_join_tag(key, TRANSFER_ID, 1)
+    assert verify_join_tag(key, TRANSFER_ID, 1, tag)
+    assert not verify_join_tag(os.urandom(32), TRANSFER_ID, 1, tag)
+    assert not verify_join_tag(key, "other", 1, tag)
+    assert not verify_join_tag(key, TRANSFER_ID, 2, tag)
+
+
+def test_forged_stripe_joins_are_rejected():
+    asyncio.run(_forged_joins_are_rejected())
@@ -0,0 +1,206 @@
+"""
+Optional per-chunk compression.
+
+Peers advertise the codecs they support in SESSION_HELLO; the sender
+uses the fastest codec both sides have. zlib is always available;
+zstandard and lz4 are used when installed.
+
+Each chunk is compressed on its own and marked with the codec that was
+applied, so chunks that would not shrink (already-compressed media,
+encrypted archives) are sent raw. A cheap entropy estimate over a few
+samples of the chunk decides whether compressing is worth trying at all.
+"""
+
+import logging
+import math
+import time
+import zlib
+from collections import Counter
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.block as lz4_block
+except ImportError:
+    lz4_block = None
+
+from transfer.models import TransferInfo
+
+logger = logging.getLogger(__name__)
+
+# Codec ID carried in every DATA_CHUNK header for uncompressed chunks
+RAW = 0
+
+# Entropy sampling: a few windows spread over the chunk
+SAMPLE_COUNT = 4
+SAMPLE_SIZE = 4096
+# Bits per byte above which a chunk is treated as incompressible
+MAX_ENTROPY_BITS = 7.5
+# Keep the compressed form only if it saves at least this fraction
+MIN_SAVINGS = 0.05
+
+
+def _check_limit(max_size: int) -> None:
+    if max_size <= 0:
+        raise ValueError(f"Invalid decompression limit {max_size}")
+
+
+class Codec:
+    """A compression codec that can be negotiated with a peer."""
+
+    codec_id: int
+    name: str
+
+    def compress(self, data: bytes) -> bytes:
+        raise NotImplementedError
+
+    def decompress(self, data: bytes, max_size: int) -> bytes:
+        """
+        Decompress, refusing output larger than ``max_size`` bytes.
+        Raises ValueError unless ``max_size`` is positive.
+        """
+        raise NotImplementedError
+
+
+class ZlibCodec(Codec):
+    codec_id = 1
+    name = "zlib"
+
+    def compress(self, data: bytes) -> bytes:
+        return zlib.compress(data, 1)
+
+    def decompress(self, data: bytes, max_size: int) -> bytes:
+        # zlib reads a max_length of 0 as "no limit"
+        _check_limit(max_size)
+        decompressor = zlib.decompressobj()
+        out = decompressor.decompress(data, max_size)
+        if decompressor.unconsumed_tail or not decompressor.eof:
+            raise ValueError("Decompressed chunk is truncated or too large")
+        return out
+
+
+class Lz4Codec(Codec):
+    codec_id = 2
+    name = "lz4"
+
+    def compress(self, data: bytes) -> bytes:
+        return lz4_block.compress(data, store_size=True)
+
+    def decompress(self, data: bytes, max_size: int) -> bytes:
+        _check_limit(max_size)
+        size = int.from_bytes(bytes(data[:4]), "little")
+        if size > max_size:
+            raise ValueError("Decompressed chunk too large")
+        return lz4_block.decompress(data)
+
+
+class ZstdCodec(Codec):
+    codec_id = 3
+    name = "zstd"
+
+    def compress(self, data: bytes) -> bytes:
+        # Compressor objects are not thread-safe; they are cheap to create
+        return zstandard.ZstdCompressor(level=1).compress(data)
+
+    def decompress(self, data: bytes, max_size: int) -> bytes:
+        _check_limit(max_size)
+        size = zstandard.frame_content_size(data)
+        if size < 0 or size > max_size:
+            raise ValueError("Decompressed chunk size missing or too large")
+        return zstandard.ZstdDecompressor().decompress(data)
+
+
+# In order of preference: fastest first
+CODECS: list[Codec] = [
+    codec
+    for codec, available in (
+        (ZstdCodec(), zstandard is not None),
+        (Lz4Codec(), lz4_block is not None),
+        (ZlibCodec(), True),
+    )
+    if available
+]
+_CODECS_BY_ID = {codec.codec_id: codec for codec in CODECS}
+
+
+def supported_codecs() -> list[str]:
+    """Codec names to advertise in SESSION_HELLO."""
+    return [codec.name for codec in CODECS]
+
+
+def choose_codec(peer_codecs: list[str]) -> Codec | None:
+    """The preferred codec the peer also supports, or None."""
+    for codec in CODECS:
+        if codec.name in peer_codecs:
+            return codec
+    return None
+
+
+def get_codec(codec_id: int) -> Codec:
+    codec = _CODECS_BY_ID.get(codec_id)
+    if codec is None:
+        raise ValueError(f"Unsupported codec {codec_id}")
+    return codec
+
+
+def looks_compressible(data: bytes) -> bool:
+    """Estimate Shannon entropy from a few samples spread over ``data``."""
+    if len(data) <= SAMPLE_COUNT * SAMPLE_SIZE:
+        samples = [data]
+    else:
+        step = len(data) // SAMPLE_COUNT
+        samples = [data[i * step:i * step + SAMPLE_SIZE] for i in range(SAMPLE_COUNT)]
+
+    counts = Counter()
+    total = 0
+    for sample in samples:
+        counts.update(sample)
+        total += len(sample)
+    if not total:
+        return False
+    entropy = -sum(n / total * math.log2(n / total) for n in counts.values())
+    return entropy < MAX_ENTROPY_BITS
+
+
+def compress_chunk(codec: Codec, data: bytes) -> tuple[int, bytes, float]:
+    """
+    Compress one chunk if it is worth it. Runs in a worker thread.
+
+    Returns: (codec ID applied, payload, CPU seconds spent).
+    """
+    started = time.thread_time()
+    codec_id, payload = RAW, data
+    if looks_compressible(data):
+        compressed = codec.compress(data)
+        if len(compressed) <= len(data) * (1 - MIN_SAVINGS):
+            codec_id, payload = codec.codec_id, compressed
+    return codec_id, payload, time.thread_time() - started
+
+
+def decompress_chunk(codec_id: int, data: bytes, max_size: int) -> tuple[bytes, float]:
+    """Undo compress_chunk(). Returns: (plaintext, CPU seconds spent)."""
+    started = time.thread_time()
+    plaintext = get_codec(codec_id).decompress(data, max_size)
+    return plaintext, time.thread_time() - started
+
+
+class CompressionStats:
+    """Per-transfer ratio and CPU cost, reported through TransferInfo."""
+
+    def __init__(self, transfer_info: TransferInfo, codec_name: str):
+        self.transfer_info = transfer_info
+        self.raw_bytes = 0
+        self.wire_bytes = 0
+        self.cpu_seconds = 0.0
+        transfer_info.compression = codec_name
+
+    def record(self, raw_bytes: int, wire_bytes: int, cpu_seconds: float) -> None:
+        self.raw_bytes += raw_bytes
+        self.wire_bytes += wire_bytes
+        self.cpu_seconds += cpu_seconds
+        if self.wire_bytes:
+            self.transfer_info.compression_ratio = round(self.raw_bytes / self.wire_bytes, 3)
+        self.transfer_info.compression_cpu_seconds = round(self.cpu_seconds, 3)
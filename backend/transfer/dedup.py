@@ -0,0 +1,168 @@
+"""
+Content-addressed dedup of whole files.
+
+A persistent index maps file digests (see transfer.delta.FileDigest) to
+files on disk that are known to have that content: files this device
+received or sent with a verified digest. Each entry remembers the file's
+size and mtime when it was indexed, so a lookup is one indexed query plus
+a stat() instead of a directory scan, and files changed since are dropped
+from the index instead of being trusted.
+
+The sender looks its file up by path to reuse the digest of an unchanged
+file, and otherwise hashes it up front. The receiver looks the digest
+up, and on a hit links the existing file into place instead of
+transferring it.
+"""
+
+import logging
+import os
+import shutil
+import sqlite3
+import uuid
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from config import CONFIG_DIR
+
+logger = logging.getLogger(__name__)
+
+# Linux ioctl that makes one file share another's extents (Btrfs, XFS)
+_FICLONE = 0x40049409
+
+
+class ContentIndex:
+    def __init__(self, db_path: str = str(CONFIG_DIR / "content_index.db")):
+        self.db_path = db_path
+        self._init_db()
+
+    def _init_db(self):
+        """Creates the index table if it doesn't exist."""
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS content_index (
+                        path TEXT PRIMARY KEY,
+                        digest TEXT NOT NULL,
+                        size INTEGER,
+                        mtime_ns INTEGER
+                    )
+                """)
+                conn.execute("CREATE INDEX IF NOT EXISTS content_index_digest ON content_index (digest)")
+                conn.commit()
+        except Exception as e:
+            logger.error(f"Failed to initialize content index: {e}")
+
+    def add(self, path: str, digest: str) -> None:
+        """Record that ``path``, as it is on disk now, has content ``digest``."""
+        try:
+            st = os.stat(path)
+            with sqlite3.connect(self.db_path) as conn:
+                conn.execute("""
+                    INSERT OR REPLACE INTO content_index (path, digest, size, mtime_ns)
+                    VALUES (?, ?, ?, ?)
+                """, (os.path.abspath(path), digest, st.st_size, st.st_mtime_ns))
+                conn.commit()
+        except Exception as e:
+            logger.error(f"Failed to index {path}: {e}")
+
+    def digest_of(self, path: str) -> str | None:
+        """The digest of ``path`` if it is indexed and unchanged since."""
+        path = os.path.abspath(path)
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                row = conn.execute(
+                    "SELECT digest, size, mtime_ns FROM content_index WHERE path = ?", (path,)
+                ).fetchone()
+                if row is None:
+                    return None
+                if not self._unchanged(conn, path, row[1], row[2]):
+                    return None
+                return row[0]
+        except Exception as e:
+            logger.error(f"Content index lookup failed: {e}")
+            return None
+
+    def find(self, digest: str, size: int) -> str | None:
+        """A file on disk with content ``digest``, or None."""
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                rows = conn.execute(
+                    "SELECT path, size, mtime_ns FROM content_index WHERE digest = ?", (digest,)
+                ).fetchall()
+                for path, indexed_size, mtime_ns in rows:
+                    if indexed_size == size and self._unchanged(conn, path, indexed_size, mtime_ns):
+                        return path
+                return None
+        except Exception as e:
+            logger.error(f"Content index lookup failed: {e}")
+            return None
+
+    @staticmethod
+    def _unchanged(conn: sqlite3.Connection, path: str, size: int, mtime_ns: int) -> bool:
+        """Check an entry against the file; forget it if the file changed."""
+        try:
+            st = os.stat(path)
+            if st.st_size == size and st.st_mtime_ns == mtime_ns:
+                return True
+        except OSError:
+            pass
+        conn.execute("DELETE FROM content_index WHERE path = ?", (path,))
+        conn.commit()
+        return False
+
+
+def link_file(source: str, target: str) -> bool:
+    """
+    Make ``target`` a copy of ``source`` without copying its data.
+
+    Tries a copy-on-write reflink first, so the two files stay
+    independent, then a hardlink. Replaces any existing ``target``.
+    Returns False if the filesystem supports neither.
+    """
+    try:
+        if os.path.exists(target) and os.path.samefile(source, target):
+            return True
+    except OSError:
+        pass
+
+    directory, name = os.path.split(target)
+    temp_path = os.path.join(directory, f".{name}.{uuid.uuid4().hex[:8]}.link")
+    try:
+        if not _reflink(source, temp_path):
+            os.link(source, temp_path)
+        os.replace(temp_path, target)
+        return True
+    except OSError as e:
+        logger.info(f"Cannot link {source} to {target}: {e}")
+        try:
+            os.unlink(temp_path)
+        except OSError:
+            pass
+        return False
+
+
+def clone_file(source: str, target: str) -> None:
+    """
+    Copy ``source`` to a new ``target`` that can be modified on its own.
+
+    A copy-on-write reflink where the filesystem supports one, otherwise
+    a full copy.
+    """
+    if not _reflink(source, target):
+        shutil.copyfile(source, target)
+
+
+def _reflink(source: str, target: str) -> bool:
+    if fcntl is None or not hasattr(fcntl, "ioctl"):
+        return False
+    with open(source, "rb") as src, open(target, "wb") as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), _FICLONE, src.fileno())
+            return True
+        except OSError:
+            pass
+    os.unlink(target)
+    return False
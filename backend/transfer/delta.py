@@ -0,0 +1,212 @@
+"""
+Block hashes: verified resume and the end-to-end file digest.
+
+When a file with the same name already exists, the receiver hashes it in
+fixed-size blocks and sends the digests to the sender, which hashes the
+same blocks of its own copy. Only blocks whose digests differ, plus
+anything past the end of the existing file, are sent again. This both
+protects against resuming on top of an unrelated file or a torn write,
+and turns re-sending a slightly changed large file into a small delta.
+
+Both sides hash at the same time: the receiver announces how much it
+will hash in its ACCEPT payload, so the sender starts on its own copy
+while the receiver works.
+
+The same block digests are the leaves of a FileDigest, a two-level hash
+tree over the whole file. Both pipelines feed it the plaintext chunks
+they already hold in memory, so verifying the received file end to end
+costs no extra pass over the data.
+"""
+
+import hashlib
+import os
+import struct
+from concurrent.futures import ThreadPoolExecutor
+
+from config import RESUME_BLOCK_SIZE, STRIPE_UNIT
+
+# Block digests are SHA-256 truncated to 128 bits. hashlib's SHA-256 comes
+# from OpenSSL, which uses the CPU's SHA extensions where present; it ran
+# about 2.5x faster than hashlib's built-in BLAKE2b when measured with
+# `python benchmark.py digest`.
+DIGEST_SIZE = 16
+# At most this many digests per BLOCK_HASHES message (16 MB of digests)
+MAX_BLOCKS = 1048576
+# Smallest block size a peer may ask us to hash with
+MIN_BLOCK_SIZE = 65536
+
+_READ_SIZE = 1048576
+_MAX_WORKERS = 8
+
+
+def choose_block_size(length: int) -> int:
+    """RESUME_BLOCK_SIZE, doubled until ``length`` fits in MAX_BLOCKS blocks."""
+    block_size = RESUME_BLOCK_SIZE
+    while -(-length // block_size) > MAX_BLOCKS:
+        block_size *= 2
+    return block_size
+
+
+def block_count(length: int, block_size: int) -> int:
+    return -(-length // block_size)
+
+
+def _block_hash():
+    return hashlib.sha256()
+
+
+def _hash_range(path: str, first_block: int, last_block: int, block_size: int, length: int) -> bytes:
+    digests = []
+    buffer = bytearray(min(_READ_SIZE, block_size))
+    view = memoryview(buffer)
+    with open(path, "rb") as f:
+        f.seek(first_block * block_size)
+        for block in range(first_block, last_block):
+            digest = _block_hash()
+            remaining = min(block_size, length - block * block_size)
+            while remaining:
+                read = f.readinto(view[:min(len(buffer), remaining)])
+                if not read:
+                    break  # File shrank underneath us; the digest won't match
+                digest.update(view[:read])
+                remaining -= read
+            digests.append(digest.digest()[:DIGEST_SIZE])
+    return b"".join(digests)
+
+
+def hash_blocks(path: str, length: int, block_size: int) -> bytes:
+    """
+    Digests of the first ``length`` bytes of ``path``, block by block.
+
+    Blocks are split between several threads (hashlib releases the GIL),
+    so hashing keeps up with fast disks. Runs in a worker thread.
+    """
+    count = block_count(length, block_size)
+    if not count:
+        return b""
+    workers = max(1, min(_MAX_WORKERS, os.cpu_count() or 1, count))
+    per_worker = -(-count // workers)
+    ranges = [(start, min(start + per_worker, count)) for start in range(0, count, per_worker)]
+    with ThreadPoolExecutor(max_workers=len(ranges)) as pool:
+        parts = pool.map(
+            lambda r: _hash_range(path, r[0], r[1], block_size, length), ranges
+        )
+        return b"".join(parts)
+
+
+def fill_blocks(path: str, leaves: list[bytes | None], length: int, block_size: int) -> bytes:
+    """
+    ``leaves`` as block digests of the first ``length`` bytes of
+    ``path``, hashing from disk only the blocks whose leaf is None. Lets
+    a resumed transfer reuse the leaves it already built in memory. Runs
+    in a worker thread.
+    """
+    return b"".join(
+        leaf if leaf is not None else _hash_range(path, block, block + 1, block_size, length)
+        for block, leaf in enumerate(leaves)
+    )
+
+
+def plan_spans(
+    local: bytes,
+    remote: bytes,
+    block_size: int,
+    length: int,
+    file_size: int,
+) -> list[tuple[int, int]]:
+    """
+    Byte ranges the sender still has to send, as (start, end) spans.
+
+    Mismatched blocks of the first ``length`` bytes are merged into runs,
+    and everything from ``length`` to ``file_size`` is added. A block cut
+    short by ``length`` is always re-sent whole, so every span starts on a
+    block boundary and FileDigest sees whole blocks. Spans are at most
+    STRIPE_UNIT long (or one block), so they can be dealt out to stripes.
+    """
+    ranges: list[list[int]] = []
+    for block in range(block_count(length, block_size)):
+        start = block * block_size
+        digest = slice(block * DIGEST_SIZE, (block + 1) * DIGEST_SIZE)
+        short = start + block_size > length and length < file_size
+        if local[digest] == remote[digest] and not short:
+            continue
+        end = min(start + block_size, length)
+        if ranges and ranges[-1][1] == start:
+            ranges[-1][1] = end
+        else:
+            ranges.append([start, end])
+    if length < file_size:
+        if ranges and ranges[-1][1] == length:
+            ranges[-1][1] = file_size
+        else:
+            ranges.append([length, file_size])
+
+    span_size = max(STRIPE_UNIT, block_size)
+    spans = []
+    for start, end in ranges:
+        for span_start in range(start, end, span_size):
+            spans.append((span_start, min(span_start + span_size, end)))
+    return spans
+
+
+class FileDigest:
+    """
+    Two-level hash tree over a file, built from chunks in any order.
+
+    Leaves are the digests of each block, the same digests block-hash
+    resume compares; the root is SHA-256 over the file size, the block
+    size and every leaf in order. Leaves of blocks reused
+    in place are preloaded from the resume hashes.
+
+    Each block must be fed in order by one stripe, which holds because
+    spans start on block boundaries and a stripe sends its chunks in
+    order. A block fed with a gap (a skipped chunk) keeps its old leaf,
+    so the root no longer matches. ``update()`` runs in worker threads;
+    stripes never share a block.
+    """
+
+    def __init__(self, file_size: int, block_size: int, leaves: bytes = b""):
+        self.file_size = file_size
+        self.block_size = block_size
+        count = block_count(file_size, block_size)
+        self._leaves: list[bytes | None] = [None] * count
+        for block in range(min(count, len(leaves) // DIGEST_SIZE)):
+            self._leaves[block] = leaves[block * DIGEST_SIZE:(block + 1) * DIGEST_SIZE]
+        # Blocks being hashed: block -> (hash state, next expected offset)
+        self._partial: dict = {}
+
+    def update(self, offset: int, data) -> None:
+        """Feed the plaintext at ``offset``."""
+        view = memoryview(data)
+        while view:
+            block = offset // self.block_size
+            block_start = block * self.block_size
+            block_end = min(block_start + self.block_size, self.file_size)
+            piece = view[:block_end - offset]
+
+            state = self._partial.pop(block, None)
+            if state is None and offset == block_start:
+                state = (_block_hash(), offset)
+            if state is not None and state[1] == offset:
+                hasher = state[0]
+                hasher.update(piece)
+                if offset + len(piece) == block_end:
+                    self._leaves[block] = hasher.digest()[:DIGEST_SIZE]
+                else:
+                    self._partial[block] = (hasher, offset + len(piece))
+
+            offset += len(piece)
+            view = view[len(piece):]
+
+    def leaves(self, count: int) -> list[bytes | None]:
+        """The first ``count`` leaves; None where a block has not been hashed."""
+        return self._leaves[:count]
+
+    def root(self) -> bytes | None:
+        """The file digest, or None while some block has no leaf."""
+        if any(leaf is None for leaf in self._leaves):
+            return None
+        root = hashlib.sha256(struct.pack("!QI", self.file_size, self.block_size))
+        for leaf in self._leaves:
+            root.update(leaf)
+        return root.digest()
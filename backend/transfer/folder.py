@@ -0,0 +1,341 @@
+"""
+Folder transfers.
+
+A folder is one transfer. The sender walks the tree lazily and streams
+the manifest (relative paths and sizes) in MANIFEST batches on a control
+stream, followed by a METADATA message with the totals. The receiver
+asks the user once, creates the directory tree, and then accepts the
+member files without prompting: each arrives on its own stream of the
+same session, carrying the folder's transfer ID and its relative path.
+
+Every member is a regular file transfer underneath (resume, digest,
+striping, compression), but its state and progress roll up into the
+folder's TransferInfo instead of reaching the UI and history one file
+at a time.
+
+Files of at most PACK_FILE_SIZE skip the per-file exchange: the sender
+packs many of them, each with its file digest, into one encrypted PACKED
+frame on the folder's stream, and the receiver writes each frame's files
+in one batch.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import struct
+
+from config import PACK_FILE_SIZE, PACK_FRAME_SIZE, PACK_MAX_FILES, PART_SUFFIX
+from transfer.delta import FileDigest, choose_block_size
+from transfer.models import TransferInfo, TransferState
+
+logger = logging.getLogger(__name__)
+
+# Manifest entries per MANIFEST frame
+MANIFEST_BATCH = 1000
+# Largest folder a receiver will take, in manifest entries
+MAX_MANIFEST_ENTRIES = 1000000
+# Manifest size of a directory entry
+DIRECTORY = -1
+
+# PACKED payload: file count (also the AES-GCM associated data), then the
+# sequence number and the encrypted body
+PACK_HEADER_FORMAT = "!I"
+PACK_HEADER_SIZE = struct.calcsize(PACK_HEADER_FORMAT)
+# Per file in a packed body: path length and size, then the path and digest
+_PACK_ENTRY_FORMAT = "!HQ"
+_PACK_ENTRY_SIZE = struct.calcsize(_PACK_ENTRY_FORMAT)
+_PACK_DIGEST_SIZE = 32
+
+_TERMINAL_STATES = (
+    TransferState.COMPLETED,
+    TransferState.FAILED,
+    TransferState.CANCELLED,
+    TransferState.REJECTED,
+)
+_PAUSED_STATES = (TransferState.PAUSED, TransferState.PAUSED_BY_PEER)
+_RUNNING_STATES = (
+    TransferState.TRANSFERRING,
+    TransferState.PAUSED,
+    TransferState.PAUSED_BY_PEER,
+)
+
+
+def walk_folder(root: str):
+    """
+    Lazily yield (relative path, size) for everything under ``root``.
+
+    Paths use "/" separators. Directories are yielded with size
+    DIRECTORY before their contents. Symlinks are skipped, and so are
+    directories that cannot be read.
+    """
+    pending = [""]
+    while pending:
+        relative_dir = pending.pop()
+        try:
+            with os.scandir(os.path.join(root, relative_dir)) as entries:
+                for entry in entries:
+                    relative = f"{relative_dir}/{entry.name}" if relative_dir else entry.name
+                    if entry.is_symlink():
+                        continue
+                    if entry.is_dir():
+                        yield relative, DIRECTORY
+                        pending.append(relative)
+                    elif entry.is_file():
+                        yield relative, entry.stat().st_size
+        except OSError as e:
+            logger.warning(f"Skipping unreadable folder {relative_dir or root}: {e}")
+
+
+def next_batch(entries, count: int = MANIFEST_BATCH) -> list[tuple[str, int]]:
+    """Up to ``count`` entries from a walk_folder() iterator. Runs in a worker thread."""
+    batch = []
+    for entry in entries:
+        batch.append(entry)
+        if len(batch) == count:
+            break
+    return batch
+
+
+def encode_manifest(batch: list[tuple[str, int]]) -> bytes:
+    return json.dumps(batch, separators=(",", ":")).encode("utf-8")
+
+
+def decode_manifest(payload: bytes) -> list[tuple[str, int]]:
+    entries = json.loads(payload.decode("utf-8"))
+    return [(str(path), int(size)) for path, size in entries]
+
+
+def safe_join(root: str, relative: str) -> str:
+    """Resolve a peer-supplied relative path under ``root``, refusing escapes."""
+    parts = relative.split("/")
+    for part in parts:
+        if part in ("", ".", "..") or "\\" in part or ":" in part or "\0" in part:
+            raise ValueError(f"Unsafe path in folder transfer: {relative!r}")
+    return os.path.join(root, *parts)
+
+
+def index_manifest(entries: list[tuple[str, int]]) -> dict[str, int]:
+    """
+    Map each file of a received manifest to its size.
+
+    Raises ValueError for unsafe or duplicate paths. Runs in a worker
+    thread.
+    """
+    sizes: dict[str, int] = {}
+    seen = set()
+    for relative, size in entries:
+        safe_join("", relative)
+        if relative in seen:
+            raise ValueError(f"Duplicate path in folder manifest: {relative!r}")
+        seen.add(relative)
+        if size != DIRECTORY:
+            if size < 0:
+                raise ValueError(f"Bad size for {relative!r} in folder manifest")
+            sizes[relative] = size
+    return sizes
+
+
+def prepare_folder(root: str, entries: list[tuple[str, int]]) -> int:
+    """
+    Create the folder's directory tree under ``root``.
+
+    Returns how many bytes of the manifest's files are already on disk,
+    complete or as .part files, which resume will reuse. Runs in a worker
+    thread.
+    """
+    os.makedirs(root, exist_ok=True)
+    created = {root}
+    existing = 0
+    for relative, size in entries:
+        path = safe_join(root, relative)
+        directory = path if size == DIRECTORY else os.path.dirname(path)
+        if directory not in created:
+            os.makedirs(directory, exist_ok=True)
+            created.add(directory)
+        if size != DIRECTORY:
+            on_disk = 0
+            for candidate in (path + PART_SUFFIX, path):
+                try:
+                    on_disk = max(on_disk, os.path.getsize(candidate))
+                except OSError:
+                    pass
+            existing += min(on_disk, size)
+    return existing
+
+
+def is_packable(size: int) -> bool:
+    return size <= PACK_FILE_SIZE
+
+
+def pack_batches(files: list[tuple[str, int]]):
+    """Group small files into batches that each fill one PACKED frame."""
+    batch: list[tuple[str, int]] = []
+    batch_bytes = 0
+    for relative, size in files:
+        if batch and (batch_bytes + size > PACK_FRAME_SIZE or len(batch) == PACK_MAX_FILES):
+            yield batch
+            batch, batch_bytes = [], 0
+        batch.append((relative, size))
+        batch_bytes += size
+    if batch:
+        yield batch
+
+
+def _file_digest(data: bytes) -> bytes:
+    digest = FileDigest(len(data), choose_block_size(len(data)))
+    digest.update(0, data)
+    return digest.root()
+
+
+def pack_files(root: str, batch: list[tuple[str, int]]) -> tuple[bytes, list[tuple[str, int]], list[str]]:
+    """
+    Read a batch of small files into one packed body.
+
+    Returns the body, the files it holds and a failure message for each
+    file that could not be read as listed in the manifest. Runs in a
+    worker thread.
+    """
+    entries = []
+    blobs = []
+    packed = []
+    failures = []
+    for relative, size in batch:
+        try:
+            with open(os.path.join(root, *relative.split("/")), "rb") as f:
+                data = f.read(size + 1)
+        except OSError as e:
+            failures.append(f"{relative}: {e}")
+            continue
+        if len(data) != size:
+            failures.append(f"{relative}: file changed while it was being sent")
+            continue
+        path = relative.encode("utf-8")
+        entries.append(struct.pack(_PACK_ENTRY_FORMAT, len(path), size) + path + _file_digest(data))
+        blobs.append(data)
+        packed.append((relative, size))
+    return b"".join(entries + blobs), packed, failures
+
+
+def unpack_files(body: bytes, count: int) -> list[tuple[str, memoryview, bytes]]:
+    """Split a packed body into (relative path, data, digest) per file."""
+    view = memoryview(body)
+    headers = []
+    pos = 0
+    for _ in range(count):
+        if pos + _PACK_ENTRY_SIZE > len(view):
+            raise ValueError("Truncated packed frame")
+        path_length, size = struct.unpack_from(_PACK_ENTRY_FORMAT, view, pos)
+        pos += _PACK_ENTRY_SIZE
+        path = bytes(view[pos:pos + path_length]).decode("utf-8")
+        pos += path_length
+        digest = bytes(view[pos:pos + _PACK_DIGEST_SIZE])
+        pos += _PACK_DIGEST_SIZE
+        headers.append((path, size, digest))
+
+    files = []
+    for path, size, digest in headers:
+        if pos + size > len(view):
+            raise ValueError("Truncated packed frame")
+        files.append((path, view[pos:pos + size], digest))
+        pos += size
+    if pos != len(view):
+        raise ValueError("Trailing data in packed frame")
+    return files
+
+
+def write_packed(root: str, files: list[tuple[str, memoryview, bytes]]) -> None:
+    """
+    Check each unpacked file against its digest and write it under
+    ``root``, through a .part file so no file is ever seen half written.
+    Runs in a worker thread.
+    """
+    for relative, data, digest in files:
+        if _file_digest(data) != digest:
+            raise RuntimeError(f"File digest mismatch for {relative}")
+    for relative, data, _ in files:
+        path = safe_join(root, relative)
+        with open(path + PART_SUFFIX, "wb") as f:
+            f.write(data)
+        os.replace(path + PART_SUFFIX, path)
+
+
+class FolderProgress:
+    """
+    Rolls the state and progress of member files up into the folder.
+
+    Member transfers report here instead of to the TransferManager;
+    ``add_progress`` is the folder's ProgressReporter.add.
+    """
+
+    def __init__(self, transfer_info: TransferInfo, add_progress):
+        self.transfer_info = transfer_info
+        self.failures: list[str] = []
+        self._add_progress = add_progress
+        self._active: dict[str, TransferInfo] = {}
+        self._reported: dict[str, int] = {}
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    @property
+    def active(self) -> int:
+        return len(self._active)
+
+    async def on_progress(self, info: TransferInfo) -> None:
+        await self._account(info)
+
+    async def on_state(self, info: TransferInfo) -> None:
+        if info.state == TransferState.TRANSFERRING and self.transfer_info.state in _PAUSED_STATES:
+            # Started moving data while the folder was paused: join the pause
+            info.state = self.transfer_info.state
+        if info.state not in _TERMINAL_STATES:
+            self._active[info.transfer_id] = info
+            self._idle.clear()
+            await self._account(info)
+            return
+
+        await self._account(info)
+        self._active.pop(info.transfer_id, None)
+        if not self._active:
+            self._idle.set()
+        self._reported.pop(info.transfer_id, None)
+        if info.state == TransferState.COMPLETED:
+            self.transfer_info.files_done += 1
+            self.transfer_info.resumed_bytes += info.resumed_bytes
+        elif info.state in (TransferState.FAILED, TransferState.REJECTED):
+            self.failures.append(f"{info.file_name}: {info.error_message or info.state.value}")
+
+    async def wait_idle(self, timeout: float) -> None:
+        """Wait up to ``timeout`` seconds for every active member to end."""
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def add_packed(self, file_count: int, byte_count: int) -> None:
+        """Account for packed files, which have no TransferInfo of their own."""
+        self.transfer_info.files_done += file_count
+        await self._add_progress(byte_count)
+
+    def mirror(self, state: TransferState) -> None:
+        """
+        Apply the folder's pause, resume or cancel to active members.
+
+        Pause and resume only touch members that are already moving data;
+        a member still connecting joins a pause when it reports
+        TRANSFERRING (see ``on_state``). Other folder states are left to the folder's own teardown.
+        """
+        if state not in _RUNNING_STATES and state != TransferState.CANCELLED:
+            return
+        for info in self._active.values():
+            if state == TransferState.CANCELLED:
+                if info.state not in _TERMINAL_STATES:
+                    info.state = state
+            elif info.state in _RUNNING_STATES:
+                info.state = state
+
+    async def _account(self, info: TransferInfo) -> None:
+        delta = info.transferred_bytes - self._reported.get(info.transfer_id, 0)
+        if delta:
+            self._reported[info.transfer_id] = info.transferred_bytes
+            await self._add_progress(delta)
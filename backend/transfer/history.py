@@ -1,26 +1,142 @@
 """
 SQLite Database for persisting Transfer History.
+
+Writes never touch the database on the caller's thread. Each record is
+queued and a dedicated writer thread, holding one connection in WAL
+mode, commits whatever has accumulated as a single transaction every
+HISTORY_FLUSH_INTERVAL. Several state changes of one transfer within a
+batch collapse into one row write. ``close()`` flushes what is left.
+
+Reads page through the history newest first with an opaque cursor (the
+last row's timestamp and id), so each page is one indexed range scan
+however deep it is. ``version`` changes whenever the writer commits,
+which the API uses as an ETag.
+
+The writer also applies the retention policy, at start and every
+HISTORY_COMPACT_INTERVAL: records older than HISTORY_RETENTION_DAYS, and
+the oldest beyond HISTORY_MAX_RECORDS, are folded into per-day totals
+(``history_rollup``) and deleted, so the totals per peer and day still
+cover them. The file is vacuumed once enough of it is free.
 """
 
+import base64
+import json
+import os
 import sqlite3
 import logging
-from pathlib import Path
-from datetime import datetime
-from config import DEFAULT_SAVE_DIR
-import os
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from config import (
+    DEFAULT_SAVE_DIR,
+    HISTORY_COMPACT_INTERVAL,
+    HISTORY_FLUSH_INTERVAL,
+    HISTORY_MAX_RECORDS,
+    HISTORY_QUEUE_SIZE,
+    HISTORY_RETENTION_DAYS,
+)
 
 logger = logging.getLogger(__name__)
 
+_UPSERT = """
+    INSERT OR REPLACE INTO transfers (id, file_name, file_size, peer_name, direction, status, timestamp, digest, cipher_suite)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+_UPDATE_STATUS = "UPDATE transfers SET status = ? WHERE id = ?"
+
+# Position of ``status`` in an upsert's parameters
+_STATUS = 5
+
+# Statuses after which a transfer's record no longer changes
+_FINAL_STATUSES = ("completed", "failed", "cancelled", "rejected")
+
+# Vacuum once this share of the file is free pages
+_VACUUM_FREE_RATIO = 0.25
+
+# Totals per group; rolled-up days add to the live records
+_STATS_COLUMNS = """
+    COUNT(*) AS transfers,
+    COALESCE(SUM(file_size), 0) AS bytes,
+    SUM(status = 'completed') AS completed,
+    SUM(status = 'failed') AS failed
+"""
+
+
+def _is_final(write: tuple[str, tuple]) -> bool:
+    statement, params = write
+    status = params[_STATUS] if statement == _UPSERT else params[0]
+    return status in _FINAL_STATUSES
+
+
+def _timestamp(value: datetime) -> str:
+    """``value`` in the form timestamps are stored in: local time, no offset."""
+    if value.tzinfo is not None:
+        value = value.astimezone().replace(tzinfo=None)
+    return value.isoformat()
+
+
+def _encode_cursor(row: dict) -> str:
+    return base64.urlsafe_b64encode(json.dumps([row["timestamp"], row["id"]]).encode()).decode()
+
+
+def _decode_cursor(cursor: str) -> tuple[str, str]:
+    """The (timestamp, id) a cursor points after. ValueError if it is malformed."""
+    try:
+        timestamp, transfer_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception:
+        raise ValueError("Invalid cursor")
+    return str(timestamp), str(transfer_id)
+
+
+def _filters(peer=None, direction=None, status=None, since=None, until=None, day=False) -> tuple[str, list]:
+    """A WHERE clause and its parameters. ``day`` filters a table keyed by day instead of timestamp."""
+    clauses, params = [], []
+    if peer:
+        clauses.append("peer_name = ?")
+        params.append(peer)
+    if direction:
+        clauses.append("direction = ?")
+        params.append(direction)
+    if status:
+        clauses.append(f"status IN ({', '.join('?' * len(status))})")
+        params.extend(status)
+    column = "day" if day else "timestamp"
+    if since is not None:
+        clauses.append(f"{column} >= ?")
+        params.append(_timestamp(since)[:10] if day else _timestamp(since))
+    if until is not None:
+        clauses.append(f"{column} < ?" if not day else f"{column} <= ?")
+        params.append(_timestamp(until)[:10] if day else _timestamp(until))
+    return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+
 class TransferHistoryDB:
     def __init__(self, db_filename: str = "transfer_history.db"):
         os.makedirs(DEFAULT_SAVE_DIR, exist_ok=True)
         self.db_path = os.path.join(DEFAULT_SAVE_DIR, db_filename)
+        # Pending writes by transfer id: (statement, parameters)
+        self._pending: dict[str, tuple[str, tuple]] = {}
+        self._cond = threading.Condition()
+        self._closing = False
+        self._writer: threading.Thread | None = None
+        self._dropped = 0  # Records evicted because the writer fell behind
+        # Bumped on every commit; the epoch keeps versions from repeating across restarts
+        self._epoch = uuid.uuid4().hex[:8]
+        self._generation = 0
         self._init_db()
 
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path)
+        # WAL lets readers run alongside the writer; NORMAL syncs once per checkpoint, not per commit
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
     def _init_db(self):
         """Creates the history table if it doesn't exist."""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cursor = conn.cursor()
                 cursor.execute("""
                     CREATE TABLE IF NOT EXISTS transfers (
@@ -30,50 +146,281 @@ class TransferHistoryDB:
                         peer_name TEXT,
                         direction TEXT,
                         status TEXT,
-                        timestamp DATETIME
+                        timestamp DATETIME,
+                        digest TEXT,
+                        cipher_suite TEXT
+                    )
+                """)
+                # Databases created before file digests and cipher suites were recorded
+                columns = [row[1] for row in cursor.execute("PRAGMA table_info(transfers)")]
+                if "digest" not in columns:
+                    cursor.execute("ALTER TABLE transfers ADD COLUMN digest TEXT")
+                if "cipher_suite" not in columns:
+                    cursor.execute("ALTER TABLE transfers ADD COLUMN cipher_suite TEXT")
+                # Pages are read newest first, optionally for one peer or status
+                cursor.execute("CREATE INDEX IF NOT EXISTS transfers_timestamp ON transfers (timestamp, id)")
+                cursor.execute("CREATE INDEX IF NOT EXISTS transfers_peer ON transfers (peer_name, timestamp, id)")
+                cursor.execute("CREATE INDEX IF NOT EXISTS transfers_status ON transfers (status, timestamp, id)")
+                # Totals of records removed by the retention policy
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS history_rollup (
+                        day TEXT,
+                        peer_name TEXT,
+                        direction TEXT,
+                        status TEXT,
+                        transfers INTEGER,
+                        bytes INTEGER,
+                        PRIMARY KEY (day, peer_name, direction, status)
                     )
                 """)
                 conn.commit()
         except Exception as e:
             logger.error(f"Failed to initialize transfer history DB: {e}")
 
-    def add_transfer(self, transfer_id: str, file_name: str, file_size: int, peer_name: str, direction: str, status: str):
-        """Adds a new transfer record."""
-        try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute("""
-                    INSERT OR REPLACE INTO transfers (id, file_name, file_size, peer_name, direction, status, timestamp)
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
-                """, (transfer_id, file_name, file_size, peer_name, direction, status, datetime.now().isoformat()))
-                conn.commit()
-        except Exception as e:
-            logger.error(f"Failed to add transfer history: {e}")
+    @property
+    def version(self) -> str:
+        """Changes whenever records are written or removed."""
+        return f"{self._epoch}-{self._generation}"
+
+    def start(self) -> None:
+        """Start the writer thread."""
+        if self._writer is None:
+            self._closing = False
+            self._writer = threading.Thread(target=self._run, name="history-writer", daemon=True)
+            self._writer.start()
+
+    def close(self) -> None:
+        """Write everything still queued and stop the writer thread. Blocks until done."""
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+        if self._writer is not None:
+            self._writer.join()
+            self._writer = None
+
+    def add_transfer(self, transfer_id: str, file_name: str, file_size: int, peer_name: str, direction: str, status: str, digest: str = "", cipher_suite: str = ""):
+        """
+        Adds a new transfer record. ``digest`` is the verified file digest
+        and ``cipher_suite`` the session's AEAD, if known.
+
+        The record is queued for the writer thread; it replaces any
+        record of the same transfer still waiting to be written.
+        """
+        params = (transfer_id, file_name, file_size, peer_name, direction, status, datetime.now().isoformat(), digest or None, cipher_suite or None)
+        self._queue(transfer_id, (_UPSERT, params))
 
     def update_status(self, transfer_id: str, new_status: str):
         """Updates the status of an existing transfer."""
+        with self._cond:
+            pending = self._pending.get(transfer_id)
+            if pending is not None and pending[0] == _UPSERT:
+                params = list(pending[1])
+                params[_STATUS] = new_status
+                self._pending[transfer_id] = (_UPSERT, tuple(params))
+                return
+        self._queue(transfer_id, (_UPDATE_STATUS, (new_status, transfer_id)))
+
+    def _queue(self, transfer_id: str, write: tuple[str, tuple]) -> None:
+        """Queue ``write`` without ever waiting for the writer thread (callers are on the event loop)."""
+        with self._cond:
+            if transfer_id not in self._pending and len(self._pending) >= HISTORY_QUEUE_SIZE:
+                if not self._make_room(write):
+                    return
+            self._pending[transfer_id] = write
+            self._cond.notify_all()
+
+    def _make_room(self, write: tuple[str, tuple]) -> bool:
+        """
+        The writer is HISTORY_QUEUE_SIZE transfers behind. Evict a record
+        of a transfer that is still running, since its final state will
+        write the whole row again. False if ``write`` itself is the one
+        to drop.
+        """
+        for transfer_id, pending in self._pending.items():
+            if not _is_final(pending):
+                del self._pending[transfer_id]
+                self._dropped += 1
+                break
+        else:
+            if not _is_final(write):
+                self._dropped += 1
+                return False
+            # Only final records left: the oldest is lost
+            oldest = next(iter(self._pending))
+            del self._pending[oldest]
+            self._dropped += 1
+            logger.error(f"Transfer history writer is behind; dropped the record of {oldest}")
+            return True
+        if self._dropped % HISTORY_QUEUE_SIZE == 1:
+            logger.warning("Transfer history writer is behind; skipping intermediate states")
+        return True
+
+    def _run(self) -> None:
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute("""
-                    UPDATE transfers SET status = ? WHERE id = ?
-                """, (new_status, transfer_id))
-                conn.commit()
+            conn = self._connect()
         except Exception as e:
-            logger.error(f"Failed to update transfer history status: {e}")
+            logger.error(f"Transfer history writer could not open the DB: {e}")
+            return
+        try:
+            next_compaction = time.monotonic()
+            while True:
+                with self._cond:
+                    self._cond.wait_for(
+                        lambda: self._pending or self._closing,
+                        timeout=max(0.0, next_compaction - time.monotonic()),
+                    )
+                    if self._pending and not self._closing:
+                        # Let a batch accumulate, unless it is full already
+                        self._cond.wait_for(
+                            lambda: self._closing or len(self._pending) >= HISTORY_QUEUE_SIZE,
+                            timeout=HISTORY_FLUSH_INTERVAL,
+                        )
+                    batch = list(self._pending.values())
+                    self._pending.clear()
+                    closing = self._closing
+                    self._cond.notify_all()
+                if batch:
+                    self._write(conn, batch)
+                    self._generation += 1
+                if closing:
+                    return
+                if time.monotonic() >= next_compaction:
+                    if self._compact(conn):
+                        self._generation += 1
+                    next_compaction = time.monotonic() + HISTORY_COMPACT_INTERVAL
+        finally:
+            conn.close()
 
-    def get_history(self, limit: int = 50) -> list[dict]:
-        """Retrieves recent transfer history."""
+    @staticmethod
+    def _compact(conn: sqlite3.Connection) -> int:
+        """Apply the retention policy. Returns the number of records removed."""
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                conn.row_factory = sqlite3.Row
-                cursor = conn.cursor()
-                cursor.execute("""
-                    SELECT * FROM transfers ORDER BY timestamp DESC LIMIT ?
-                """, (limit,))
-                rows = cursor.fetchall()
-                # Convert sqlite3.Row to dict
-                return [dict(row) for row in rows]
+            with conn:
+                cutoffs = []
+                if HISTORY_RETENTION_DAYS:
+                    cutoffs.append(_timestamp(datetime.now() - timedelta(days=HISTORY_RETENTION_DAYS)))
+                if HISTORY_MAX_RECORDS:
+                    row = conn.execute(
+                        "SELECT timestamp FROM transfers ORDER BY timestamp DESC, id DESC LIMIT 1 OFFSET ?",
+                        (HISTORY_MAX_RECORDS - 1,),
+                    ).fetchone()
+                    if row is not None:
+                        cutoffs.append(row[0])
+                if not cutoffs:
+                    return 0
+                cutoff = max(cutoffs)
+                conn.execute("""
+                    INSERT INTO history_rollup (day, peer_name, direction, status, transfers, bytes)
+                    SELECT substr(timestamp, 1, 10), peer_name, direction, status, COUNT(*), COALESCE(SUM(file_size), 0)
+                    FROM transfers WHERE timestamp < ?
+                    GROUP BY substr(timestamp, 1, 10), peer_name, direction, status
+                    ON CONFLICT (day, peer_name, direction, status) DO UPDATE SET
+                        transfers = transfers + excluded.transfers,
+                        bytes = bytes + excluded.bytes
+                """, (cutoff,))
+                removed = conn.execute("DELETE FROM transfers WHERE timestamp < ?", (cutoff,)).rowcount
+            if removed:
+                logger.info(f"Transfer history: removed {removed} records past retention")
+                free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+                total = conn.execute("PRAGMA page_count").fetchone()[0]
+                if total and free / total >= _VACUUM_FREE_RATIO:
+                    conn.execute("VACUUM")
+            return removed
+        except Exception as e:
+            logger.error(f"Failed to apply transfer history retention: {e}")
+            return 0
+
+    @staticmethod
+    def _write(conn: sqlite3.Connection, batch: list[tuple[str, tuple]]) -> None:
+        try:
+            with conn:
+                for statement, params in batch:
+                    conn.execute(statement, params)
+        except Exception as e:
+            logger.error(f"Failed to write {len(batch)} transfer history records: {e}")
+
+    def _read(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def get_history(
+        self,
+        limit: int = 50,
+        cursor: str | None = None,
+        peer: str | None = None,
+        direction: str | None = None,
+        status: list[str] | None = None,
+        since: datetime | None = None,
+        until: datetime | None = None,
+    ) -> tuple[list[dict], str | None]:
+        """
+        One page of history, newest first, and the cursor of the next
+        page (None on the last). ``status`` matches any of the given
+        values; ``since`` is inclusive, ``until`` exclusive. Raises
+        ValueError for a malformed cursor.
+        """
+        where, params = _filters(peer, direction, status, since, until)
+        if cursor is not None:
+            where += (" AND " if where else " WHERE ") + "(timestamp, id) < (?, ?)"
+            params.extend(_decode_cursor(cursor))
+        try:
+            conn = self._read()
+            try:
+                rows = conn.execute(
+                    f"SELECT * FROM transfers{where} ORDER BY timestamp DESC, id DESC LIMIT ?",
+                    (*params, limit + 1),
+                ).fetchall()
+            finally:
+                conn.close()
         except Exception as e:
             logger.error(f"Failed to fetch transfer history: {e}")
+            return [], None
+        # Convert sqlite3.Row to dict
+        records = [dict(row) for row in rows[:limit]]
+        next_cursor = _encode_cursor(records[-1]) if len(rows) > limit else None
+        return records, next_cursor
+
+    def get_stats(
+        self,
+        group: str = "day",
+        peer: str | None = None,
+        direction: str | None = None,
+        since: datetime | None = None,
+        until: datetime | None = None,
+    ) -> list[dict]:
+        """
+        Totals per peer or per day (``group``): transfers, bytes, and how
+        many completed or failed. Includes records already removed by the
+        retention policy, to the day.
+        """
+        key = "peer_name" if group == "peer" else "substr(timestamp, 1, 10)"
+        rollup_key = "peer_name" if group == "peer" else "day"
+        where, params = _filters(peer, direction, None, since, until)
+        rollup_where, rollup_params = _filters(peer, direction, None, since, until, day=True)
+        try:
+            conn = self._read()
+            try:
+                rows = conn.execute(f"""
+                    SELECT key, SUM(transfers) AS transfers, SUM(bytes) AS bytes,
+                           SUM(completed) AS completed, SUM(failed) AS failed
+                    FROM (
+                        SELECT {key} AS key, {_STATS_COLUMNS} FROM transfers{where} GROUP BY key
+                        UNION ALL
+                        SELECT {rollup_key} AS key, SUM(transfers), SUM(bytes),
+                               SUM(CASE WHEN status = 'completed' THEN transfers ELSE 0 END),
+                               SUM(CASE WHEN status = 'failed' THEN transfers ELSE 0 END)
+                        FROM history_rollup{rollup_where} GROUP BY key
+                    )
+                    GROUP BY key ORDER BY key DESC
+                """, (*params, *rollup_params)).fetchall()
+            finally:
+                conn.close()
+        except Exception as e:
+            logger.error(f"Failed to fetch transfer history totals: {e}")
             return []
+        return [
+            {group: row["key"], "transfers": row["transfers"], "bytes": row["bytes"],
+             "completed": row["completed"], "failed": row["failed"]}
+            for row in rows
+        ]
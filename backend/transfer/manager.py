@@ -17,13 +17,21 @@ from config import (
     TRANSFER_PORT_MIN,
     TRANSFER_PORT_MAX,
 )
+from security.crypto import cipher_speeds
 from transfer.models import (
     TransferDirection,
     TransferInfo,
+    TransferPriority,
     TransferState,
 )
-from transfer.service import receive_file, send_file
+from transfer.service import receive_file, send_file, send_folder
+from transfer.protocol import FrameProtocol
+from transfer.session import PeerSession, SessionPool, SessionStream, start_session_server
 from transfer.history import TransferHistoryDB
+from transfer.dedup import ContentIndex
+from transfer.ratelimit import RateLimiter
+from transfer.progress import ProgressAggregator
+from transfer.scheduler import TransferScheduler
 
 logger = logging.getLogger(__name__)
 
@@ -43,6 +51,14 @@ class TransferManager:
         self._identity_service = identity_service
         self._trust_store = trust_store
         self._history_db = TransferHistoryDB()
+        self._content_index = ContentIndex()
+        self._rate_limiter = RateLimiter()
+        self._scheduler = TransferScheduler(self._on_queue_positions)
+        self._progress = ProgressAggregator(self._emit)
+        # Outgoing sessions are pooled per peer; incoming ones live as
+        # long as the sender keeps them open.
+        self._session_pool = SessionPool(identity_service)
+        self._inbound_sessions: set[PeerSession] = set()
 
     @property
     def save_dir(self) -> str:
@@ -53,6 +69,21 @@ class TransferManager:
         os.makedirs(path, exist_ok=True)
         self._save_dir = path
 
+    @property
+    def rate_limiter(self) -> RateLimiter:
+        """Bandwidth limits for outgoing transfers, adjustable live."""
+        return self._rate_limiter
+
+    @property
+    def scheduler(self) -> TransferScheduler:
+        """Concurrency caps and queue order for outgoing transfers."""
+        return self._scheduler
+
+    @property
+    def progress(self) -> ProgressAggregator:
+        """Batches progress updates into periodic ``transfer_tick`` events."""
+        return self._progress
+
     def on_event(self, callback) -> None:
         """Register callback: async fn(event_type: str, data: dict)."""
         self._event_callbacks.append(callback)
@@ -68,18 +99,23 @@ class TransferManager:
     async def start(self, device_name: str) -> None:
         """Start the receiver listener on a random port."""
         self._device_name = device_name
+        # Measure the ciphers now rather than during the first handshake
+        await asyncio.to_thread(cipher_speeds)
         port = random.randint(TRANSFER_PORT_MIN, TRANSFER_PORT_MAX)
 
         # Try a few ports if the first one is busy
         for attempt in range(10):
             try:
-                self._receiver_server = await asyncio.start_server(
+                self._receiver_server = await start_session_server(
                     self._handle_incoming_connection,
                     "0.0.0.0",
                     port,
                 )
                 logger.info(f"Transfer receiver listening on port {port}")
                 self._receiver_port = port
+                self._session_pool.start()
+                self._progress.start()
+                self._history_db.start()
                 return
             except OSError:
                 port = random.randint(TRANSFER_PORT_MIN, TRANSFER_PORT_MAX)
@@ -97,30 +133,67 @@ class TransferManager:
             task.cancel()
         self._tasks.clear()
 
+        await self._progress.stop()
+        await self._session_pool.close()
+        for session in list(self._inbound_sessions):
+            session.close()
+
         if self._receiver_server:
             self._receiver_server.close()
             await self._receiver_server.wait_closed()
 
+        # Flush the history records still queued
+        await asyncio.to_thread(self._history_db.close)
+
         logger.info("Transfer manager stopped")
 
     def get_transfers(self) -> list[TransferInfo]:
         """Return all active transfers."""
         return list(self._transfers.values())
 
-    def get_history(self, limit: int = 50) -> list[dict]:
-        """Return global transfer history."""
-        return self._history_db.get_history(limit)
+    def snapshot(self) -> dict:
+        """Every transfer in full, tagged with the last progress tick it includes."""
+        return {
+            "seq": self._progress.seq,
+            "transfers": [t.model_dump() for t in self._transfers.values()],
+        }
+
+    async def get_history(self, **filters) -> tuple[list[dict], str | None]:
+        """One page of transfer history and the next page's cursor (see TransferHistoryDB.get_history)."""
+        return await asyncio.to_thread(self._history_db.get_history, **filters)
+
+    async def get_history_stats(self, **filters) -> list[dict]:
+        """Transfer totals per peer or per day (see TransferHistoryDB.get_stats)."""
+        return await asyncio.to_thread(self._history_db.get_stats, **filters)
+
+    @property
+    def history_version(self) -> str:
+        """Changes whenever the transfer history does."""
+        return self._history_db.version
 
     async def queue_send(
         self, peer_ip: str, peer_port: int, peer_device_id: str,
-        peer_device_name: str, file_paths: list[str]
+        peer_device_name: str, file_paths: list[str],
+        stripes: int | None = None,
+        compress: bool | None = None,
+        priority: TransferPriority = TransferPriority.NORMAL,
     ) -> list[TransferInfo]:
-        """Queue multiple files to send to a peer."""
+        """
+        Queue multiple files to send to a peer.
+
+        A folder is sent as one transfer of everything under it.
+        ``stripes`` requests that many parallel connections per file;
+        None lets the service choose based on file size. ``compress``
+        overrides COMPRESSION_ENABLED for these files. Each transfer
+        stays PENDING until the scheduler gives it a slot.
+        """
         infos = []
         for file_path in file_paths:
             transfer_id = str(uuid.uuid4())
-            file_name = os.path.basename(file_path)
-            file_size = os.path.getsize(file_path)
+            is_folder = os.path.isdir(file_path)
+            file_name = os.path.basename(os.path.normpath(file_path))
+            # A folder's size is known once its manifest has been built
+            file_size = 0 if is_folder else os.path.getsize(file_path)
 
             info = TransferInfo(
                 transfer_id=transfer_id,
@@ -130,14 +203,17 @@ class TransferManager:
                 peer_device_id=peer_device_id,
                 peer_device_name=peer_device_name,
                 state=TransferState.PENDING,
+                is_folder=is_folder,
+                priority=priority,
             )
 
             async with self._lock:
                 self._transfers[transfer_id] = info
 
-            # Start a task for each file
+            # Each file's task waits for a scheduler slot before connecting
+            send_task = self._send_folder_task if is_folder else self._send_file_task
             task = asyncio.create_task(
-                self._send_file_task(peer_ip, peer_port, file_path, info)
+                send_task(peer_ip, peer_port, file_path, info, stripes, compress)
             )
             self._tasks[transfer_id] = task
             infos.append(info)
@@ -147,35 +223,87 @@ class TransferManager:
         return infos
 
     async def _send_file_task(
-        self, peer_ip: str, peer_port: int, file_path: str, info: TransferInfo
+        self, peer_ip: str, peer_port: int, file_path: str, info: TransferInfo,
+        stripes: int | None = None,
+        compress: bool | None = None,
     ) -> None:
         """Task wrapper for sending a single file."""
-        await send_file(
-            peer_ip=peer_ip,
-            peer_port=peer_port,
-            file_path=file_path,
-            transfer_info=info,
-            progress_callback=self._on_progress,
-            state_callback=self._on_state_change,
-            identity_service=self._identity_service,
-            trust_store=self._trust_store,
-        )
-        # Clean up task reference
-        self._tasks.pop(info.transfer_id, None)
-
-    async def _handle_incoming_connection(
-        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+        try:
+            async with self._scheduler.slot(info.peer_device_id, info):
+                await send_file(
+                    session_pool=self._session_pool,
+                    peer_ip=peer_ip,
+                    peer_port=peer_port,
+                    file_path=file_path,
+                    transfer_info=info,
+                    progress_callback=self._on_progress,
+                    state_callback=self._on_state_change,
+                    identity_service=self._identity_service,
+                    trust_store=self._trust_store,
+                    content_index=self._content_index,
+                    stripes=stripes,
+                    compress=compress,
+                    rate_limit=self._rate_limiter.for_transfer(info.transfer_id, info.peer_device_id),
+                )
+        finally:
+            # Clean up task reference
+            self._tasks.pop(info.transfer_id, None)
+            self._rate_limiter.release(info.transfer_id)
+
+    async def _send_folder_task(
+        self, peer_ip: str, peer_port: int, folder_path: str, info: TransferInfo,
+        stripes: int | None = None,
+        compress: bool | None = None,
     ) -> None:
-        """Handle a new incoming TCP connection for file reception."""
+        """Task wrapper for sending a folder."""
+        try:
+            async with self._scheduler.slot(info.peer_device_id, info):
+                await send_folder(
+                    session_pool=self._session_pool,
+                    peer_ip=peer_ip,
+                    peer_port=peer_port,
+                    folder_path=folder_path,
+                    transfer_info=info,
+                    progress_callback=self._on_progress,
+                    state_callback=self._on_state_change,
+                    identity_service=self._identity_service,
+                    trust_store=self._trust_store,
+                    content_index=self._content_index,
+                    stripes=stripes,
+                    compress=compress,
+                    rate_limit=self._rate_limiter.for_transfer(info.transfer_id, info.peer_device_id),
+                )
+        finally:
+            self._tasks.pop(info.transfer_id, None)
+            self._rate_limiter.release(info.transfer_id)
+
+    async def _handle_incoming_connection(self, conn: FrameProtocol) -> None:
+        """Authenticate a new incoming TCP connection and serve its streams."""
+        try:
+            session = await PeerSession.accept(conn, self._identity_service)
+        except Exception as e:
+            logger.warning(f"Rejected incoming session: {e}")
+            conn.close()
+            return
+
+        self._inbound_sessions.add(session)
+        try:
+            session.start(self._handle_incoming_stream)
+            await session.wait_closed()
+        finally:
+            self._inbound_sessions.discard(session)
+
+    async def _handle_incoming_stream(self, stream: SessionStream) -> None:
+        """Handle one file transfer stream opened by a peer."""
         await receive_file(
-            reader=reader,
-            writer=writer,
+            stream=stream,
             save_dir=self._save_dir,
             accept_callback=self._prompt_accept,
             progress_callback=self._on_progress,
             state_callback=self._on_state_change,
             identity_service=self._identity_service,
             trust_store=self._trust_store,
+            content_index=self._content_index,
         )
 
     async def _prompt_accept(self, transfer_info: TransferInfo) -> bool:
@@ -209,6 +337,10 @@ class TransferManager:
         if future and not future.done():
             future.set_result(accept)
 
+    async def set_priority(self, transfer_id: str, priority: TransferPriority) -> bool:
+        """Change the priority of a queued send. False if it already started."""
+        return await self._scheduler.reprioritize(transfer_id, priority)
+
     async def pause_transfer(self, transfer_id: str) -> None:
         """Pause an active transfer."""
         info = self._transfers.get(transfer_id)
@@ -228,6 +360,8 @@ class TransferManager:
         info = self._transfers.get(transfer_id)
         if info and info.state in (
             TransferState.PENDING,
+            TransferState.CONNECTING,
+            TransferState.RECONNECTING,
             TransferState.TRANSFERRING,
             TransferState.PAUSED,
             TransferState.PAUSED_BY_PEER,
@@ -241,17 +375,22 @@ class TransferManager:
             if task:
                 task.cancel()
 
+    async def _on_queue_positions(self, positions: dict[str, int]) -> None:
+        """Called by the scheduler when queued transfers move up."""
+        await self._emit("transfer_queue", {"positions": positions})
+
     async def _on_progress(self, info: TransferInfo) -> None:
-        """Called by transfer service on progress updates."""
-        await self._emit("transfer_progress", info.model_dump())
+        """Called by transfer service on progress updates; sent with the next tick."""
+        self._progress.update(info)
 
     async def _on_state_change(self, info: TransferInfo) -> None:
         """Called by transfer service on state changes."""
         async with self._lock:
             self._transfers[info.transfer_id] = info
+        self._progress.sync(info)
         await self._emit("transfer_state", info.model_dump())
 
-        # Persist to local database
+        # Persist to local database; queued for the writer thread
         self._history_db.add_transfer(
             transfer_id=info.transfer_id,
             file_name=info.file_name,
@@ -259,6 +398,8 @@ class TransferManager:
             peer_name=info.peer_device_name,
             direction=info.direction.value,
             status=info.state.value,
+            digest=info.digest,
+            cipher_suite=info.cipher_suite,
         )
 
         # Generate user-facing notifications
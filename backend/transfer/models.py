@@ -1,7 +1,8 @@
 """Pydantic models for file transfer."""
 
+import asyncio
 from enum import Enum
-from pydantic import BaseModel
+from pydantic import BaseModel, PrivateAttr
 
 
 class TransferState(str, Enum):
@@ -10,6 +11,7 @@ class TransferState(str, Enum):
     AWAITING_ACCEPTANCE = "awaiting_acceptance"
     REJECTED = "rejected"
     CONNECTING = "connecting"
+    RECONNECTING = "reconnecting"  # Connection lost mid-transfer; resumes once it is back
     TRANSFERRING = "transferring"
     PAUSED = "paused"
     PAUSED_BY_PEER = "paused_by_peer"
@@ -18,6 +20,13 @@ class TransferState(str, Enum):
     CANCELLED = "cancelled"
 
 
+class TransferPriority(str, Enum):
+    """Scheduling class of a queued send; see transfer.scheduler."""
+    HIGH = "high"
+    NORMAL = "normal"
+    LOW = "low"
+
+
 class TransferDirection(str, Enum):
     SENDING = "sending"
     RECEIVING = "receiving"
@@ -37,6 +46,46 @@ class TransferInfo(BaseModel):
     progress_percent: float = 0.0
     eta_seconds: float = 0.0
     error_message: str | None = None
+    stripes: int = 1  # Parallel TCP connections negotiated for this transfer
+    chunk_size: int = 0  # Current chunk size picked by the tuner (bytes)
+    pipeline_depth: int = 0  # Chunks in flight per stream picked by the tuner
+    rtt_ms: float = 0.0  # Minimum round-trip time measured to the peer
+    compression: str = ""  # Codec used for this transfer, "" if uncompressed
+    compression_ratio: float = 1.0  # Raw bytes / bytes on the wire so far
+    compression_cpu_seconds: float = 0.0  # CPU time spent (de)compressing
+    resumed_bytes: int = 0  # Bytes verified in place by block hashes, not re-sent
+    digest: str = ""  # Hex file digest (see transfer.delta), set once both sides agree on it
+    deduplicated: bool = False  # Receiver already had the content; nothing was sent
+    cipher_suite: str = ""  # AEAD negotiated for the session, e.g. "aes-256-gcm"
+    is_folder: bool = False  # A whole folder sent as one transfer
+    file_count: int = 0  # Files in a folder transfer
+    files_done: int = 0  # Files of a folder transfer completed so far
+    reconnects: int = 0  # Times the transfer resumed over a new connection after losing one
+    priority: TransferPriority = TransferPriority.NORMAL  # Scheduling class of a send
+    queue_position: int = 0  # 1-based place in the send queue while waiting, else 0
+
+    # Resolved and replaced on every assignment to ``state``
+    _state_changed: asyncio.Future | None = PrivateAttr(default=None)
+
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        if name == "state":
+            changed = self._state_changed
+            if changed is not None and not changed.done():
+                changed.set_result(value)
+            self._state_changed = None
+
+    def state_changed(self) -> asyncio.Future:
+        """
+        A future resolved the next time ``state`` is assigned, so pause,
+        resume and cancel wake the transfer's tasks without polling.
+
+        The future is shared by every waiter: wait on it with
+        ``asyncio.wait()``, which never cancels it.
+        """
+        if self._state_changed is None or self._state_changed.done():
+            self._state_changed = asyncio.get_running_loop().create_future()
+        return self._state_changed
 
 
 class TransferRequest(BaseModel):
@@ -52,20 +101,41 @@ class MessageType:
     METADATA = 0x02
     ACCEPT = 0x03
     REJECT = 0x04
-    RESUME_OFFSET = 0x05
+    RESUME_OFFSET = 0x05  # Size-based resume; superseded by BLOCK_HASHES
     DATA_CHUNK = 0x06
     PAUSE = 0x07
     RESUME = 0x08
     CANCEL = 0x09
     TRANSFER_COMPLETE = 0x0A
+    STRIPE_JOIN = 0x0B
+    ERROR = 0x0C
+    SESSION_HELLO = 0x0D
+    TUNE = 0x0E
+    PING = 0x0F
+    PONG = 0x10
+    BLOCK_HASHES = 0x11
+    RESUME_PLAN = 0x12
+    MANIFEST = 0x13
+    PACKED = 0x14
+    CREDIT = 0x15
 
 
 class FileMetadata(BaseModel):
-    """Metadata sent before file data."""
+    """
+    Metadata sent before file data.
+
+    The sender's identity is proven once per session (SESSION_HELLO),
+    so no per-file signature is needed.
+    """
     transfer_id: str
     file_name: str
     file_size: int
     sender_device_id: str
     sender_device_name: str
-    identity_public_key: str = ""
-    identity_signature: str = ""
+    stripes: int = 1  # Requested number of parallel connections
+    compression: str = ""  # Codec the sender may apply to chunks, "" for none
+    content_digest: str = ""  # Hex file digest for dedup, "" if not known up front
+    is_folder: bool = False  # Sent after the folder's MANIFEST; file_size is the total
+    file_count: int = 0  # Files in the folder's manifest
+    folder_id: str = ""  # For a member file: transfer ID of its folder
+    relative_path: str = ""  # For a member file: its path in the folder's manifest
@@ -0,0 +1,163 @@
+"""
+Progress aggregation for the event channel.
+
+Transfers report progress as often as they like; the aggregator only
+marks them dirty. Once per ``interval`` it sends a single
+``transfer_tick`` event holding, for each transfer that changed, just
+the progress fields whose values differ from what was last sent. Idle
+periods send nothing, and the tick loop sleeps until a transfer reports
+again.
+
+Every tick carries a sequence number. A client that (re)connects gets a
+snapshot of every transfer tagged with the current sequence number;
+ticks after it are applied on top, and a gap in the numbers tells the
+client it missed one and should ask for a fresh snapshot. Field values
+are absolute, so applying a tick twice is harmless.
+
+Ticks have a compact binary form (``encode_tick``) for clients that ask
+for it: a ``!BII`` header (kind, seq, count), then per transfer its id
+as a length-prefixed string, a ``!H`` mask of the fields present, and
+the values of those fields in PROGRESS_FIELDS order.
+"""
+
+import asyncio
+import logging
+import struct
+
+from config import PROGRESS_TICK_INTERVAL
+from transfer.models import TransferInfo, TransferState
+
+logger = logging.getLogger(__name__)
+
+# Fields a tick may carry, with their binary encoding. Everything else
+# about a transfer travels in full ``transfer_state`` events.
+PROGRESS_FIELDS = (
+    ("transferred_bytes", "Q"),
+    ("speed_bps", "d"),
+    ("progress_percent", "f"),
+    ("eta_seconds", "f"),
+    ("chunk_size", "I"),
+    ("pipeline_depth", "I"),
+    ("rtt_ms", "f"),
+    ("compression_ratio", "f"),
+    ("compression_cpu_seconds", "f"),
+    ("resumed_bytes", "Q"),
+    ("files_done", "I"),
+    ("stripes", "I"),
+)
+
+TICK_KIND = 1  # First byte of a binary tick
+_HEADER_FORMAT = "!BII"
+_ID_FORMAT = "!B"
+_MASK_FORMAT = "!H"
+
+_TERMINAL_STATES = (
+    TransferState.COMPLETED,
+    TransferState.FAILED,
+    TransferState.CANCELLED,
+    TransferState.REJECTED,
+)
+
+
+def _fields(info: TransferInfo) -> dict:
+    return {name: getattr(info, name) for name, _ in PROGRESS_FIELDS}
+
+
+def encode_tick(tick: dict) -> bytes:
+    """The binary form of a ``transfer_tick`` event's data."""
+    transfers = tick["transfers"]
+    parts = [struct.pack(_HEADER_FORMAT, TICK_KIND, tick["seq"], len(transfers))]
+    for transfer_id, delta in transfers.items():
+        tid = transfer_id.encode()
+        mask = 0
+        fmt = "!"
+        values = []
+        for bit, (name, code) in enumerate(PROGRESS_FIELDS):
+            if name in delta:
+                mask |= 1 << bit
+                fmt += code
+                values.append(delta[name])
+        parts.append(struct.pack(_ID_FORMAT, len(tid)) + tid)
+        parts.append(struct.pack(_MASK_FORMAT, mask) + struct.pack(fmt, *values))
+    return b"".join(parts)
+
+
+class ProgressAggregator:
+    """
+    Coalesces progress reports into one batched tick per interval.
+
+    ``emit`` is an async fn(event_type, data), the manager's ``_emit``.
+    ``interval`` may be changed while running; the next tick uses it.
+    """
+
+    def __init__(self, emit, interval: float = PROGRESS_TICK_INTERVAL):
+        self.interval = interval
+        self._emit = emit
+        self._dirty: dict[str, TransferInfo] = {}
+        self._sent: dict[str, dict] = {}  # Field values clients have, per transfer
+        self._seq = 0
+        self._wake = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    @property
+    def seq(self) -> int:
+        """Sequence number of the last tick sent."""
+        return self._seq
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def update(self, info: TransferInfo) -> None:
+        """Note that ``info`` made progress; it goes out with the next tick."""
+        self._dirty[info.transfer_id] = info
+        self._wake.set()
+
+    def sync(self, info: TransferInfo) -> None:
+        """
+        Note that ``info`` was just sent in full, so the next tick only
+        carries what changes after this. Finished transfers are dropped.
+        """
+        self._dirty.pop(info.transfer_id, None)
+        if info.state in _TERMINAL_STATES:
+            self._sent.pop(info.transfer_id, None)
+        else:
+            self._sent[info.transfer_id] = _fields(info)
+
+    def flush(self) -> dict | None:
+        """Take the pending changes as a tick, or None if nothing changed."""
+        transfers = {}
+        for transfer_id, info in self._dirty.items():
+            current = _fields(info)
+            last = self._sent.get(transfer_id, {})
+            delta = {name: value for name, value in current.items() if last.get(name) != value}
+            if delta:
+                transfers[transfer_id] = delta
+                if info.state not in _TERMINAL_STATES:
+                    self._sent[transfer_id] = current
+        self._dirty.clear()
+        if not transfers:
+            return None
+        self._seq += 1
+        return {"seq": self._seq, "transfers": transfers}
+
+    async def _run(self) -> None:
+        while True:
+            await self._wake.wait()
+            self._wake.clear()
+            await asyncio.sleep(self.interval)
+            tick = self.flush()
+            if tick is not None:
+                try:
+                    await self._emit("transfer_tick", tick)
+                except Exception as e:
+                    logger.error(f"Progress tick failed: {e}")
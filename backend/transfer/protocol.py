@@ -0,0 +1,300 @@
+"""
+Buffered frame transport for peer sessions.
+
+FrameProtocol is an ``asyncio.BufferedProtocol``: the event loop reads
+socket data straight into buffers we own instead of allocating a new
+``bytes`` object per read. Frame headers and small control payloads are
+parsed out of one fixed staging buffer, while DATA_CHUNK payloads are
+received directly into reusable buffers from a BufferPool, so a multi-GB
+receive recycles a handful of chunk-sized buffers instead of allocating
+(and page-faulting) a fresh 4 MB object for every frame.
+"""
+
+import asyncio
+import collections
+import logging
+import struct
+import time
+
+from config import MAX_FRAME_SIZE
+from transfer.models import MessageType
+
+logger = logging.getLogger(__name__)
+
+FRAME_HEADER_FORMAT = "!BII"  # 1-byte type + 4-byte stream ID + 4-byte length
+FRAME_HEADER_SIZE = struct.calcsize(FRAME_HEADER_FORMAT)
+
+# Headers and control payloads are parsed out of this buffer
+STAGING_SIZE = 65536
+# Parsed frames waiting for the session reader before the socket is paused
+MAX_PENDING_FRAMES = 4
+
+
+class BufferPool:
+    """
+    Free list of equally sized bytearrays for chunk frames.
+
+    Buffers are sized to the largest chunk frame seen so far, so the pool
+    follows whatever chunk size the transfer negotiated. Acquiring never
+    blocks: when the free list is empty a new buffer is allocated, and
+    backpressure stays with the per-stream queue depth. At most
+    ``max_free_bytes`` of idle buffers are kept.
+    """
+
+    def __init__(self, max_free_bytes: int):
+        self.buffer_size = 0
+        self._max_free_bytes = max_free_bytes
+        self._free: list[bytearray] = []
+
+    def acquire(self, size: int) -> bytearray:
+        """Return a buffer of at least ``size`` bytes."""
+        if size > self.buffer_size:
+            self.buffer_size = size
+            self._free.clear()
+        if self._free:
+            return self._free.pop()
+        return bytearray(self.buffer_size)
+
+    def release(self, buffer: bytearray) -> None:
+        if (
+            len(buffer) == self.buffer_size
+            and (len(self._free) + 1) * self.buffer_size <= self._max_free_bytes
+        ):
+            self._free.append(buffer)
+
+    def clear(self) -> None:
+        self._free.clear()
+
+
+class FrameProtocol(asyncio.BufferedProtocol):
+    """
+    One session connection, parsing type-stream-length frames.
+
+    Frames are read with ``await read_frame()``. Control payloads are
+    returned as ``bytes``; DATA_CHUNK payloads as a memoryview over a
+    pooled buffer, which the consumer hands back with ``release()`` once
+    the chunk has been decrypted.
+
+    Also stands in for a StreamWriter (``writelines()``, ``drain()``,
+    ``close()``) so write_frame() can use it directly.
+    """
+
+    def __init__(self, pool: BufferPool, on_connect=None):
+        self.pool = pool
+        self._on_connect = on_connect
+        self._connect_task: asyncio.Task | None = None
+        self._transport: asyncio.Transport | None = None
+        self._loop = asyncio.get_running_loop()
+
+        self._staging = bytearray(STAGING_SIZE)
+        self._staging_view = memoryview(self._staging)
+        self._start = 0  # Unparsed bytes are staging[start:end]
+        self._end = 0
+
+        # Payload currently being received directly into a pooled buffer
+        self._payload: bytearray | None = None
+        self._payload_view: memoryview | None = None
+        self._payload_length = 0
+        self._payload_filled = 0
+        self._payload_header: tuple[int, int] = (0, 0)
+        # When the peer last sent us anything, even part of a frame
+        self.last_received = time.monotonic()
+        self._resumed_at = 0.0  # When we last resumed reading
+
+        self._frames: collections.deque = collections.deque()
+        self._frame_waiter: asyncio.Future | None = None
+        self._reading_paused = False
+        self._error: Exception | None = None
+
+        self._writing_paused = False
+        self._drain_waiters: collections.deque = collections.deque()
+        self._closed = self._loop.create_future()
+
+    # --- asyncio.BufferedProtocol ---
+
+    def connection_made(self, transport: asyncio.Transport) -> None:
+        self._transport = transport
+        if self._on_connect:
+            self._connect_task = self._loop.create_task(self._on_connect(self))
+
+    def get_buffer(self, sizehint: int) -> memoryview:
+        if self._payload is not None:
+            return self._payload_view[self._payload_filled:self._payload_length]
+        if self._start == self._end:
+            self._start = self._end = 0
+        elif self._start:
+            # Move the partial frame to the front; at most one small frame
+            pending = self._end - self._start
+            self._staging[:pending] = self._staging_view[self._start:self._end]
+            self._start, self._end = 0, pending
+        return self._staging_view[self._end:]
+
+    def buffer_updated(self, nbytes: int) -> None:
+        self.last_received = time.monotonic()
+        try:
+            if self._payload is not None:
+                self._payload_filled += nbytes
+                if self._payload_filled == self._payload_length:
+                    self._finish_payload()
+                return
+            self._end += nbytes
+            self._parse_staging()
+        except ConnectionError as e:
+            logger.warning(f"Dropping session: {e}")
+            self._set_error(e)
+            self._transport.abort()
+
+    def eof_received(self) -> bool:
+        self._set_error(ConnectionError("Connection closed by peer"))
+        return False
+
+    def connection_lost(self, exc: Exception | None) -> None:
+        self._set_error(ConnectionError(f"Connection lost: {exc}") if exc else ConnectionError("Connection closed"))
+        self._writing_paused = False
+        while self._drain_waiters:
+            waiter = self._drain_waiters.popleft()
+            if not waiter.done():
+                waiter.set_exception(ConnectionResetError("Connection lost"))
+        if not self._closed.done():
+            self._closed.set_result(None)
+
+    def pause_writing(self) -> None:
+        self._writing_paused = True
+
+    def resume_writing(self) -> None:
+        self._writing_paused = False
+        while self._drain_waiters:
+            waiter = self._drain_waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+
+    # --- Reading ---
+
+    @property
+    def silence(self) -> float:
+        """
+        Seconds the peer has sent nothing. Time we spent with reading
+        paused ourselves doesn't count: nothing could arrive then,
+        however alive the peer is.
+        """
+        if self._reading_paused:
+            return 0.0
+        return time.monotonic() - max(self.last_received, self._resumed_at)
+
+    async def read_frame(self) -> tuple[int, int, bytes | memoryview]:
+        """Return the next frame as (type, stream_id, payload)."""
+        while not self._frames:
+            if self._error:
+                raise self._error
+            self._frame_waiter = self._loop.create_future()
+            try:
+                await self._frame_waiter
+            finally:
+                self._frame_waiter = None
+        frame = self._frames.popleft()
+        if self._reading_paused and len(self._frames) <= 1 and not self._transport.is_closing():
+            self._reading_paused = False
+            self._resumed_at = time.monotonic()
+            self._transport.resume_reading()
+        return frame
+
+    def release(self, payload: memoryview) -> None:
+        """Return a DATA_CHUNK payload's buffer to the pool."""
+        self.pool.release(payload.obj)
+
+    def _parse_staging(self) -> None:
+        while self._end - self._start >= FRAME_HEADER_SIZE:
+            msg_type, stream_id, length = struct.unpack_from(
+                FRAME_HEADER_FORMAT, self._staging, self._start
+            )
+            if length > MAX_FRAME_SIZE:
+                raise ConnectionError(f"Frame of {length} bytes exceeds limit")
+            body_start = self._start + FRAME_HEADER_SIZE
+            available = self._end - body_start
+
+            if msg_type != MessageType.DATA_CHUNK and length <= STAGING_SIZE - FRAME_HEADER_SIZE:
+                if available < length:
+                    return  # Wait for the rest; get_buffer() keeps it contiguous
+                self._start = body_start + length
+                self._deliver(msg_type, stream_id, bytes(self._staging_view[body_start:self._start]))
+                continue
+
+            # Large payload: receive it straight into its own buffer
+            if msg_type == MessageType.DATA_CHUNK:
+                buffer = self.pool.acquire(length)
+            else:
+                buffer = bytearray(length)
+            copied = min(available, length)
+            buffer[:copied] = self._staging_view[body_start:body_start + copied]
+            self._start = body_start + copied
+            if copied == length:
+                self._deliver_buffer(msg_type, stream_id, buffer, length)
+                continue
+
+            self._payload = buffer
+            self._payload_view = memoryview(buffer)
+            self._payload_length = length
+            self._payload_filled = copied
+            self._payload_header = (msg_type, stream_id)
+            return
+
+    def _finish_payload(self) -> None:
+        msg_type, stream_id = self._payload_header
+        buffer, length = self._payload, self._payload_length
+        self._payload = self._payload_view = None
+        self._deliver_buffer(msg_type, stream_id, buffer, length)
+
+    def _deliver_buffer(self, msg_type: int, stream_id: int, buffer: bytearray, length: int) -> None:
+        if msg_type == MessageType.DATA_CHUNK:
+            self._deliver(msg_type, stream_id, memoryview(buffer)[:length])
+        else:
+            self._deliver(msg_type, stream_id, bytes(buffer))
+
+    def _deliver(self, msg_type: int, stream_id: int, payload) -> None:
+        self._frames.append((msg_type, stream_id, payload))
+        if self._frame_waiter and not self._frame_waiter.done():
+            self._frame_waiter.set_result(None)
+        if len(self._frames) >= MAX_PENDING_FRAMES and not self._reading_paused:
+            self._reading_paused = True
+            self._transport.pause_reading()
+
+    def _set_error(self, error: Exception) -> None:
+        if self._error is None:
+            self._error = error
+        if self._frame_waiter and not self._frame_waiter.done():
+            self._frame_waiter.set_result(None)
+
+    # --- Writing (StreamWriter-compatible subset) ---
+
+    def writelines(self, parts) -> None:
+        self._transport.writelines(parts)
+
+    @property
+    def write_buffer_size(self) -> int:
+        return self._transport.get_write_buffer_size() if self._transport else 0
+
+    async def drain(self) -> None:
+        if self._transport.is_closing():
+            # Let connection_lost() run, as StreamWriter.drain() does
+            await asyncio.sleep(0)
+            raise ConnectionResetError("Connection lost")
+        if not self._writing_paused:
+            return
+        waiter = self._loop.create_future()
+        self._drain_waiters.append(waiter)
+        await waiter
+
+    def close(self) -> None:
+        if self._transport:
+            self._transport.close()
+
+    def abort(self) -> None:
+        """Close at once, dropping unsent data instead of waiting to flush it."""
+        if self._transport:
+            self._transport.abort()
+
+    async def wait_closed(self) -> None:
+        await asyncio.shield(self._closed)
+
+    def get_extra_info(self, name: str, default=None):
+        return self._transport.get_extra_info(name, default)
@@ -0,0 +1,267 @@
+"""
+Bandwidth limits for outgoing data.
+
+Every chunk a sender puts on the wire is paid for in token buckets at
+three levels: its transfer, its peer, and the whole app. Each limit is
+in bytes per second, 0 meaning unlimited, and can be changed while
+transfers run.
+
+Background mode adds a fourth bucket per transfer whose rate follows
+the delay on the path to the peer, in the spirit of LEDBAT (RFC 6817):
+the RTT of control-stream pings is compared with the lowest RTT seen,
+and once the difference (queuing delay, usually someone else's traffic
+waiting behind ours in a router or Wi-Fi buffer) exceeds
+BACKGROUND_TARGET_DELAY the rate backs off; while it stays below, the
+rate ramps back up, until the limit no longer holds the transfer back.
+
+The pings share the connection with our own chunks, so each sample is
+corrected for the bytes queued ahead of its PING in our transport
+buffer, at the transfer's send rate. Data already handed to the
+kernel's socket buffer can't be seen from here and still counts as
+queuing delay, so on a link slower than that buffer drains the mode
+can throttle below what an idle path would allow.
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+
+from config import (
+    BACKGROUND_MIN_RATE,
+    BACKGROUND_MODE,
+    BACKGROUND_TARGET_DELAY,
+    RATE_BURST_SECONDS,
+    RATE_LIMIT_GLOBAL,
+    RATE_LIMIT_PEER,
+    RATE_LIMIT_TRANSFER,
+)
+
+logger = logging.getLogger(__name__)
+
+# Smallest burst a limited bucket allows, so tiny rates still send whole frames
+_MIN_BURST = 65536
+# Base delay history: minimum RTT per minute over the last few minutes
+_BASE_HISTORY = 10
+_BASE_INTERVAL = 60.0
+# Background rate control per RTT sample
+_BACKOFF = 0.7  # Multiplier once queuing delay exceeds the target
+_RAMP = 0.25  # Largest relative increase while below the target
+
+
+class TokenBucket:
+    """
+    A token bucket that goes into debt instead of splitting chunks.
+
+    ``consume()`` takes the tokens at once and then waits until the
+    debt it left is paid off at the current rate, so concurrent senders
+    are served in arrival order and a chunk larger than the burst still
+    goes out whole. Changing the rate wakes the waiters, which re-plan
+    with the new rate.
+    """
+
+    def __init__(self, rate: int = 0):
+        self.rate = rate
+        self._tokens = self.burst
+        # Tokens added since creation; a waiter is paid off once this
+        # passes the target it computed when it went into debt
+        self._filled = 0.0
+        self._stamp = time.monotonic()
+        self._changed: asyncio.Future | None = None
+
+    @property
+    def burst(self) -> float:
+        return max(self.rate * RATE_BURST_SECONDS, _MIN_BURST)
+
+    def set_rate(self, rate: int) -> None:
+        if rate == self.rate:
+            return
+        self._refill()
+        self.rate = rate
+        self._tokens = min(self._tokens, self.burst)
+        if self._changed and not self._changed.done():
+            self._changed.set_result(None)
+        self._changed = None
+
+    async def consume(self, amount: int) -> None:
+        target = self.charge(amount)
+        if target is not None:
+            await self.wait(target)
+
+    def charge(self, amount: int) -> float | None:
+        """
+        Take ``amount`` tokens now. Returns the fill level to ``wait()``
+        for if that left a debt, else None.
+        """
+        if not self.rate:
+            return None
+        self._refill()
+        self._tokens -= amount
+        if self._tokens >= 0:
+            return None
+        return self._filled - self._tokens
+
+    async def wait(self, target: float) -> None:
+        """Wait until the bucket has filled up to ``target``."""
+        self._refill()
+        while self.rate and self._filled < target:
+            if self._changed is None:
+                self._changed = asyncio.get_running_loop().create_future()
+            await asyncio.wait(
+                (self._changed,), timeout=(target - self._filled) / self.rate
+            )
+            self._refill()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        if self.rate:
+            tokens = min(self.burst, self._tokens + (now - self._stamp) * self.rate)
+            self._filled += tokens - self._tokens
+            self._tokens = tokens
+        else:
+            # Unlimited: forget any debt
+            self._filled += max(0.0, -self._tokens)
+            self._tokens = self.burst
+        self._stamp = now
+
+
+class BackgroundRate:
+    """LEDBAT-style rate control from RTT samples; rate 0 means unlimited."""
+
+    def __init__(self):
+        self.rate = 0
+        self._base: deque[tuple[float, float]] = deque()  # (minute started, min RTT)
+
+    def observe(self, rtt: float, send_rate: float) -> int:
+        """Update with an RTT sample and the transfer's recent send rate (bytes/s)."""
+        now = time.monotonic()
+        if not self._base or now - self._base[-1][0] >= _BASE_INTERVAL:
+            self._base.append((now, rtt))
+            if len(self._base) > _BASE_HISTORY:
+                self._base.popleft()
+        elif rtt < self._base[-1][1]:
+            self._base[-1] = (self._base[-1][0], rtt)
+        queuing = rtt - min(base for _, base in self._base)
+
+        off_target = (BACKGROUND_TARGET_DELAY - queuing) / BACKGROUND_TARGET_DELAY
+        if off_target < 0:
+            current = min(self.rate, send_rate) if self.rate else send_rate
+            self.rate = max(BACKGROUND_MIN_RATE, int(current * _BACKOFF))
+        elif self.rate:
+            self.rate = int(self.rate * (1 + _RAMP * off_target))
+            if self.rate > 2 * send_rate and send_rate > BACKGROUND_MIN_RATE:
+                # The limit no longer holds us back; the link is idle
+                self.rate = 0
+        return self.rate
+
+    def reset(self) -> None:
+        self.rate = 0
+
+
+class TransferLimit:
+    """The buckets one outgoing transfer pays into, plus its background control."""
+
+    def __init__(self, limiter: "RateLimiter", transfer_bucket: TokenBucket, peer_bucket: TokenBucket):
+        self._limiter = limiter
+        self.bucket = transfer_bucket
+        self._peer_bucket = peer_bucket
+        self._background_bucket = TokenBucket()
+        self._background = BackgroundRate()
+        self._sent = 0
+        self._sent_stamp = time.monotonic()
+
+    @property
+    def background(self) -> bool:
+        return self._limiter.background
+
+    @property
+    def limited(self) -> bool:
+        return any(bucket.rate for bucket in self._buckets())
+
+    def _buckets(self) -> tuple[TokenBucket, ...]:
+        return (self.bucket, self._background_bucket, self._peer_bucket, self._limiter.global_bucket)
+
+    def record_sent(self, amount: int) -> None:
+        """Count ``amount`` bytes sent, limited or not; background mode backs off from this rate."""
+        self._sent += amount
+
+    async def consume(self, amount: int) -> None:
+        # Every bucket is charged before any is waited on, so their debts
+        # are paid off at the same time: the wait is the largest of them,
+        # not their sum
+        targets = [(bucket, bucket.charge(amount)) for bucket in self._buckets()]
+        for bucket, target in targets:
+            if target is not None:
+                await bucket.wait(target)
+
+    def observe_rtt(self, rtt: float, backlog: int = 0) -> None:
+        """
+        Feed a control-stream RTT sample (seconds) to background mode.
+        ``backlog`` is how many bytes of ours were queued ahead of the PING.
+        """
+        now = time.monotonic()
+        send_rate = self._sent / max(now - self._sent_stamp, 1e-3)
+        self._sent, self._sent_stamp = 0, now
+        if not self.background:
+            self._background.reset()
+        else:
+            if backlog and send_rate:
+                # Time the PING waited behind our own chunks, not the path's
+                rtt = max(0.0, rtt - backlog / send_rate)
+            rate = self._background.observe(rtt, send_rate)
+            if rate != self._background_bucket.rate:
+                logger.debug(f"Background rate now {rate} B/s (RTT {rtt * 1000:.1f} ms)")
+        self._background_bucket.set_rate(self._background.rate)
+
+
+class RateLimiter:
+    """
+    Bandwidth limits for every outgoing transfer.
+
+    Owns the global bucket and one bucket per peer; per-transfer buckets
+    are handed out by ``for_transfer()`` and dropped by ``release()``.
+    """
+
+    def __init__(self):
+        self.global_bucket = TokenBucket(RATE_LIMIT_GLOBAL)
+        self.peer_rate = RATE_LIMIT_PEER
+        self.transfer_rate = RATE_LIMIT_TRANSFER
+        self.background = BACKGROUND_MODE
+        self._peers: dict[str, TokenBucket] = {}
+        self._transfers: dict[str, TransferLimit] = {}
+
+    @property
+    def global_rate(self) -> int:
+        return self.global_bucket.rate
+
+    def configure(
+        self,
+        global_rate: int | None = None,
+        peer_rate: int | None = None,
+        transfer_rate: int | None = None,
+        background: bool | None = None,
+    ) -> None:
+        """Change limits live; None leaves a setting as it is."""
+        if global_rate is not None:
+            self.global_bucket.set_rate(global_rate)
+        if peer_rate is not None:
+            self.peer_rate = peer_rate
+            for bucket in self._peers.values():
+                bucket.set_rate(peer_rate)
+        if transfer_rate is not None:
+            self.transfer_rate = transfer_rate
+            for limit in self._transfers.values():
+                limit.bucket.set_rate(transfer_rate)
+        if background is not None:
+            self.background = background
+
+    def for_transfer(self, transfer_id: str, peer_id: str) -> TransferLimit:
+        peer_bucket = self._peers.get(peer_id)
+        if peer_bucket is None:
+            peer_bucket = self._peers[peer_id] = TokenBucket(self.peer_rate)
+        limit = TransferLimit(self, TokenBucket(self.transfer_rate), peer_bucket)
+        self._transfers[transfer_id] = limit
+        return limit
+
+    def release(self, transfer_id: str) -> None:
+        self._transfers.pop(transfer_id, None)
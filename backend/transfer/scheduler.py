@@ -0,0 +1,168 @@
+"""
+Send scheduler.
+
+Queued sends wait here, PENDING, until a slot frees up: at most
+``max_active`` transfers run at once, and at most ``max_per_peer`` to
+any one peer, so dropping hundreds of files opens a handful of
+connections and disk readers instead of hundreds.
+
+The next transfer is picked by priority class first (high, normal,
+low), and within a class small files (up to SCHEDULER_SMALL_FILE) go
+before large ones, which keeps interactive sends from waiting behind
+bulk ones. Peers with waiting transfers of the same class take turns,
+so one peer's long queue cannot starve another's.
+"""
+
+import asyncio
+import bisect
+import itertools
+from collections import deque
+from contextlib import asynccontextmanager
+
+from config import MAX_ACTIVE_PER_PEER, MAX_ACTIVE_TRANSFERS, SCHEDULER_SMALL_FILE
+from transfer.models import TransferInfo, TransferPriority
+
+_PRIORITY_ORDER = {
+    TransferPriority.HIGH: 0,
+    TransferPriority.NORMAL: 1,
+    TransferPriority.LOW: 2,
+}
+
+
+class _Waiting:
+    __slots__ = ("key", "info", "granted")
+
+    def __init__(self, key: tuple, info: TransferInfo, granted: asyncio.Future):
+        self.key = key
+        self.info = info
+        self.granted = granted
+
+    def __lt__(self, other: "_Waiting") -> bool:
+        return self.key < other.key
+
+
+class TransferScheduler:
+    """
+    Hands out send slots in priority order, fairly between peers.
+
+    ``on_positions`` is an async fn(dict[str, int]) called with the new
+    ``queue_position`` of each queued transfer whose position changed.
+    """
+
+    def __init__(self, on_positions=None):
+        self.max_active = MAX_ACTIVE_TRANSFERS
+        self.max_per_peer = MAX_ACTIVE_PER_PEER
+        self._on_positions = on_positions
+        self._waiting: dict[str, list[_Waiting]] = {}  # Per peer, sorted by key
+        self._active: dict[str, int] = {}  # Running transfers per peer
+        self._turns: deque[str] = deque()  # Peers, least recently served first
+        self._seq = itertools.count()
+
+    @property
+    def active(self) -> int:
+        return sum(self._active.values())
+
+    async def configure(self, max_active: int | None = None, max_per_peer: int | None = None) -> None:
+        """Change the concurrency caps; raising them starts waiting transfers at once."""
+        if max_active is not None:
+            self.max_active = max_active
+        if max_per_peer is not None:
+            self.max_per_peer = max_per_peer
+        await self._changed()
+
+    async def reprioritize(self, transfer_id: str, priority: TransferPriority) -> bool:
+        """Move a queued transfer to another priority class. False if it isn't queued."""
+        for entries in self._waiting.values():
+            for index, entry in enumerate(entries):
+                if entry.info.transfer_id == transfer_id:
+                    del entries[index]
+                    entry.info.priority = priority
+                    entry.key = (_PRIORITY_ORDER[priority],) + entry.key[1:]
+                    bisect.insort(entries, entry)
+                    await self._changed()
+                    return True
+        return False
+
+    @asynccontextmanager
+    async def slot(self, peer_id: str, info: TransferInfo):
+        """Wait, queued, until ``info`` may run; the slot is held until exit."""
+        small = 0 if not info.is_folder and info.file_size <= SCHEDULER_SMALL_FILE else 1
+        key = (_PRIORITY_ORDER[info.priority], small, next(self._seq))
+        entry = _Waiting(key, info, asyncio.get_running_loop().create_future())
+        bisect.insort(self._waiting.setdefault(peer_id, []), entry)
+        if peer_id not in self._turns:
+            self._turns.append(peer_id)
+        try:
+            await self._changed()
+            await entry.granted
+        except BaseException:
+            if entry.granted.done() and not entry.granted.cancelled():
+                await self._release(peer_id)
+            else:
+                self._remove(peer_id, entry)
+                info.queue_position = 0
+                await self._changed()
+            raise
+        try:
+            yield
+        finally:
+            await self._release(peer_id)
+
+    async def _release(self, peer_id: str) -> None:
+        self._active[peer_id] -= 1
+        if not self._active[peer_id]:
+            del self._active[peer_id]
+        await self._changed()
+
+    def _remove(self, peer_id: str, entry: _Waiting) -> None:
+        entries = self._waiting.get(peer_id, [])
+        if entry in entries:
+            entries.remove(entry)
+        if not entries:
+            self._waiting.pop(peer_id, None)
+
+    async def _changed(self) -> None:
+        """Start whatever may run now, then renumber the queue."""
+        while self.active < self.max_active:
+            entry, peer_id = self._pick()
+            if entry is None:
+                break
+            self._remove(peer_id, entry)
+            self._active[peer_id] = self._active.get(peer_id, 0) + 1
+            self._turns.remove(peer_id)
+            self._turns.append(peer_id)
+            entry.info.queue_position = 0
+            entry.granted.set_result(True)
+
+        changed = {}
+        for position, entry in enumerate(self._order(), start=1):
+            if entry.info.queue_position != position:
+                entry.info.queue_position = position
+                changed[entry.info.transfer_id] = position
+        if changed and self._on_positions:
+            await self._on_positions(changed)
+
+    def _pick(self) -> tuple[_Waiting | None, str | None]:
+        """The best waiting transfer whose peer is below its cap."""
+        best = best_peer = None
+        for peer_id in self._turns:
+            entries = self._waiting.get(peer_id)
+            if not entries or self._active.get(peer_id, 0) >= self.max_per_peer:
+                continue
+            # Ties on class go to the peer earliest in turn order
+            if best is None or entries[0].key[:2] < best.key[:2]:
+                best, best_peer = entries[0], peer_id
+        return best, best_peer
+
+    def _order(self) -> list[_Waiting]:
+        """Waiting transfers in the order they would start, ignoring the caps."""
+        queues = {peer_id: deque(self._waiting[peer_id]) for peer_id in self._turns if peer_id in self._waiting}
+        turns = deque(queues)
+        order = []
+        while turns:
+            best_peer = min(turns, key=lambda peer_id: queues[peer_id][0].key[:2])
+            order.append(queues[best_peer].popleft())
+            turns.remove(best_peer)
+            if queues[best_peer]:
+                turns.append(best_peer)
+        return order
@@ -1,26 +1,105 @@
 """
 TCP-based file transfer service.
 
-Handles the wire protocol for sending and receiving files,
-including ECDH handshake, encrypted chunked transfer, pause/resume/cancel,
-and transfer resumption from offset.
+Handles the per-file wire protocol for sending and receiving files over
+session streams (see transfer.session): encrypted chunked transfer,
+pause/resume/cancel, block-hash verified resumption and an end-to-end
+file digest (see transfer.delta), skipping files the receiver already
+has (see transfer.dedup), folders as single transfers (see
+transfer.folder), striping a single file across several parallel
+sessions, and reconnecting to resume a transfer whose connection was
+lost.
 """
 
 import asyncio
+import errno
 import json
 import logging
+import mmap
 import os
+import shutil
+import stat
 import struct
+import threading
 import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
-from config import CHUNK_SIZE, DEVICE_ID, DEVICE_NAME, TRANSFER_PORT_MIN, TRANSFER_PORT_MAX
+from config import (
+    BACKGROUND_PING_INTERVAL,
+    CHUNK_SIZE,
+    COMPRESSION_ENABLED,
+    CRYPTO_BATCH_BYTES,
+    CRYPTO_WORKERS,
+    DEDUP_ENABLED,
+    DEFAULT_STRIPES,
+    DEVICE_ID,
+    DEVICE_NAME,
+    FOLDER_CONCURRENCY,
+    MAX_CHUNK_SIZE,
+    MAX_PIPELINE_DEPTH,
+    MAX_RETRIES,
+    MAX_RETRY_DELAY,
+    MAX_STRIPES,
+    MMAP_MIN_AGE,
+    MMAP_READS,
+    PART_SUFFIX,
+    RECONNECT_WINDOW,
+    RETRY_DELAY,
+    STREAM_QUEUE_DEPTH,
+    STRIPE_JOIN_TIMEOUT,
+    STRIPE_MIN_FILE_SIZE,
+    STRIPE_UNIT,
+    TUNE_INTERVAL,
+    TRANSFER_PORT_MIN,
+    TRANSFER_PORT_MAX,
+)
 from security.crypto import (
-    generate_keypair,
-    derive_shared_key,
-    encrypt_chunk,
-    decrypt_chunk,
+    TAG_SIZE,
+    SessionCipher,
+    compute_join_tag,
+    verify_join_tag,
+)
+from transfer.compression import (
+    RAW,
+    Codec,
+    CompressionStats,
+    choose_codec,
+    compress_chunk,
+    decompress_chunk,
+)
+from transfer.delta import (
+    DIGEST_SIZE,
+    MAX_BLOCKS,
+    MIN_BLOCK_SIZE,
+    FileDigest,
+    block_count,
+    choose_block_size,
+    fill_blocks,
+    hash_blocks,
+    plan_spans,
+)
+from transfer.dedup import ContentIndex, clone_file, link_file
+from transfer.ratelimit import TransferLimit
+from transfer.folder import (
+    DIRECTORY,
+    MAX_MANIFEST_ENTRIES,
+    PACK_HEADER_FORMAT,
+    PACK_HEADER_SIZE,
+    FolderProgress,
+    decode_manifest,
+    encode_manifest,
+    index_manifest,
+    is_packable,
+    next_batch,
+    pack_batches,
+    pack_files,
+    prepare_folder,
+    safe_join,
+    unpack_files,
+    walk_folder,
+    write_packed,
 )
 from transfer.models import (
     FileMetadata,
@@ -29,76 +108,40 @@ from transfer.models import (
     TransferInfo,
     TransferState,
 )
+from transfer.session import PeerSession, SessionPool, SessionStream
+from transfer.tuner import PipelineWindow, TransferTuner
 
 logger = logging.getLogger(__name__)
 
 # --- Wire protocol helpers ---
 
-HEADER_FORMAT = "!BI"  # 1-byte type + 4-byte length (big-endian)
-HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
-
-
-async def send_message(
-    writer: asyncio.StreamWriter, msg_type: int, payload: bytes = b""
-) -> None:
-    """Send a type-length-payload message."""
-    header = struct.pack(HEADER_FORMAT, msg_type, len(payload))
-    writer.write(header + payload)
-    await writer.drain()
-
-
-async def recv_message(
-    reader: asyncio.StreamReader,
-) -> tuple[int, bytes]:
-    """Receive a type-length-payload message. Returns (type, payload)."""
-    header = await reader.readexactly(HEADER_SIZE)
-    msg_type, length = struct.unpack(HEADER_FORMAT, header)
-    payload = b""
-    if length > 0:
-        payload = await reader.readexactly(length)
-    return msg_type, payload
+# Every DATA_CHUNK payload starts with the chunk's absolute file offset
+# and the compression codec applied to it. The header is also
+# authenticated as AES-GCM associated data.
+CHUNK_HEADER_FORMAT = "!QB"
+CHUNK_HEADER_SIZE = struct.calcsize(CHUNK_HEADER_FORMAT)
 
+_PAUSED_STATES = (TransferState.PAUSED, TransferState.PAUSED_BY_PEER)
+_STOPPED_STATES = (TransferState.CANCELLED, TransferState.FAILED)
 
-async def perform_handshake_sender(
-    reader: asyncio.StreamReader,
-    writer: asyncio.StreamWriter,
-) -> bytes:
-    """
-    Perform ECDH handshake as the sender (initiator).
-    Returns the derived AES session key.
-    """
-    private_key, pub_bytes = generate_keypair()
+# errnos meaning the path to the peer failed rather than the transfer itself
+_NETWORK_ERRNOS = frozenset({
+    errno.ECONNREFUSED,
+    errno.ECONNRESET,
+    errno.ECONNABORTED,
+    errno.EPIPE,
+    errno.ETIMEDOUT,
+    errno.ENETDOWN,
+    errno.ENETUNREACH,
+    errno.EHOSTDOWN,
+    errno.EHOSTUNREACH,
+})
 
-    # Send our public key
-    await send_message(writer, MessageType.HANDSHAKE_PUBKEY, pub_bytes)
+# Created on first use; sized by CRYPTO_WORKERS
+_crypto_executor: ThreadPoolExecutor | None = None
 
-    # Receive peer's public key
-    msg_type, peer_pub_bytes = await recv_message(reader)
-    if msg_type != MessageType.HANDSHAKE_PUBKEY:
-        raise ConnectionError(f"Expected HANDSHAKE_PUBKEY, got {msg_type:#x}")
-
-    return derive_shared_key(private_key, peer_pub_bytes)
-
-
-async def perform_handshake_receiver(
-    reader: asyncio.StreamReader,
-    writer: asyncio.StreamWriter,
-) -> bytes:
-    """
-    Perform ECDH handshake as the receiver.
-    Returns the derived AES session key.
-    """
-    private_key, pub_bytes = generate_keypair()
-
-    # Receive peer's public key
-    msg_type, peer_pub_bytes = await recv_message(reader)
-    if msg_type != MessageType.HANDSHAKE_PUBKEY:
-        raise ConnectionError(f"Expected HANDSHAKE_PUBKEY, got {msg_type:#x}")
-
-    # Send our public key
-    await send_message(writer, MessageType.HANDSHAKE_PUBKEY, pub_bytes)
-
-    return derive_shared_key(private_key, peer_pub_bytes)
+# Time the receiver gets to flush its queues and check the file digest
+VERIFY_TIMEOUT = 60.0
 
 
 class SpeedTracker:
@@ -126,8 +169,318 @@ class SpeedTracker:
         return total_bytes / elapsed
 
 
+class ProgressReporter:
+    """
+    Accumulates transferred bytes for one transfer and throttles
+    progress callbacks. Shared by every stripe of a striped transfer.
+    """
+
+    def __init__(self, transfer_info: TransferInfo, progress_callback, interval: float = 0.2):
+        self._info = transfer_info
+        self._callback = progress_callback
+        self._interval = interval
+        self._tracker = SpeedTracker()
+        self._last_report = time.monotonic()
+
+    async def add(self, byte_count: int) -> None:
+        info = self._info
+        info.transferred_bytes += byte_count
+        self._tracker.record(byte_count)
+
+        now = time.monotonic()
+        if now - self._last_report < self._interval:
+            return
+        self._last_report = now
+
+        info.speed_bps = self._tracker.get_speed()
+        info.progress_percent = (
+            info.transferred_bytes / info.file_size * 100
+            if info.file_size > 0
+            else 100
+        )
+        remaining = info.file_size - info.transferred_bytes
+        info.eta_seconds = remaining / info.speed_bps if info.speed_bps > 0 else 0
+        await self._callback(info)
+
+
+class PositionalFile:
+    """
+    A file opened for writes at explicit offsets.
+
+    Uses ``os.pwrite`` where available; on platforms without it (Windows)
+    a lock serialises the seek + write pair so concurrent stripes cannot
+    interleave. ``written_end`` is the end of the furthest write so far
+    (or of the data the file was opened with).
+    """
+
+    def __init__(self, path: str, truncate: bool):
+        flags = os.O_RDWR | os.O_CREAT | getattr(os, "O_BINARY", 0)
+        if truncate:
+            flags |= os.O_TRUNC
+        self._fd = os.open(path, flags, 0o644)
+        self._lock = threading.Lock()
+        self.written_end = os.fstat(self._fd).st_size
+
+    def write_at(self, data: bytes, offset: int) -> None:
+        view = memoryview(data)
+        end = offset + len(view)
+        if hasattr(os, "pwrite"):
+            while view:
+                written = os.pwrite(self._fd, view, offset)
+                view = view[written:]
+                offset += written
+            with self._lock:
+                self.written_end = max(self.written_end, end)
+            return
+        with self._lock:
+            os.lseek(self._fd, offset, os.SEEK_SET)
+            while view:
+                written = os.write(self._fd, view)
+                view = view[written:]
+            self.written_end = max(self.written_end, end)
+
+    def preallocate(self, size: int) -> None:
+        """
+        Reserve disk space for the whole file up front, so it is laid out
+        in as few extents as possible instead of growing chunk by chunk.
+        """
+        if size <= 0 or not hasattr(os, "posix_fallocate"):
+            return
+        try:
+            os.posix_fallocate(self._fd, 0, size)
+        except OSError as e:
+            if e.errno == errno.ENOSPC:
+                raise
+            logger.debug(f"Cannot preallocate: {e}")
+
+    def truncate(self, size: int) -> None:
+        os.ftruncate(self._fd, size)
+        self.written_end = min(self.written_end, size)
+
+    def sync(self) -> None:
+        os.fsync(self._fd)
+
+    def close(self) -> None:
+        os.close(self._fd)
+
+
+def _prepare_part(file_path: str) -> int:
+    """
+    How many bytes of ``file_path`` are already in its .part file.
+
+    An older file at the destination seeds the .part file, so a changed
+    file is received as a delta against it. Runs in a worker thread.
+    """
+    part_path = file_path + PART_SUFFIX
+    if not os.path.exists(part_path) and os.path.isfile(file_path):
+        clone_file(file_path, part_path)
+    try:
+        return os.path.getsize(part_path)
+    except OSError:
+        return 0
+
+
+async def _wait_while_paused(transfer_info: TransferInfo) -> bool:
+    """Wait out a pause; False once the transfer has been stopped instead."""
+    while transfer_info.state in _PAUSED_STATES:
+        await asyncio.wait((transfer_info.state_changed(),))
+    return transfer_info.state not in _STOPPED_STATES
+
+
+async def _unless_stopped(transfer_info: TransferInfo, awaitable) -> tuple[bool, object]:
+    """
+    Await ``awaitable`` unless the transfer is cancelled or fails first.
+
+    Returns (True, result), or (False, None) after cancelling
+    ``awaitable`` because the transfer stopped.
+    """
+    task = asyncio.ensure_future(awaitable)
+    try:
+        while not task.done():
+            if transfer_info.state in _STOPPED_STATES:
+                return False, None
+            await asyncio.wait(
+                (task, transfer_info.state_changed()), return_when=asyncio.FIRST_COMPLETED
+            )
+        return True, task.result()
+    finally:
+        task.cancel()
+
+
+def _connection_lost(error: Exception, streams: list[SessionStream | None]) -> bool:
+    """Whether a transfer failed because its connection went away, not on its own account."""
+    if any(stream.session.is_closed for stream in streams if stream):
+        return True
+    if isinstance(error, (ConnectionRefusedError, ConnectionResetError, ConnectionAbortedError, BrokenPipeError)):
+        return True
+    return isinstance(error, OSError) and error.errno in _NETWORK_ERRNOS
+
+
+async def _back_off(transfer_info: TransferInfo, state_callback, attempt: int, error: Exception) -> bool:
+    """
+    (Sender side) Show a transfer as RECONNECTING and wait before
+    reconnect ``attempt`` (from 1), doubling the delay each time.
+    False if the transfer was cancelled meanwhile.
+    """
+    delay = min(RETRY_DELAY * 2 ** (attempt - 1), MAX_RETRY_DELAY)
+    logger.warning(
+        f"Lost connection sending {transfer_info.file_name}: {error}; "
+        f"reconnecting in {delay}s ({attempt}/{MAX_RETRIES})"
+    )
+    transfer_info.state = TransferState.RECONNECTING
+    transfer_info.error_message = str(error)
+    transfer_info.speed_bps = 0
+    transfer_info.eta_seconds = 0
+    await state_callback(transfer_info)
+    running, _ = await _unless_stopped(transfer_info, asyncio.sleep(delay))
+    return running
+
+
+def _negotiate_stripes(requested: int | None, file_size: int) -> int:
+    """Pick how many connections the sender asks for."""
+    if requested is None:
+        requested = DEFAULT_STRIPES if file_size >= STRIPE_MIN_FILE_SIZE else 1
+    # No point opening more connections than there are stripe units
+    unit_count = max(1, -(-file_size // STRIPE_UNIT))
+    return max(1, min(requested, MAX_STRIPES, unit_count))
+
+
+class _BufferedSource:
+    """Chunks read with seek() + read() into new bytes objects."""
+
+    def __init__(self, f):
+        self._f = f
+
+    def read(self, offset: int, size: int) -> bytes:
+        self._f.seek(offset)
+        return self._f.read(size)
+
+    def close(self) -> None:
+        pass
+
+
+class _MappedSource:
+    """
+    Chunks as memoryview slices of the memory-mapped file.
+
+    Encryption and hashing read the page cache directly: no read()
+    syscall and no copy into a new bytes object per chunk.
+
+    A mapping is not safe against another process truncating the file:
+    touching a page past the new end raises SIGBUS, which kills the
+    process, and Python cannot catch it. ``read()`` trims slices to the
+    size at the time of the call, but the slice is hashed and encrypted
+    later, in other threads, so a truncation in between still faults.
+    ``_open_source`` therefore only maps files that have not been
+    modified for MMAP_MIN_AGE seconds; files still being written are
+    read with buffered reads.
+    """
+
+    def __init__(self, f):
+        self._fd = f.fileno()
+        self._map = mmap.mmap(self._fd, 0, access=mmap.ACCESS_READ)
+        if hasattr(mmap, "MADV_SEQUENTIAL"):
+            self._map.madvise(mmap.MADV_SEQUENTIAL)
+        self._view = memoryview(self._map)
+
+    def read(self, offset: int, size: int) -> memoryview:
+        # Stop at the current size; this narrows, but cannot close, the
+        # window for a concurrent truncation (see the class docstring)
+        end = min(offset + size, len(self._view), os.fstat(self._fd).st_size)
+        return self._view[offset:max(offset, end)]
+
+    def close(self) -> None:
+        self._view.release()
+        try:
+            self._map.close()
+        except BufferError:
+            pass  # Chunks still being sealed; the map closes once they are freed
+
+
+def _open_source(f) -> _BufferedSource | _MappedSource:
+    """
+    A mapped source for regular files at rest, buffered reads for
+    anything else, including files modified within MMAP_MIN_AGE seconds.
+    """
+    if MMAP_READS:
+        try:
+            st = os.fstat(f.fileno())
+            at_rest = time.time() - st.st_mtime >= MMAP_MIN_AGE
+            if stat.S_ISREG(st.st_mode) and st.st_size > 0 and at_rest:
+                return _MappedSource(f)
+        except (OSError, ValueError) as e:
+            logger.info(f"Cannot map {f.name}, using buffered reads: {e}")
+    return _BufferedSource(f)
+
+
+def _read_chunks(source, plan: list[tuple[int, int]], digest: FileDigest) -> list:
+    """Read consecutive (offset, size) chunks; stops early at end of file."""
+    chunks = []
+    for offset, size in plan:
+        chunk = source.read(offset, size)
+        if not chunk:
+            break
+        # Hashed while the chunk is hot in cache, and in file order: no
+        # second pass over the file
+        digest.update(offset, chunk)
+        chunks.append(chunk)
+    return chunks
+
+
+def _crypto_pool() -> ThreadPoolExecutor:
+    """The worker pool shared by every transfer's encryption stage."""
+    global _crypto_executor
+    if _crypto_executor is None:
+        _crypto_executor = ThreadPoolExecutor(
+            max_workers=_crypto_workers(), thread_name_prefix="crypto"
+        )
+    return _crypto_executor
+
+
+def _crypto_workers() -> int:
+    return CRYPTO_WORKERS or os.cpu_count() or 1
+
+
+def _seal_batch(
+    cipher: SessionCipher,
+    stream_id: int,
+    codec: Codec | None,
+    offsets: list[int],
+    seqs: list[int],
+    chunks: list[bytes],
+) -> tuple[list, float, float]:
+    """
+    Compress (with a codec) and encrypt a batch of chunks in one worker
+    thread. Sequence numbers were reserved in order on the event loop.
+
+    Returns ([(chunk length, wire length, compression CPU seconds,
+    frame parts)], compress seconds, encrypt seconds).
+    """
+    frames = []
+    compress_seconds = encrypt_seconds = 0.0
+    for offset, seq, chunk in zip(offsets, seqs, chunks):
+        started = time.perf_counter()
+        codec_id, body, cpu_seconds = RAW, chunk, 0.0
+        if codec:
+            codec_id, body, cpu_seconds = compress_chunk(codec, chunk)
+        compressed = time.perf_counter()
+        chunk_header = struct.pack(CHUNK_HEADER_FORMAT, offset, codec_id)
+        ciphertext = cipher.encrypt(stream_id, seq, body, chunk_header)
+        seq_header = struct.pack(SessionCipher.SEQUENCE_FORMAT, seq)
+        encrypt_seconds += time.perf_counter() - compressed
+        compress_seconds += compressed - started
+        # Sent as one vectored frame: no concatenation copies
+        frames.append((len(chunk), len(body), cpu_seconds, (chunk_header, seq_header, ciphertext)))
+    return frames, compress_seconds, encrypt_seconds
+
+
+def _write_chunk(target: PositionalFile, digest: FileDigest, data, offset: int) -> None:
+    target.write_at(data, offset)
+    digest.update(offset, data)
+
+
 async def _monitor_remote_commands(
-    reader: asyncio.StreamReader,
+    stream: SessionStream,
     transfer_info: TransferInfo,
     state_callback,
 ) -> None:
@@ -138,12 +491,9 @@ async def _monitor_remote_commands(
             TransferState.FAILED,
             TransferState.CANCELLED,
         ):
-            # We use a small timeout or just wait. recv_message awaits header.
             # Only READ messages here.
             try:
-                msg_type, _ = await recv_message(reader)
-            except asyncio.IncompleteReadError:
-                break
+                msg_type, payload = await stream.recv()
             except Exception:
                 break
 
@@ -160,15 +510,27 @@ async def _monitor_remote_commands(
                 transfer_info.state = TransferState.CANCELLED
                 await state_callback(transfer_info)
                 return
+            elif msg_type == MessageType.ERROR:
+                reason = payload.decode("utf-8", "replace")
+                logger.info(f"Receiver failed {transfer_info.file_name}: {reason}")
+                transfer_info.state = TransferState.FAILED
+                transfer_info.error_message = f"Receiver error: {reason}"
+                await state_callback(transfer_info)
+                return
     except asyncio.CancelledError:
         pass
 
 
 async def _monitor_local_state(
-    writer: asyncio.StreamWriter,
+    stream: SessionStream,
     transfer_info: TransferInfo,
 ) -> None:
-    """(Receiver side) Watch for local state changes and send commands."""
+    """
+    Watch for local state changes and send commands to the peer.
+
+    Used by both sides on the control stream; data stripes never
+    carry PAUSE/RESUME/CANCEL.
+    """
     last_state = transfer_info.state
     try:
         while transfer_info.state not in (
@@ -179,22 +541,22 @@ async def _monitor_local_state(
         ):
             # Check for state changes initiated by UI (TransferManager)
             current = transfer_info.state
-            
+
             if current != last_state:
                 if current == TransferState.PAUSED and last_state == TransferState.TRANSFERRING:
-                    logger.info(f"Sending PAUSE to sender for {transfer_info.file_name}")
-                    await send_message(writer, MessageType.PAUSE)
+                    logger.info(f"Sending PAUSE to peer for {transfer_info.file_name}")
+                    await stream.send(MessageType.PAUSE)
                 elif current == TransferState.TRANSFERRING and last_state == TransferState.PAUSED:
-                    logger.info(f"Sending RESUME to sender for {transfer_info.file_name}")
-                    await send_message(writer, MessageType.RESUME)
-                elif current == TransferState.CANCELLED:
-                    logger.info(f"Sending CANCEL to sender for {transfer_info.file_name}")
-                    await send_message(writer, MessageType.CANCEL)
-                    return # Exit loop on cancel
+                    logger.info(f"Sending RESUME to peer for {transfer_info.file_name}")
+                    await stream.send(MessageType.RESUME)
 
                 last_state = current
-            
-            await asyncio.sleep(0.1)
+
+            await asyncio.wait((transfer_info.state_changed(),))
+
+        if transfer_info.state == TransferState.CANCELLED:
+            logger.info(f"Sending CANCEL to peer for {transfer_info.file_name}")
+            await stream.send(MessageType.CANCEL)
 
     except asyncio.CancelledError:
         pass
@@ -202,7 +564,241 @@ async def _monitor_local_state(
         logger.error(f"Local state monitor error: {e}")
 
 
+async def _open_stripe(
+    session: PeerSession,
+    transfer_id: str,
+    stripe_index: int,
+    control_key: bytes,
+) -> SessionStream:
+    """
+    (Sender side) Open an additional data stream for a striped transfer
+    on another session to the same peer.
+
+    The stream proves it belongs to the transfer with a tag keyed by the
+    control session's key.
+    """
+    stream = session.open_stream()
+    try:
+        join = {
+            "transfer_id": transfer_id,
+            "stripe": stripe_index,
+            "tag": compute_join_tag(control_key, transfer_id, stripe_index).hex(),
+        }
+        await stream.send(MessageType.STRIPE_JOIN, json.dumps(join).encode("utf-8"))
+
+        msg_type, _ = await stream.recv()
+        if msg_type != MessageType.ACCEPT:
+            raise ConnectionError(f"Stripe {stripe_index} refused by receiver ({msg_type:#x})")
+    except BaseException:
+        stream.close()
+        raise
+    return stream
+
+
+async def _send_stripe(
+    stream: SessionStream,
+    file_path: str,
+    spans: list[tuple[int, int]],
+    transfer_info: TransferInfo,
+    progress: ProgressReporter,
+    tuner: TransferTuner,
+    digest: FileDigest,
+    codec: Codec | None = None,
+    compression: CompressionStats | None = None,
+    rate_limit: TransferLimit | None = None,
+) -> bool:
+    """
+    (Sender side) Stream the given (start, end) spans over one session stream.
+
+    Spans are sent in increasing order, each as chunks of the tuner's
+    current size. With a codec,
+    chunks that look compressible are compressed before encryption.
+    Every chunk read is fed to ``digest``.
+
+    Chunks are read in batches, one thread hop per batch, and each batch
+    is compressed and encrypted on the shared crypto pool, so several
+    batches (of this and other transfers) are sealed at once on
+    different cores. The queue of pending batches is the reorder buffer:
+    frames go out in the order their sequence numbers were reserved.
+
+    Returns True once every chunk is sent, False if the transfer was
+    cancelled or failed meanwhile.
+    """
+    cipher = stream.session.cipher
+    loop = asyncio.get_running_loop()
+    workers = _crypto_workers()
+    # Batches being sealed or waiting to be sent, in sequence order
+    queue = asyncio.Queue()
+    # Chunks being read, encrypted, queued or sent; sized by the tuner
+    window = PipelineWindow(tuner.depth)
+    tuned_version = 0
+    sources = []
+
+    async def _disk_producer():
+        try:
+            with open(file_path, "rb") as f:
+                source = _open_source(f)
+                sources.append(source)
+                for span_start, span_end in spans:
+                    chunk_offset = span_start
+                    while chunk_offset < span_end:
+                        if not await _wait_while_paused(transfer_info):
+                            return
+
+                        # Enough chunks per batch to amortise the thread hop,
+                        # but few enough that every worker can get a batch
+                        batch_size = max(1, min(
+                            CRYPTO_BATCH_BYTES // tuner.chunk_size, window.size // workers
+                        ))
+                        await window.acquire()
+                        plan = []
+                        while chunk_offset < span_end and len(plan) < batch_size:
+                            if plan and not window.try_acquire():
+                                break
+                            size = min(tuner.chunk_size, span_end - chunk_offset)
+                            plan.append((chunk_offset, size))
+                            chunk_offset += size
+
+                        started = time.monotonic()
+                        chunks = await asyncio.to_thread(_read_chunks, source, plan, digest)
+                        tuner.record("read", sum(len(c) for c in chunks), time.monotonic() - started)
+                        for _ in range(len(plan) - len(chunks)):
+                            window.release()
+                        if chunks:
+                            offsets = [offset for offset, _ in plan[:len(chunks)]]
+                            seqs = [cipher.next_send_seq(stream.stream_id) for _ in chunks]
+                            await queue.put(loop.run_in_executor(
+                                _crypto_pool(), _seal_batch,
+                                cipher, stream.stream_id, codec, offsets, seqs, chunks,
+                            ))
+                        if len(chunks) < len(plan):
+                            # The file shrank; the digest check reports it
+                            await queue.put(None)
+                            return
+            await queue.put(None)
+        except Exception as e:
+            await queue.put(e)
+
+    producer_task = asyncio.create_task(_disk_producer())
+
+    try:
+        while True:
+            if not await _wait_while_paused(transfer_info):
+                return False
+            running, batch = await _unless_stopped(transfer_info, queue.get())
+            if not running:
+                return False
+
+            if isinstance(batch, Exception):
+                raise batch
+            if batch is None:
+                break
+
+            frames, compress_seconds, encrypt_seconds = await batch
+            batch_bytes = sum(frame[0] for frame in frames)
+            if codec:
+                tuner.record("compress", batch_bytes, compress_seconds / workers)
+            # Batches are sealed in parallel: per-worker time overstates the stage
+            tuner.record("encrypt", batch_bytes, encrypt_seconds / workers)
+
+            for chunk_len, wire_len, cpu_seconds, parts in frames:
+                if compression:
+                    compression.record(chunk_len, wire_len, cpu_seconds)
+                if rate_limit:
+                    wire_bytes = sum(map(len, parts))
+                    rate_limit.record_sent(wire_bytes)
+                    if rate_limit.limited:
+                        running, _ = await _unless_stopped(transfer_info, rate_limit.consume(wire_bytes))
+                        if not running:
+                            return False
+                started = time.monotonic()
+                if not stream.has_credit:
+                    # The receiver is behind; wait for it unless the transfer stops
+                    running, _ = await _unless_stopped(transfer_info, stream.wait_for_credit())
+                    if not running:
+                        return False
+                await stream.send(MessageType.DATA_CHUNK, *parts)
+                tuner.record("send", chunk_len, time.monotonic() - started)
+                window.release()
+                await progress.add(chunk_len)
+
+            # Apply (and announce) the latest tuning decision
+            tuner.maybe_retune()
+            if tuner.version != tuned_version:
+                tuned_version = tuner.version
+                window.resize(tuner.depth)
+                await stream.send(MessageType.TUNE, tuner.describe())
+
+        return True
+    finally:
+        producer_task.cancel()
+        for source in sources:
+            source.close()
+
+
+async def _sample_rtt(
+    session: PeerSession, tuner: TransferTuner | None, rate_limit: TransferLimit | None = None
+) -> None:
+    """
+    Ping the peer once per tuning interval for the tuner's RTT estimate,
+    and more often in background mode, whose rate follows the RTT.
+    """
+    while True:
+        background = rate_limit is not None and rate_limit.background
+        await asyncio.sleep(BACKGROUND_PING_INTERVAL if background else TUNE_INTERVAL)
+        backlog = session.send_backlog
+        try:
+            rtt = await session.ping()
+        except asyncio.TimeoutError:
+            continue
+        if tuner:
+            tuner.observe_rtt(rtt)
+        if rate_limit:
+            rate_limit.observe_rtt(rtt, backlog)
+
+
+async def _finish_transfer(
+    transfer_info: TransferInfo,
+    state_callback,
+    file_path: str,
+    peer_identity: tuple | None,
+    trust_store,
+    content_index: ContentIndex | None,
+) -> None:
+    """Mark a transfer COMPLETED on either side and remember what it proved."""
+    if peer_identity and trust_store:
+        trust_store.add_trusted_peer(*peer_identity)
+    if content_index and transfer_info.digest:
+        content_index.add(file_path, transfer_info.digest)
+
+    transfer_info.state = TransferState.COMPLETED
+    transfer_info.progress_percent = 100.0
+    transfer_info.speed_bps = 0
+    transfer_info.eta_seconds = 0
+    await state_callback(transfer_info)
+
+
+async def _content_digest(
+    file_path: str,
+    file_size: int,
+    content_index: ContentIndex,
+) -> tuple[str, bytes | None]:
+    """
+    (Sender side) The file's digest, for the receiver to look up.
+
+    Reuses the indexed digest of an unchanged file; otherwise hashes the
+    file and also returns its block hashes, which resume can reuse.
+    """
+    digest = content_index.digest_of(file_path)
+    if digest:
+        return digest, None
+    block_size = choose_block_size(file_size)
+    leaves = await asyncio.to_thread(hash_blocks, file_path, file_size, block_size)
+    return FileDigest(file_size, block_size, leaves).root().hex(), leaves
+
+
 async def send_file(
+    session_pool: SessionPool,
     peer_ip: str,
     peer_port: int,
     file_path: str,
@@ -211,207 +807,1117 @@ async def send_file(
     state_callback,
     identity_service = None,
     trust_store = None,
+    content_index: ContentIndex | None = None,
+    stripes: int | None = None,
+    compress: bool | None = None,
+    session: PeerSession | None = None,
+    folder_id: str = "",
+    relative_path: str = "",
+    rate_limit: TransferLimit | None = None,
 ) -> None:
     """
-    Send a single file to a peer.
+    Send a single file to a peer over a pooled session.
+
+    If the connection is lost, the transfer shows as RECONNECTING, waits
+    RETRY_DELAY (doubling per attempt) and sends its METADATA again over
+    a new session. The receiver takes the transfer up without a new
+    prompt, and block-hash resume skips what already reached its .part
+    file. It fails after MAX_RETRIES attempts in a row that got no
+    further.
 
     Args:
+        session_pool: Pool providing authenticated sessions to the peer.
         peer_ip: IP address of the receiver.
         peer_port: TCP port the receiver is listening on.
         file_path: Local path of the file to send.
         transfer_info: TransferInfo object (mutated in-place for progress).
         progress_callback: async fn(transfer_info) called on progress.
         state_callback: async fn(transfer_info) called on state change.
+        content_index: Digests of files already sent; with
+            DEDUP_ENABLED, lets the receiver skip files it has.
+        stripes: Parallel sessions to request; None picks a default
+            based on file size. The receiver may grant fewer.
+        compress: Compress chunks with a codec both peers support; None
+            uses COMPRESSION_ENABLED.
+        session: Session to use instead of one from the pool; the file
+            is then not retried on its own if the session is lost.
+        folder_id: Send as a member of this folder transfer, whose
+            control stream carries pause, resume and cancel.
+        relative_path: The member's path in the folder's manifest.
+        rate_limit: Bandwidth limits the file's chunks are paid from.
     """
-    reader: asyncio.StreamReader | None = None
-    writer: asyncio.StreamWriter | None = None
-    monitor_task: asyncio.Task | None = None
-    producer_task: asyncio.Task | None = None
+    # Kept across reconnects: the file is hashed for dedup once, and a
+    # new attempt offers the block digests the last one built in memory
+    content_digest, file_leaves = "", None
+    digest: FileDigest | None = None
+    may_reconnect = session is None  # Folder members are resumed by their folder
+    failures = 0
+    progress_mark = 0
+
+    while True:
+        stream: SessionStream | None = None
+        stripe_streams: list[SessionStream] = []
+        monitor_task: asyncio.Task | None = None
+        relay_task: asyncio.Task | None = None
+        rtt_task: asyncio.Task | None = None
+        hash_task: asyncio.Task | None = None
+        digest_task: asyncio.Task | None = None
+        stripe_tasks: list[asyncio.Task] = []
+        lost: Exception | None = None
+
+        try:
+            if transfer_info.state != TransferState.RECONNECTING:
+                transfer_info.state = TransferState.CONNECTING
+                await state_callback(transfer_info)
 
-    try:
-        transfer_info.state = TransferState.CONNECTING
-        await state_callback(transfer_info)
+            # Hash the file for dedup while the session comes up
+            if DEDUP_ENABLED and content_index and not content_digest:
+                digest_task = asyncio.create_task(
+                    _content_digest(file_path, transfer_info.file_size, content_index)
+                )
 
-        reader, writer = await asyncio.open_connection(peer_ip, peer_port)
+            # 1. Reuse (or establish) an authenticated session to the peer
+            if may_reconnect:
+                [session] = await session_pool.acquire(peer_ip, peer_port)
+                if transfer_info.state == TransferState.RECONNECTING:
+                    transfer_info.reconnects += 1
+            if digest_task:
+                content_digest, file_leaves = await digest_task
+            stream = session.open_stream()
+            transfer_info.cipher_suite = session.cipher.suite
+            if compress is None:
+                compress = COMPRESSION_ENABLED
+            # Codecs were negotiated in the session's SESSION_HELLO exchange
+            codec = choose_codec(session.peer_codecs) if compress else None
+
+            # 2. Send metadata
+            metadata = FileMetadata(
+                transfer_id=transfer_info.transfer_id,
+                file_name=transfer_info.file_name,
+                file_size=transfer_info.file_size,
+                sender_device_id=identity_service.public_id if identity_service else DEVICE_ID,
+                sender_device_name=identity_service.alias if identity_service else DEVICE_NAME,
+                stripes=_negotiate_stripes(stripes, transfer_info.file_size),
+                compression=codec.name if codec else "",
+                content_digest=content_digest,
+                folder_id=folder_id,
+                relative_path=relative_path,
+            )
+            metadata_json = json.dumps(metadata.model_dump()).encode("utf-8")
+            await stream.send(MessageType.METADATA, metadata_json)
+
+            # 3. Wait for accept/reject
+            msg_type, payload = await stream.recv()
+            if msg_type == MessageType.REJECT:
+                transfer_info.state = TransferState.REJECTED
+                await state_callback(transfer_info)
+                return
+            if msg_type != MessageType.ACCEPT:
+                raise ConnectionError(f"Expected ACCEPT/REJECT, got {msg_type:#x}")
 
-        # 1. ECDH Handshake
-        session_key = await perform_handshake_sender(reader, writer)
+            accept_data = {}
+            if payload:
+                try:
+                    accept_data = json.loads(payload.decode('utf-8'))
+                except ValueError as e:
+                    logger.warning(f"Malformed ACCEPT payload: {e}")
+
+            # The receiver's identity key was verified when the session was set
+            # up; it reveals its real name only once it accepts a transfer.
+            peer_identity = None
+            real_name = accept_data.get('device_name')
+            if real_name and session.peer_public_key:
+                peer_identity = (transfer_info.peer_device_id, real_name, session.peer_public_key)
+                transfer_info.peer_device_name = real_name
+                await state_callback(transfer_info)
 
-        # 2. Send metadata
-        signature = ""
-        pub_key = ""
-        if identity_service:
-            pub_key = identity_service.get_public_bytes().hex()
-            signature = identity_service.sign(transfer_info.transfer_id.encode('utf-8')).hex()
-
-        metadata = FileMetadata(
-            transfer_id=transfer_info.transfer_id,
-            file_name=transfer_info.file_name,
-            file_size=transfer_info.file_size,
-            sender_device_id=identity_service.public_id if identity_service else DEVICE_ID,
-            sender_device_name=identity_service.alias if identity_service else DEVICE_NAME,
-            identity_public_key=pub_key,
-            identity_signature=signature,
-        )
-        metadata_json = json.dumps(metadata.model_dump()).encode("utf-8")
-        await send_message(writer, MessageType.METADATA, metadata_json)
+            if accept_data.get("deduplicated"):
+                # The receiver already had this content and linked it into place
+                transfer_info.deduplicated = True
+                transfer_info.transferred_bytes = transfer_info.file_size
+                transfer_info.resumed_bytes = transfer_info.file_size
+                transfer_info.digest = content_digest
+                await _finish_transfer(
+                    transfer_info, state_callback, file_path, peer_identity, trust_store, content_index
+                )
+                return
+
+            stripe_count = max(1, min(int(accept_data.get("stripes", 1)), metadata.stripes))
+            # The receiver bounds the tuner: the frames and buffering it will take
+            tuner = TransferTuner(
+                transfer_info,
+                max_chunk_size=int(accept_data.get("max_chunk_size", CHUNK_SIZE)),
+                max_depth=int(accept_data.get("max_depth", STREAM_QUEUE_DEPTH)),
+            )
+
+            # 4. Compare block hashes of the receiver's existing copy with ours.
+            # Hash our copy while the receiver hashes its own.
+            resume_length = max(0, min(int(accept_data.get("resume_length", 0)), transfer_info.file_size))
+            block_size = max(MIN_BLOCK_SIZE, int(accept_data.get("block_size", MIN_BLOCK_SIZE)))
+            if block_count(transfer_info.file_size, block_size) > MAX_BLOCKS:
+                raise ConnectionError(f"Block size {block_size} too small for this file")
+            local_hashes = b""
+            if file_leaves is not None and block_size == choose_block_size(transfer_info.file_size):
+                # Hashed up front for dedup; a block cut short by resume_length
+                # won't match, and is re-sent whole anyway
+                local_hashes = file_leaves[:block_count(resume_length, block_size) * DIGEST_SIZE]
+            elif digest is not None and digest.block_size == block_size:
+                # Reconnected: hash only the blocks the last attempt didn't
+                hash_task = asyncio.create_task(asyncio.to_thread(
+                    fill_blocks, file_path, digest.leaves(block_count(resume_length, block_size)),
+                    resume_length, block_size,
+                ))
+            elif resume_length:
+                hash_task = asyncio.create_task(
+                    asyncio.to_thread(hash_blocks, file_path, resume_length, block_size)
+                )
+            msg_type, remote_hashes = await stream.recv()
+            if msg_type != MessageType.BLOCK_HASHES:
+                raise ConnectionError(f"Expected BLOCK_HASHES, got {msg_type:#x}")
+            if len(remote_hashes) != block_count(resume_length, block_size) * DIGEST_SIZE:
+                raise ConnectionError("Malformed BLOCK_HASHES")
+            if hash_task:
+                local_hashes = await hash_task
+            spans = plan_spans(local_hashes, remote_hashes, block_size, resume_length, transfer_info.file_size)
+            # Blocks we don't send keep the digests both sides just compared
+            digest = FileDigest(transfer_info.file_size, block_size, local_hashes)
+            resumed = transfer_info.file_size - sum(end - start for start, end in spans)
+            await stream.send(MessageType.RESUME_PLAN, struct.pack("!Q", resumed))
+            if resume_length:
+                logger.info(
+                    f"{transfer_info.file_name}: {resumed} of {transfer_info.file_size} bytes "
+                    f"already on the receiver"
+                )
 
-        # 3. Wait for accept/reject
-        msg_type, payload = await recv_message(reader)
-        if msg_type == MessageType.REJECT:
-            transfer_info.state = TransferState.REJECTED
+            # 5. Attach extra stripes on other sessions (the control stream is stripe 0)
+            if stripe_count > 1:
+                sessions = await session_pool.acquire(peer_ip, peer_port, stripe_count)
+                others = [s for s in sessions if s is not session][:stripe_count - 1]
+                for index, other in enumerate(others, start=1):
+                    stripe_streams.append(await _open_stripe(
+                        other, transfer_info.transfer_id, index, session.session_key
+                    ))
+                stripe_count = 1 + len(stripe_streams)
+
+            # 6. Start sending chunks
+            transfer_info.state = TransferState.TRANSFERRING
+            transfer_info.error_message = None
+            transfer_info.transferred_bytes = resumed
+            transfer_info.resumed_bytes = resumed
+            transfer_info.stripes = stripe_count
+            transfer_info.chunk_size = CHUNK_SIZE
+            transfer_info.pipeline_depth = STREAM_QUEUE_DEPTH
             await state_callback(transfer_info)
+
+            # START MONITORING FOR REMOTE COMMANDS (PAUSE/RESUME from receiver)
+            monitor_task = asyncio.create_task(
+                _monitor_remote_commands(stream, transfer_info, state_callback)
+            )
+            if not folder_id:
+                # Relay local PAUSE/RESUME/CANCEL over the control stream
+                relay_task = asyncio.create_task(
+                    _monitor_local_state(stream, transfer_info)
+                )
+
+            # Files that fit in one chunk are never retuned; skip the round trip
+            if transfer_info.file_size - resumed > tuner.chunk_size:
+                # Start from an RTT measured before our own data queues up
+                try:
+                    tuner.observe_rtt(await session.ping())
+                except asyncio.TimeoutError:
+                    logger.warning(f"No PONG from {peer_ip}; tuning without RTT")
+                rtt_task = asyncio.create_task(_sample_rtt(session, tuner, rate_limit))
+
+            progress = ProgressReporter(transfer_info, progress_callback)
+            compression = CompressionStats(transfer_info, codec.name) if codec else None
+            # Stripe i carries spans i, i+N, i+2N, ... of what is left to send
+            stripe_tasks = [
+                asyncio.create_task(_send_stripe(
+                    data_stream,
+                    file_path,
+                    spans[index::stripe_count],
+                    transfer_info,
+                    progress,
+                    tuner,
+                    digest,
+                    codec,
+                    compression,
+                    rate_limit,
+                ))
+                for index, data_stream in enumerate([stream, *stripe_streams])
+            ]
+            results = await asyncio.gather(*stripe_tasks)
+            if not all(results):
+                return
+
+            # 7. Completion: the control stream's TRANSFER_COMPLETE carries the
+            # file digest, which the receiver checks before acknowledging
+            root = digest.root()
+            if root is None:
+                raise RuntimeError("File changed while it was being sent")
+            for data_stream in stripe_streams:
+                await data_stream.send(MessageType.TRANSFER_COMPLETE)
+            monitor_task.cancel()
+            await stream.send(MessageType.TRANSFER_COMPLETE, root)
+            while True:
+                msg_type, payload = await asyncio.wait_for(stream.recv(), timeout=VERIFY_TIMEOUT)
+                if msg_type == MessageType.TRANSFER_COMPLETE:
+                    break
+                if msg_type == MessageType.ERROR:
+                    raise ConnectionError(f"Receiver error: {payload.decode('utf-8', 'replace')}")
+                if msg_type == MessageType.CANCEL:
+                    transfer_info.state = TransferState.CANCELLED
+                    await state_callback(transfer_info)
+                    return
+                # A PAUSE or RESUME after the last chunk changes nothing
+
+            transfer_info.digest = root.hex()
+            await _finish_transfer(
+                transfer_info, state_callback, file_path, peer_identity, trust_store, content_index
+            )
+
+        except asyncio.CancelledError:
+            transfer_info.state = TransferState.CANCELLED
+            await state_callback(transfer_info)
+        except Exception as e:
+            if (
+                may_reconnect
+                and transfer_info.state not in _STOPPED_STATES
+                and _connection_lost(e, [stream, *stripe_streams])
+            ):
+                # Retried below, once this attempt is torn down
+                lost = e
+            else:
+                logger.error(f"Send error for {transfer_info.file_name}: {e}")
+                if transfer_info.state != TransferState.CANCELLED:
+                    transfer_info.state = TransferState.FAILED
+                    transfer_info.error_message = str(e)
+                    await state_callback(transfer_info)
+                    if stream:
+                        await _notify_peer(stream, MessageType.ERROR, str(e).encode("utf-8"))
+        finally:
+            for task in stripe_tasks:
+                task.cancel()
+            if monitor_task:
+                monitor_task.cancel()
+            if relay_task:
+                relay_task.cancel()
+            if rtt_task:
+                rtt_task.cancel()
+            if hash_task:
+                hash_task.cancel()
+            if digest_task:
+                digest_task.cancel()
+
+            if stream and transfer_info.state == TransferState.CANCELLED:
+                # Best effort: tell the receiver even if our task was cancelled
+                await _notify_peer(stream, MessageType.CANCEL)
+
+            # The sessions stay open in the pool for the next transfer
+            for s in [*stripe_streams, stream]:
+                if s:
+                    s.close()
+
+        if lost is None:
+            return
+        # Only attempts in a row that got no further count against MAX_RETRIES
+        if transfer_info.transferred_bytes > progress_mark:
+            progress_mark = transfer_info.transferred_bytes
+            failures = 0
+        failures += 1
+        if failures > MAX_RETRIES:
+            logger.error(f"Send error for {transfer_info.file_name}: {lost}")
+            transfer_info.state = TransferState.FAILED
+            transfer_info.error_message = f"Connection lost: {lost}"
+            await state_callback(transfer_info)
+            return
+        if not await _back_off(transfer_info, state_callback, failures, lost):
             return
-        if msg_type != MessageType.ACCEPT:
-            raise ConnectionError(f"Expected ACCEPT/REJECT, got {msg_type:#x}")
 
-        peer_identity = None
-        if payload and trust_store:
-            try:
-                data = json.loads(payload.decode('utf-8'))
-                pk = data.get('identity_public_key')
-                sig = data.get('identity_signature')
-                real_name = data.get('device_name')
-                
-                from cryptography.hazmat.primitives.asymmetric import ed25519
-                pub_key_obj = ed25519.Ed25519PublicKey.from_public_bytes(bytes.fromhex(pk))
-                pub_key_obj.verify(bytes.fromhex(sig), transfer_info.transfer_id.encode('utf-8'))
-                peer_identity = (transfer_info.peer_device_id, real_name, pk)
-                transfer_info.peer_device_name = real_name
-                await state_callback(transfer_info)
-            except Exception as e:
-                logger.warning(f"Failed to verify receiver identity: {e}")
 
-        # 4. Receive resume offset
-        msg_type, offset_data = await recv_message(reader)
-        if msg_type != MessageType.RESUME_OFFSET:
-            raise ConnectionError(f"Expected RESUME_OFFSET, got {msg_type:#x}")
-        offset = struct.unpack("!Q", offset_data)[0]
+async def _mirror_folder_state(folder: FolderProgress) -> None:
+    """
+    Apply a folder's state to its member files until the folder ends.
 
-        # 5. Start sending chunks
-        transfer_info.state = TransferState.TRANSFERRING
-        transfer_info.transferred_bytes = offset
-        await state_callback(transfer_info)
+    Returns once the folder is cancelled or failed, after stopping the
+    members on this side.
+    """
+    info = folder.transfer_info
+    while info.state not in _STOPPED_STATES:
+        folder.mirror(info.state)
+        await asyncio.wait((info.state_changed(),))
+    folder.mirror(TransferState.CANCELLED)
+
+
+async def _send_packed(
+    stream: SessionStream,
+    folder_path: str,
+    files: list[tuple[str, int]],
+    folder: FolderProgress,
+    rate_limit: TransferLimit | None = None,
+) -> None:
+    """(Sender side) Send small member files, many per PACKED frame, on the folder's stream."""
+    transfer_info = folder.transfer_info
+    cipher = stream.session.cipher
+    for batch in pack_batches(files):
+        if not await _wait_while_paused(transfer_info):
+            return
 
-        # START MONITORING FOR REMOTE COMMANDS (PAUSE/RESUME from receiver)
-        monitor_task = asyncio.create_task(
-            _monitor_remote_commands(reader, transfer_info, state_callback)
+        body, packed, failures = await asyncio.to_thread(pack_files, folder_path, batch)
+        folder.failures.extend(failures)
+        if not packed:
+            continue
+        header = struct.pack(PACK_HEADER_FORMAT, len(packed))
+        seq = cipher.next_send_seq(stream.stream_id)
+        ciphertext = await asyncio.to_thread(cipher.encrypt, stream.stream_id, seq, body, header)
+        if rate_limit:
+            rate_limit.record_sent(len(ciphertext))
+            if rate_limit.limited:
+                running, _ = await _unless_stopped(transfer_info, rate_limit.consume(len(ciphertext)))
+                if not running:
+                    return
+        if not stream.has_credit:
+            running, _ = await _unless_stopped(transfer_info, stream.wait_for_credit())
+            if not running:
+                return
+        await stream.send(
+            MessageType.PACKED, header, struct.pack(SessionCipher.SEQUENCE_FORMAT, seq), ciphertext
         )
+        await folder.add_packed(len(packed), sum(size for _, size in packed))
 
-        tracker = SpeedTracker()
-        last_progress_time = time.monotonic()
 
-        queue = asyncio.Queue(maxsize=4)
-        
-        async def _disk_producer():
-            try:
-                with open(file_path, "rb") as f:
-                    f.seek(offset)
-                    while transfer_info.state not in (TransferState.CANCELLED, TransferState.FAILED):
-                        while transfer_info.state in (TransferState.PAUSED, TransferState.PAUSED_BY_PEER):
-                            await asyncio.sleep(0.1)
-                            if transfer_info.state == TransferState.CANCELLED:
-                                return
-                        
-                        chunk = await asyncio.to_thread(f.read, CHUNK_SIZE)
-                        if not chunk:
-                            await queue.put((None, None))
-                            break
-                        encrypted = await asyncio.to_thread(encrypt_chunk, session_key, chunk)
-                        await queue.put((len(chunk), encrypted))
-            except Exception as e:
-                await queue.put((e, None))
+async def send_folder(
+    session_pool: SessionPool,
+    peer_ip: str,
+    peer_port: int,
+    folder_path: str,
+    transfer_info: TransferInfo,
+    progress_callback,
+    state_callback,
+    identity_service = None,
+    trust_store = None,
+    content_index: ContentIndex | None = None,
+    stripes: int | None = None,
+    compress: bool | None = None,
+    rate_limit: TransferLimit | None = None,
+) -> None:
+    """
+    Send a folder to a peer as one transfer (see transfer.folder).
 
-        producer_task = asyncio.create_task(_disk_producer())
+    The folder's stream carries the manifest, the user's accept or
+    reject, and pause/resume/cancel for the whole folder. Member files
+    are sent by send_file() on their own streams of the same session,
+    up to FOLDER_CONCURRENCY at a time, except for small files, which
+    are packed into PACKED frames on the folder's stream.
 
-        while True:
-            if transfer_info.state == TransferState.CANCELLED:
-                await send_message(writer, MessageType.CANCEL)
+    A lost connection is retried as in send_file(), for the folder as a
+    whole: the new attempt sends the manifest again, and each member
+    resumes from what the receiver already has.
+
+    Args are as for send_file(); ``transfer_info`` describes the folder,
+    and its size and file count are filled in from the manifest. Members
+    share the folder's ``rate_limit``.
+    """
+    failures = 0
+    progress_mark = 0
+
+    while True:
+        stream: SessionStream | None = None
+        monitor_task: asyncio.Task | None = None
+        relay_task: asyncio.Task | None = None
+        mirror_task: asyncio.Task | None = None
+        rtt_task: asyncio.Task | None = None
+        workers: list[asyncio.Task] = []
+        lost: Exception | None = None
+
+        try:
+            if transfer_info.state != TransferState.RECONNECTING:
+                transfer_info.state = TransferState.CONNECTING
+                await state_callback(transfer_info)
+
+            [session] = await session_pool.acquire(peer_ip, peer_port)
+            if transfer_info.state == TransferState.RECONNECTING:
+                transfer_info.reconnects += 1
+            stream = session.open_stream()
+            transfer_info.cipher_suite = session.cipher.suite
+
+            # 1. Stream the manifest while walking the tree
+            files: list[tuple[str, int]] = []
+            entries = walk_folder(folder_path)
+            while True:
+                batch = await asyncio.to_thread(next_batch, entries)
+                if not batch:
+                    break
+                await stream.send(MessageType.MANIFEST, encode_manifest(batch))
+                files.extend(entry for entry in batch if entry[1] != DIRECTORY)
+            transfer_info.file_size = sum(size for _, size in files)
+            transfer_info.file_count = len(files)
+
+            metadata = FileMetadata(
+                transfer_id=transfer_info.transfer_id,
+                file_name=transfer_info.file_name,
+                file_size=transfer_info.file_size,
+                sender_device_id=identity_service.public_id if identity_service else DEVICE_ID,
+                sender_device_name=identity_service.alias if identity_service else DEVICE_NAME,
+                is_folder=True,
+                file_count=transfer_info.file_count,
+            )
+            await stream.send(MessageType.METADATA, json.dumps(metadata.model_dump()).encode("utf-8"))
+            await state_callback(transfer_info)
+
+            # 2. Wait for accept/reject
+            msg_type, payload = await stream.recv()
+            if msg_type == MessageType.REJECT:
+                transfer_info.state = TransferState.REJECTED
+                await state_callback(transfer_info)
                 return
-            if transfer_info.state in (TransferState.PAUSED, TransferState.PAUSED_BY_PEER):
-                if transfer_info.state == TransferState.PAUSED:
-                    await send_message(writer, MessageType.PAUSE)
-                
-                while transfer_info.state in (TransferState.PAUSED, TransferState.PAUSED_BY_PEER):
-                    await asyncio.sleep(0.1)
-                
-                if transfer_info.state == TransferState.CANCELLED:
-                    await send_message(writer, MessageType.CANCEL)
+            if msg_type != MessageType.ACCEPT:
+                raise ConnectionError(f"Expected ACCEPT/REJECT, got {msg_type:#x}")
+
+            accept_data = {}
+            if payload:
+                try:
+                    accept_data = json.loads(payload.decode('utf-8'))
+                except ValueError as e:
+                    logger.warning(f"Malformed ACCEPT payload: {e}")
+
+            peer_identity = None
+            real_name = accept_data.get('device_name')
+            if real_name and session.peer_public_key:
+                peer_identity = (transfer_info.peer_device_id, real_name, session.peer_public_key)
+                transfer_info.peer_device_name = real_name
+
+            # 3. Send the member files; the folder stream carries control.
+            # After a reconnect, progress is counted afresh as members resume.
+            transfer_info.state = TransferState.TRANSFERRING
+            transfer_info.error_message = None
+            transfer_info.transferred_bytes = 0
+            transfer_info.resumed_bytes = 0
+            transfer_info.files_done = 0
+            await state_callback(transfer_info)
+            monitor_task = asyncio.create_task(
+                _monitor_remote_commands(stream, transfer_info, state_callback)
+            )
+            relay_task = asyncio.create_task(
+                _monitor_local_state(stream, transfer_info)
+            )
+            progress = ProgressReporter(transfer_info, progress_callback)
+            folder = FolderProgress(transfer_info, progress.add)
+            mirror_task = asyncio.create_task(_mirror_folder_state(folder))
+            if rate_limit:
+                # Packed frames have no member of their own to sample the RTT
+                rtt_task = asyncio.create_task(_sample_rtt(session, None, rate_limit))
+            pending = iter([entry for entry in files if not is_packable(entry[1])])
+            small = [entry for entry in files if is_packable(entry[1])]
+
+            async def _send_members():
+                for relative_path, size in pending:
+                    if not await _wait_while_paused(transfer_info):
+                        return
+                    member = TransferInfo(
+                        transfer_id=str(uuid.uuid4()),
+                        file_name=relative_path,
+                        file_size=size,
+                        direction=TransferDirection.SENDING,
+                        peer_device_id=transfer_info.peer_device_id,
+                        peer_device_name=transfer_info.peer_device_name,
+                        state=TransferState.PENDING,
+                    )
+                    await send_file(
+                        session_pool,
+                        peer_ip,
+                        peer_port,
+                        os.path.join(folder_path, *relative_path.split("/")),
+                        member,
+                        folder.on_progress,
+                        folder.on_state,
+                        identity_service=identity_service,
+                        content_index=content_index,
+                        stripes=stripes,
+                        compress=compress,
+                        session=session,
+                        folder_id=transfer_info.transfer_id,
+                        relative_path=relative_path,
+                        rate_limit=rate_limit,
+                    )
+
+            workers = [
+                asyncio.create_task(_send_members())
+                for _ in range(min(FOLDER_CONCURRENCY, len(files) - len(small)))
+            ]
+            if small:
+                workers.append(asyncio.create_task(_send_packed(stream, folder_path, small, folder, rate_limit)))
+            if workers:
+                sending = asyncio.gather(*workers)
+                await asyncio.wait([sending, mirror_task], return_when=asyncio.FIRST_COMPLETED)
+                if sending.done():
+                    sending.result()
+            if transfer_info.state in (TransferState.CANCELLED, TransferState.FAILED):
+                return
+            if folder.failures:
+                raise RuntimeError(
+                    f"{len(folder.failures)} of {transfer_info.file_count} files failed, "
+                    f"first: {folder.failures[0]}"
+                )
+
+            # 4. Completion: the receiver checks that every file arrived
+            monitor_task.cancel()
+            await stream.send(MessageType.TRANSFER_COMPLETE)
+            while True:
+                msg_type, payload = await asyncio.wait_for(stream.recv(), timeout=VERIFY_TIMEOUT)
+                if msg_type == MessageType.TRANSFER_COMPLETE:
+                    break
+                if msg_type == MessageType.ERROR:
+                    raise ConnectionError(f"Receiver error: {payload.decode('utf-8', 'replace')}")
+                if msg_type == MessageType.CANCEL:
+                    transfer_info.state = TransferState.CANCELLED
+                    await state_callback(transfer_info)
                     return
-                
-                if transfer_info.state == TransferState.TRANSFERRING:
-                    await send_message(writer, MessageType.RESUME)
 
+            await _finish_transfer(
+                transfer_info, state_callback, folder_path, peer_identity, trust_store, None
+            )
+
+        except asyncio.CancelledError:
+            transfer_info.state = TransferState.CANCELLED
+            await state_callback(transfer_info)
+        except Exception as e:
+            if transfer_info.state not in _STOPPED_STATES and _connection_lost(e, [stream]):
+                # Retried below, once this attempt is torn down
+                lost = e
+            else:
+                logger.error(f"Send error for folder {transfer_info.file_name}: {e}")
+                if transfer_info.state != TransferState.CANCELLED:
+                    transfer_info.state = TransferState.FAILED
+                    transfer_info.error_message = str(e)
+                    await state_callback(transfer_info)
+                    if stream:
+                        await _notify_peer(stream, MessageType.ERROR, str(e).encode("utf-8"))
+        finally:
+            # Members still in flight are cancelled and tell the receiver so
+            for task in workers:
+                task.cancel()
+            if workers:
+                await asyncio.gather(*workers, return_exceptions=True)
+            for task in (monitor_task, relay_task, mirror_task, rtt_task):
+                if task:
+                    task.cancel()
+
+            if stream and transfer_info.state == TransferState.CANCELLED:
+                await _notify_peer(stream, MessageType.CANCEL)
+            if stream:
+                stream.close()
+
+        if lost is None:
+            return
+        if transfer_info.transferred_bytes > progress_mark:
+            progress_mark = transfer_info.transferred_bytes
+            failures = 0
+        failures += 1
+        if failures > MAX_RETRIES:
+            logger.error(f"Send error for folder {transfer_info.file_name}: {lost}")
+            transfer_info.state = TransferState.FAILED
+            transfer_info.error_message = f"Connection lost: {lost}"
+            await state_callback(transfer_info)
+            return
+        if not await _back_off(transfer_info, state_callback, failures, lost):
+            return
+
+
+async def _notify_peer(stream: SessionStream, msg_type: int, payload: bytes = b"") -> None:
+    """Best-effort control message on a stream that is being torn down."""
+    try:
+        await asyncio.wait_for(stream.send(msg_type, payload), timeout=1.0)
+    except Exception:
+        pass
+
+
+class _StripeGroup:
+    """
+    (Receiver side) State shared by all connections of one transfer.
+
+    Tracks which stripes have joined and whether they finished.
+
+    A stripe that drops out is not fatal on its own: the sender sees the
+    same failure and tears down the control connection, or it sends
+    CANCEL first, which must win over the resulting EOFs.
+    """
+
+    def __init__(
+        self,
+        transfer_info: TransferInfo,
+        control_key: bytes,
+        stripe_count: int,
+        target: PositionalFile,
+        progress: ProgressReporter,
+    ):
+        self.transfer_info = transfer_info
+        self.control_key = control_key
+        self.stripe_count = stripe_count
+        self.target = target
+        self.progress = progress
+        # Built from every chunk written, seeded with the resume hashes
+        # before the first chunk can arrive; checked against the sender's
+        self.digest: FileDigest | None = None
+        self.expected_digest: bytes | None = None
+        self.error: BaseException | None = None
+        # Ratio and CPU cost of the chunks the sender compressed
+        self.compression: CompressionStats | None = None
+        # Set once the transfer has ended; stripes must not write any more
+        self.sealed = False
+        loop = asyncio.get_running_loop()
+        self._joined = [loop.create_future() for _ in range(stripe_count)]
+        self._finished = [loop.create_future() for _ in range(stripe_count)]
+
+    def claim(self, stripe_index: int) -> bool:
+        """Mark an extra stripe as joined; False if invalid or already taken."""
+        if not 0 < stripe_index < self.stripe_count:
+            return False
+        joined = self._joined[stripe_index]
+        if joined.done():
+            return False
+        joined.set_result(True)
+        return True
+
+    def finish(self, stripe_index: int, completed: bool, error: BaseException | None = None) -> None:
+        if error is not None and self.error is None:
+            self.error = error
+        fut = self._finished[stripe_index]
+        if not fut.done():
+            fut.set_result(completed)
+
+    async def wait_extra_stripes(self) -> bool:
+        """Wait for stripes 1..N-1 to join and deliver all their chunks."""
+        for index in range(1, self.stripe_count):
             try:
-                res = await asyncio.wait_for(queue.get(), timeout=1.0)
+                await asyncio.wait_for(
+                    asyncio.shield(self._joined[index]), timeout=STRIPE_JOIN_TIMEOUT
+                )
             except asyncio.TimeoutError:
-                continue
+                raise ConnectionError(f"Stripe {index} never connected")
+        results = [await fut for fut in self._finished[1:]]
+        if self.error is not None:
+            raise self.error
+        return all(results)
+
+    async def settle(self, timeout: float = 2.0) -> None:
+        """Stop further writes and give joined stripes a moment to notice."""
+        self.sealed = True
+        pending = [
+            finished
+            for joined, finished in zip(self._joined[1:], self._finished[1:])
+            if joined.done() and not finished.done()
+        ]
+        if pending:
+            await asyncio.wait(pending, timeout=timeout)
+
+
+# Receiver-side registry of striped transfers accepting extra connections
+_stripe_groups: dict[str, _StripeGroup] = {}
+
+
+class _CorruptChunk(Exception):
+    """A chunk that decrypted but could not be decompressed."""
+
+
+def _open_chunk(
+    cipher: SessionCipher,
+    stream_id: int,
+    seq: int,
+    ciphertext: memoryview,
+    plain_buffer: bytearray,
+    chunk_header: bytes,
+    codec_id: int,
+    limit: int,
+) -> tuple[memoryview | bytes, int, float]:
+    """
+    Decrypt (and decompress) one chunk in a crypto worker.
+
+    Returns (plaintext, wire length, decompression CPU seconds). A RAW
+    chunk's plaintext is a view of ``plain_buffer``.
+    """
+    decrypted = cipher.decrypt_into(stream_id, seq, ciphertext, plain_buffer, chunk_header)
+    if codec_id == RAW:
+        return decrypted, len(decrypted), 0.0
+    try:
+        plaintext, cpu_seconds = decompress_chunk(codec_id, decrypted, limit)
+    except Exception as e:
+        raise _CorruptChunk(f"Malformed compressed chunk: {e}") from e
+    return plaintext, len(decrypted), cpu_seconds
 
-            if isinstance(res[0], Exception):
-                raise res[0]
-            
-            chunk_len, encrypted = res
-            if chunk_len is None:
-                break
 
-            await send_message(writer, MessageType.DATA_CHUNK, encrypted)
+async def _receive_stripe(
+    stream: SessionStream,
+    group: _StripeGroup,
+    stripe_index: int,
+    state_callback,
+) -> bool:
+    """
+    (Receiver side) Read chunks from one stream and write them
+    at their offsets.
 
-            transfer_info.transferred_bytes += chunk_len
-            tracker.record(chunk_len)
+    The session's reader keeps filling the stream's bounded queue while
+    this loop hands each chunk to the shared crypto pool, where several
+    are decrypted at once. A writer task takes the decrypted chunks in
+    stream order and writes them, so decrypting chunk N+1 overlaps with
+    writing chunk N, and FileDigest still sees each block in order.
 
-            now = time.monotonic()
-            if now - last_progress_time >= 0.2:
-                transfer_info.speed_bps = tracker.get_speed()
-                transfer_info.progress_percent = (
-                    transfer_info.transferred_bytes / transfer_info.file_size * 100
-                    if transfer_info.file_size > 0
-                    else 100
-                )
-                remaining_bytes = transfer_info.file_size - transfer_info.transferred_bytes
-                transfer_info.eta_seconds = (
-                    remaining_bytes / transfer_info.speed_bps
-                    if transfer_info.speed_bps > 0
-                    else 0
+    Returns True on TRANSFER_COMPLETE, False if the transfer was cancelled.
+    The control stream's TRANSFER_COMPLETE carries the sender's file digest.
+    """
+    transfer_info = group.transfer_info
+    session = stream.session
+    cipher = session.cipher
+    loop = asyncio.get_running_loop()
+    # Chunks being decrypted or waiting for the writer, in stream order.
+    # Each holds a frame buffer and a plaintext buffer.
+    pending: asyncio.Queue = asyncio.Queue(maxsize=_crypto_workers() + 1)
+    writer_error: BaseException | None = None
+
+    async def _ordered_writer():
+        # Never exits early: after an error it keeps draining ``pending``
+        # so the loop below cannot block on a full queue.
+        nonlocal writer_error
+        decryption_failures = 0
+        while True:
+            item = await pending.get()
+            if item is None:
+                return
+            chunk_offset, codec_id, view, plain_buffer, opening = item
+            try:
+                # Security limit: Aggressively drop if decryption hangs or fails
+                decrypted, wire_length, cpu_seconds = await asyncio.wait_for(opening, timeout=5.0)
+            except _CorruptChunk as e:
+                session.release(view)
+                session.buffers.release(plain_buffer)
+                writer_error = writer_error or e
+                continue
+            except Exception as e:
+                if not isinstance(e, asyncio.TimeoutError):
+                    # After a timeout the worker may still be using both buffers
+                    session.release(view)
+                    session.buffers.release(plain_buffer)
+                decryption_failures += 1
+                if decryption_failures >= 3 and writer_error is None:
+                    writer_error = RuntimeError("Multiple decryption failures. Potential malformed chunk DoS attack.")
+                    writer_error.__cause__ = e
+                continue
+            session.release(view)
+            if codec_id != RAW:
+                session.buffers.release(plain_buffer)
+            try:
+                if writer_error is not None or group.sealed:
+                    continue
+                if group.compression:
+                    group.compression.record(len(decrypted), wire_length, cpu_seconds)
+                if chunk_offset + len(decrypted) > transfer_info.file_size:
+                    writer_error = RuntimeError(f"Chunk at offset {chunk_offset} exceeds announced file size")
+                    continue
+                try:
+                    await asyncio.to_thread(_write_chunk, group.target, group.digest, decrypted, chunk_offset)
+                except Exception as e:
+                    writer_error = e
+                    continue
+            finally:
+                if codec_id == RAW:
+                    # ``decrypted`` was a view of it
+                    session.buffers.release(plain_buffer)
+            await group.progress.add(len(decrypted))
+
+    writer_task = asyncio.create_task(_ordered_writer())
+
+    try:
+        while True:
+            if writer_error is not None:
+                raise writer_error
+            if transfer_info.state in (TransferState.CANCELLED, TransferState.FAILED):
+                return False
+            if group.sealed:
+                return False
+
+            running, message = await _unless_stopped(transfer_info, stream.recv())
+            if not running:
+                return False
+            msg_type, payload = message
+
+            if msg_type == MessageType.TRANSFER_COMPLETE:
+                # Everything before it must be on disk first
+                await pending.put(None)
+                await writer_task
+                if writer_error is not None:
+                    raise writer_error
+                if stripe_index == 0:
+                    group.expected_digest = payload
+                return True
+            elif msg_type == MessageType.CANCEL:
+                transfer_info.state = TransferState.CANCELLED
+                await state_callback(transfer_info)
+                return False
+            elif msg_type == MessageType.PAUSE:
+                transfer_info.state = TransferState.PAUSED_BY_PEER
+                await state_callback(transfer_info)
+                continue
+            elif msg_type == MessageType.RESUME:
+                transfer_info.state = TransferState.TRANSFERRING
+                await state_callback(transfer_info)
+                continue
+            elif msg_type == MessageType.ERROR:
+                raise ConnectionError(f"Sender error: {payload.decode('utf-8', 'replace')}")
+            elif msg_type == MessageType.TUNE:
+                _apply_tune(stream, transfer_info, payload)
+                continue
+            elif msg_type == MessageType.DATA_CHUNK:
+                # The payload is a view of a pooled receive buffer; the
+                # plaintext goes into a second pooled buffer, and both are
+                # recycled once the chunk is on disk.
+                view = payload
+                chunk_header = view[:CHUNK_HEADER_SIZE]
+                seq_end = CHUNK_HEADER_SIZE + SessionCipher.SEQUENCE_SIZE
+                chunk_offset, codec_id = struct.unpack(CHUNK_HEADER_FORMAT, chunk_header)
+                (seq,) = struct.unpack(SessionCipher.SEQUENCE_FORMAT, view[CHUNK_HEADER_SIZE:seq_end])
+                # A replayed or reordered chunk is never decrypted
+                cipher.accept_recv_seq(stream.stream_id, seq)
+                # Checked before any work is spent on the chunk: it must
+                # start inside the file, and never inflate past its end
+                remaining = transfer_info.file_size - chunk_offset
+                raw_length = len(view) - seq_end - TAG_SIZE
+                if remaining <= 0 or (codec_id == RAW and raw_length > remaining):
+                    session.release(view)
+                    raise RuntimeError(f"Chunk at offset {chunk_offset} exceeds announced file size")
+                limit = min(MAX_CHUNK_SIZE, remaining)
+                plain_buffer = session.buffers.acquire(len(view))
+                opening = loop.run_in_executor(
+                    _crypto_pool(), _open_chunk,
+                    cipher, stream.stream_id, seq, view[seq_end:], plain_buffer,
+                    chunk_header, codec_id, limit,
                 )
-                await progress_callback(transfer_info)
-                last_progress_time = now
-
-        # 6. Send completion
-        await send_message(writer, MessageType.TRANSFER_COMPLETE)
-        
-        if peer_identity and trust_store:
-            trust_store.add_trusted_peer(*peer_identity)
-            
-        transfer_info.state = TransferState.COMPLETED
-        transfer_info.progress_percent = 100.0
-        transfer_info.speed_bps = 0
-        transfer_info.eta_seconds = 0
-        await state_callback(transfer_info)
+                await pending.put((chunk_offset, codec_id, view, plain_buffer, opening))
+            else:
+                logger.warning(f"Unexpected message type during receive: {msg_type:#x}")
+    finally:
+        writer_task.cancel()
 
-    except asyncio.CancelledError:
-        transfer_info.state = TransferState.CANCELLED
-        await state_callback(transfer_info)
+
+def _apply_tune(stream: SessionStream, transfer_info: TransferInfo, payload: bytes) -> None:
+    """(Receiver side) Follow the sender's new chunk size and pipeline depth."""
+    try:
+        tune = json.loads(payload.decode("utf-8"))
+        chunk_size = int(tune["chunk_size"])
+        depth = max(1, min(int(tune["depth"]), MAX_PIPELINE_DEPTH))
+    except (ValueError, KeyError, TypeError) as e:
+        logger.warning(f"Ignoring malformed TUNE: {e}")
+        return
+    stream.set_depth(depth)
+    transfer_info.chunk_size = chunk_size
+    transfer_info.pipeline_depth = depth
+
+
+async def _join_stripe(
+    stream: SessionStream,
+    join_raw: bytes,
+    state_callback,
+) -> None:
+    """(Receiver side) Attach an incoming extra stream to its transfer."""
+    join = json.loads(join_raw.decode("utf-8"))
+    transfer_id = str(join.get("transfer_id", ""))
+    stripe_index = int(join.get("stripe", -1))
+
+    group = _stripe_groups.get(transfer_id)
+    if (
+        group is None
+        or not verify_join_tag(group.control_key, transfer_id, stripe_index, bytes.fromhex(join.get("tag", "")))
+        or not group.claim(stripe_index)
+    ):
+        logger.warning(f"Rejecting stripe {stripe_index} for unknown transfer {transfer_id}")
+        await stream.send(MessageType.REJECT)
+        return
+
+    await stream.send(MessageType.ACCEPT)
+    try:
+        completed = await _receive_stripe(stream, group, stripe_index, state_callback)
+        group.finish(stripe_index, completed)
     except Exception as e:
-        logger.error(f"Send error for {transfer_info.file_name}: {e}")
-        if transfer_info.state != TransferState.CANCELLED:
+        logger.error(f"Stripe {stripe_index} of {group.transfer_info.file_name} failed: {e}")
+        group.finish(stripe_index, False, e)
+    except asyncio.CancelledError:
+        group.finish(stripe_index, False)
+        raise
+
+
+class _FolderGroup:
+    """(Receiver side) A folder transfer whose member files are arriving."""
+
+    def __init__(self, session: PeerSession, root: str, sizes: dict[str, int], progress: FolderProgress):
+        self.session = session
+        self.root = root
+        self.sizes = sizes
+        self.progress = progress
+        # Member paths already started; each is accepted once
+        self.claimed: set[str] = set()
+
+    def claim(self, relative_path: str, size: int) -> bool:
+        """Mark a member as started; False if not in the manifest or already taken."""
+        if self.sizes.get(relative_path) != size or relative_path in self.claimed:
+            return False
+        self.claimed.add(relative_path)
+        return True
+
+
+# Receiver-side registry of accepted folders expecting member files
+_folder_groups: dict[str, _FolderGroup] = {}
+
+
+def _claim_member(session: PeerSession, metadata: FileMetadata) -> _FolderGroup | None:
+    """(Receiver side) The folder a member file belongs to, or None to refuse it."""
+    group = _folder_groups.get(metadata.folder_id)
+    if group is None or group.session is not session:
+        logger.warning(f"Refusing member of unknown folder transfer {metadata.folder_id}")
+        return None
+    if not group.claim(metadata.relative_path, metadata.file_size):
+        logger.warning(f"Refusing {metadata.relative_path!r}: not in the folder's manifest")
+        return None
+    return group
+
+
+async def _receive_packed(stream: SessionStream, group: _FolderGroup, payload: bytes) -> None:
+    """(Receiver side) Decrypt a PACKED frame and write its files in one batch."""
+    cipher = stream.session.cipher
+    header = payload[:PACK_HEADER_SIZE]
+    seq_end = PACK_HEADER_SIZE + SessionCipher.SEQUENCE_SIZE
+    (count,) = struct.unpack(PACK_HEADER_FORMAT, header)
+    (seq,) = struct.unpack(SessionCipher.SEQUENCE_FORMAT, payload[PACK_HEADER_SIZE:seq_end])
+    cipher.accept_recv_seq(stream.stream_id, seq)
+    body = await asyncio.to_thread(cipher.decrypt, stream.stream_id, seq, payload[seq_end:], header)
+
+    files = unpack_files(body, count)
+    for relative_path, data, _ in files:
+        if not is_packable(len(data)) or not group.claim(relative_path, len(data)):
+            raise ConnectionError(f"Packed file {relative_path!r} is not in the folder's manifest")
+    await asyncio.to_thread(write_packed, group.root, files)
+    await group.progress.add_packed(len(files), sum(len(data) for _, data, _ in files))
+
+
+class _Resumable:
+    """
+    (Receiver side) An accepted transfer its sender may take up again
+    over a new connection, without a new prompt.
+
+    Registered when the user accepts; once the connection is lost, it is
+    held for RECONNECT_WINDOW with the block digests already built, so
+    the resume only hashes blocks that were never completed.
+    """
+
+    def __init__(self, session: PeerSession, metadata: FileMetadata, path: str):
+        self.session = session
+        self.peer_key = session.peer_public_key
+        self.device_id = metadata.sender_device_id
+        self.path = path
+        self.digest: FileDigest | None = None
+        self.stamp: tuple[int, int] | None = None  # (size, mtime_ns) of the .part file when held
+        # Set once the receive that registered it has ended, either way
+        self.released = asyncio.Event()
+        self.expiry: asyncio.Task | None = None
+        self.reconnects = 0
+
+    def hashes(self, part_path: str, length: int, block_size: int) -> list[bytes | None] | None:
+        """Leaves to resume ``length`` bytes with, or None if the .part file changed since."""
+        if self.digest is None or self.digest.block_size != block_size:
+            return None
+        try:
+            st = os.stat(part_path)
+        except OSError:
+            return None
+        if self.stamp != (st.st_size, st.st_mtime_ns):
+            return None
+        return self.digest.leaves(block_count(length, block_size))
+
+
+# Receiver-side registry of accepted transfers, by transfer ID
+_resumables: dict[str, _Resumable] = {}
+
+
+async def _hold_for_reconnect(
+    transfer_id: str,
+    resumable: _Resumable,
+    transfer_info: TransferInfo,
+    state_callback,
+    digest: FileDigest | None = None,
+) -> None:
+    """(Receiver side) Keep a transfer whose connection was lost open for its sender's return."""
+    resumable.digest = digest
+    try:
+        st = os.stat(resumable.path + PART_SUFFIX)
+        resumable.stamp = (st.st_size, st.st_mtime_ns)
+    except OSError:
+        pass
+
+    async def _expire():
+        running, _ = await _unless_stopped(transfer_info, asyncio.sleep(RECONNECT_WINDOW))
+        if _resumables.get(transfer_id) is resumable:
+            del _resumables[transfer_id]
+        if running:
             transfer_info.state = TransferState.FAILED
-            transfer_info.error_message = str(e)
+            transfer_info.error_message = "Connection lost and the sender did not reconnect"
             await state_callback(transfer_info)
-    finally:
-        if monitor_task:
-            monitor_task.cancel()
-        
-        if writer:
-            writer.close()
-            try:
-                await writer.wait_closed()
-            except Exception:
-                pass
 
+    transfer_info.state = TransferState.RECONNECTING
+    transfer_info.error_message = "Connection lost; waiting for the sender to reconnect"
+    transfer_info.speed_bps = 0
+    transfer_info.eta_seconds = 0
+    await state_callback(transfer_info)
+    resumable.expiry = asyncio.create_task(_expire())
 
-async def receive_file(
-    reader: asyncio.StreamReader,
-    writer: asyncio.StreamWriter,
+
+async def _take_over(session: PeerSession, metadata: FileMetadata) -> _Resumable | None:
+    """
+    (Receiver side) The accepted transfer a reconnecting sender resumes,
+    or None if ``metadata`` starts a new one.
+
+    The transfer ID is known only to both peers, and the sender must
+    also present the same identity key. A sender that noticed the dead
+    connection first may be back before we notice; its old session is
+    dropped here.
+    """
+    resumable = _resumables.get(metadata.transfer_id)
+    if (
+        resumable is None
+        or resumable.session is session
+        or resumable.peer_key != session.peer_public_key
+        or resumable.device_id != metadata.sender_device_id
+    ):
+        return None
+    if not resumable.released.is_set():
+        resumable.session.close(ConnectionError("Sender reconnected on a new connection"))
+        try:
+            await asyncio.wait_for(resumable.released.wait(), STRIPE_JOIN_TIMEOUT)
+        except asyncio.TimeoutError:
+            return None
+    if _resumables.get(metadata.transfer_id) is not resumable:
+        return None  # Ended for good, or expired
+    del _resumables[metadata.transfer_id]
+    if resumable.expiry:
+        resumable.expiry.cancel()
+    return resumable
+
+
+def _sender_identity(session: PeerSession, metadata: FileMetadata, trust_store) -> tuple[tuple | None, str]:
+    """(Receiver side) The sender's identity to trust on success, and its display name."""
+    peer_identity = None
+    real_sender_name = metadata.sender_device_name
+
+    # The sender's identity key was verified once for the whole session
+    if session.peer_public_key and trust_store:
+        known_peer = trust_store.get_peer_by_key(session.peer_public_key)
+        if known_peer:
+            real_sender_name = known_peer.real_name
+
+        peer_identity = (metadata.sender_device_id, real_sender_name, session.peer_public_key)
+    return peer_identity, real_sender_name
+
+
+async def _receive_folder(
+    stream: SessionStream,
+    manifest_raw: bytes,
     save_dir: str,
     accept_callback,
     progress_callback,
@@ -420,50 +1926,47 @@ async def receive_file(
     trust_store = None,
 ) -> TransferInfo | None:
     """
-    Handle an incoming file transfer connection.
+    (Receiver side) Handle a folder transfer's stream, which starts with
+    its first MANIFEST batch.
 
-    Args:
-        reader, writer: The TCP connection streams.
-        save_dir: Directory to save the received file.
-        accept_callback: async fn(transfer_info) -> bool — prompts user.
-        progress_callback: async fn(transfer_info) called on progress.
-        state_callback: async fn(transfer_info) called on state change.
-
-    Returns:
-        The TransferInfo of the completed transfer, or None if rejected.
+    After the user accepts, member files arrive on other streams of the
+    same session and are handled by receive_file(); this stream carries
+    packed small files, pause/resume/cancel and the sender's final
+    TRANSFER_COMPLETE.
     """
     transfer_info: TransferInfo | None = None
+    group: _FolderGroup | None = None
     monitor_task: asyncio.Task | None = None
-    producer_task: asyncio.Task | None = None
+    mirror_task: asyncio.Task | None = None
+    resumable: _Resumable | None = None
+    completed = False
+    lost = False
 
-    try:
-        # 1. ECDH Handshake
-        session_key = await perform_handshake_receiver(reader, writer)
+    session = stream.session
 
-        # 2. Receive metadata
-        msg_type, metadata_raw = await recv_message(reader)
+    try:
+        # 1. Collect the manifest, then the folder's metadata
+        entries: list[tuple[str, int]] = []
+        msg_type, payload = MessageType.MANIFEST, manifest_raw
+        while msg_type == MessageType.MANIFEST:
+            entries.extend(decode_manifest(payload))
+            if len(entries) > MAX_MANIFEST_ENTRIES:
+                raise ConnectionError("Folder manifest too large")
+            msg_type, payload = await stream.recv()
         if msg_type != MessageType.METADATA:
             raise ConnectionError(f"Expected METADATA, got {msg_type:#x}")
 
-        metadata = FileMetadata(**json.loads(metadata_raw.decode("utf-8")))
-
-        peer_identity = None
-        real_sender_name = metadata.sender_device_name
-        
-        if metadata.identity_public_key and metadata.identity_signature and trust_store:
-            try:
-                from cryptography.hazmat.primitives.asymmetric import ed25519
-                pub_key_obj = ed25519.Ed25519PublicKey.from_public_bytes(bytes.fromhex(metadata.identity_public_key))
-                pub_key_obj.verify(bytes.fromhex(metadata.identity_signature), metadata.transfer_id.encode('utf-8'))
-                
-                known_peer = trust_store.get_peer_by_key(metadata.identity_public_key)
-                if known_peer:
-                    real_sender_name = known_peer.real_name
-                
-                peer_identity = (metadata.sender_device_id, real_sender_name, metadata.identity_public_key)
-            except Exception as e:
-                logger.warning(f"Failed to verify sender identity: {e}")
+        metadata = FileMetadata(**json.loads(payload.decode("utf-8")))
+        sizes = await asyncio.to_thread(index_manifest, entries)
+        if (
+            not metadata.is_folder
+            or len(sizes) != metadata.file_count
+            or sum(sizes.values()) != metadata.file_size
+        ):
+            raise ConnectionError("Folder metadata does not match its manifest")
+        root = safe_join(save_dir, metadata.file_name)
 
+        peer_identity, real_sender_name = _sender_identity(session, metadata, trust_store)
         transfer_info = TransferInfo(
             transfer_id=metadata.transfer_id,
             file_name=metadata.file_name,
@@ -472,142 +1975,348 @@ async def receive_file(
             peer_device_id=metadata.sender_device_id,
             peer_device_name=real_sender_name,
             state=TransferState.AWAITING_ACCEPTANCE,
+            is_folder=True,
+            file_count=metadata.file_count,
+            cipher_suite=session.cipher.suite,
         )
         await state_callback(transfer_info)
 
-        # 3. Ask user to accept/reject
-        accepted = await accept_callback(transfer_info)
-        if not accepted:
-            await send_message(writer, MessageType.REJECT)
-            transfer_info.state = TransferState.REJECTED
-            await state_callback(transfer_info)
-            return transfer_info
+        # 2. Ask user to accept/reject, once for the whole folder, unless
+        # the sender is resuming it after losing the connection
+        previous = await _take_over(session, metadata)
+        if previous:
+            logger.info(f"{metadata.file_name}: sender reconnected, resuming")
+        else:
+            accepted = await accept_callback(transfer_info)
+            if not accepted:
+                await stream.send(MessageType.REJECT)
+                transfer_info.state = TransferState.REJECTED
+                await state_callback(transfer_info)
+                return transfer_info
+        resumable = _Resumable(session, metadata, root)
+        if previous:
+            resumable.reconnects = transfer_info.reconnects = previous.reconnects + 1
+        _resumables[transfer_info.transfer_id] = resumable
+
+        # 3. Create the tree, and check that what is missing fits
+        existing = await asyncio.to_thread(prepare_folder, root, entries)
+        free = (await asyncio.to_thread(shutil.disk_usage, root)).free
+        if metadata.file_size - existing > free:
+            raise RuntimeError(
+                f"Not enough disk space: need {metadata.file_size - existing} bytes, {free} free"
+            )
+
+        progress = ProgressReporter(transfer_info, progress_callback)
+        group = _FolderGroup(session, root, sizes, FolderProgress(transfer_info, progress.add))
+        _folder_groups[transfer_info.transfer_id] = group
 
         accept_payload = {}
         if identity_service:
-            accept_payload = {
-                "identity_public_key": identity_service.get_public_bytes().hex(),
-                "identity_signature": identity_service.sign(transfer_info.transfer_id.encode('utf-8')).hex(),
-                "device_name": DEVICE_NAME,
-            }
-        await send_message(writer, MessageType.ACCEPT, json.dumps(accept_payload).encode('utf-8'))
-
-        # 4. Check for partial file (resume support)
-        file_path = os.path.join(save_dir, metadata.file_name)
-        offset = 0
-        if os.path.exists(file_path):
-            offset = os.path.getsize(file_path)
-
-        await send_message(
-            writer, MessageType.RESUME_OFFSET, struct.pack("!Q", offset)
-        )
+            accept_payload["device_name"] = DEVICE_NAME
+        await stream.send(MessageType.ACCEPT, json.dumps(accept_payload).encode('utf-8'))
 
-        # 5. Start receiving chunks
         transfer_info.state = TransferState.TRANSFERRING
-        transfer_info.transferred_bytes = offset
         await state_callback(transfer_info)
-
-        # START MONITORING FOR LOCAL STATE CHANGES (Pause/Resume from UI)
         monitor_task = asyncio.create_task(
-            _monitor_local_state(writer, transfer_info)
+            _monitor_local_state(stream, transfer_info)
         )
+        mirror_task = asyncio.create_task(_mirror_folder_state(group.progress))
 
-        tracker = SpeedTracker()
-        last_progress_time = time.monotonic()
-        mode = "ab" if offset > 0 else "wb"
+        # 4. Follow the folder's control messages while members arrive
+        while True:
+            running, message = await _unless_stopped(transfer_info, stream.recv())
+            if not running:
+                return transfer_info
+            msg_type, payload = message
+
+            if msg_type == MessageType.PACKED:
+                await _receive_packed(stream, group, payload)
+            elif msg_type == MessageType.TRANSFER_COMPLETE:
+                break
+            elif msg_type == MessageType.CANCEL:
+                transfer_info.state = TransferState.CANCELLED
+                await state_callback(transfer_info)
+                return transfer_info
+            elif msg_type == MessageType.PAUSE:
+                transfer_info.state = TransferState.PAUSED_BY_PEER
+                await state_callback(transfer_info)
+            elif msg_type == MessageType.RESUME:
+                transfer_info.state = TransferState.TRANSFERRING
+                await state_callback(transfer_info)
+            elif msg_type == MessageType.ERROR:
+                raise ConnectionError(f"Sender error: {payload.decode('utf-8', 'replace')}")
+            else:
+                logger.warning(f"Unexpected message type during folder receive: {msg_type:#x}")
+
+        # 5. Every member was acknowledged before the sender got here; let
+        # the last ones finish reporting, then check that all arrived
+        await group.progress.wait_idle(VERIFY_TIMEOUT)
+        if group.progress.failures:
+            raise RuntimeError(f"{len(group.progress.failures)} files failed, first: {group.progress.failures[0]}")
+        if transfer_info.files_done != transfer_info.file_count:
+            raise RuntimeError(f"Only {transfer_info.files_done} of {transfer_info.file_count} files arrived")
+        await stream.send(MessageType.TRANSFER_COMPLETE)
+
+        completed = True
+        await _finish_transfer(transfer_info, state_callback, root, peer_identity, trust_store, None)
+        return transfer_info
 
-        queue = asyncio.Queue(maxsize=4)
-        decryption_failures = 0
+    except asyncio.CancelledError:
+        if transfer_info:
+            transfer_info.state = TransferState.CANCELLED
+            await state_callback(transfer_info)
+    except Exception as e:
+        if resumable and session.is_closed and transfer_info.state not in _STOPPED_STATES:
+            logger.warning(f"Lost connection receiving folder {transfer_info.file_name}: {e}")
+            lost = True
+        else:
+            logger.error(f"Folder receive error: {e}")
+            if transfer_info and transfer_info.state != TransferState.CANCELLED:
+                transfer_info.state = TransferState.FAILED
+                transfer_info.error_message = str(e)
+                await state_callback(transfer_info)
+                await _notify_peer(stream, MessageType.ERROR, str(e).encode("utf-8"))
+    finally:
+        for task in (monitor_task, mirror_task):
+            if task:
+                task.cancel()
+        if group:
+            _folder_groups.pop(group.progress.transfer_info.transfer_id, None)
+            if not completed:
+                # Stop members still arriving; their files stay for resume
+                group.progress.mirror(TransferState.CANCELLED)
+        stream.close()
+        if resumable:
+            if lost:
+                await _hold_for_reconnect(transfer_info.transfer_id, resumable, transfer_info, state_callback)
+            elif _resumables.get(transfer_info.transfer_id) is resumable:
+                del _resumables[transfer_info.transfer_id]
+            resumable.released.set()
 
-        async def _net_producer():
-            try:
-                while True:
-                    msg_type, payload = await recv_message(reader)
-                    await queue.put((msg_type, payload))
-                    if msg_type in (MessageType.TRANSFER_COMPLETE, MessageType.CANCEL, MessageType.REJECT):
-                        break
-            except Exception as e:
-                await queue.put((e, None))
+    return transfer_info
 
-        producer_task = asyncio.create_task(_net_producer())
 
-        with open(file_path, mode) as f:
-            while True:
-                if transfer_info.state == TransferState.CANCELLED:
-                    return transfer_info
+async def receive_file(
+    stream: SessionStream,
+    save_dir: str,
+    accept_callback,
+    progress_callback,
+    state_callback,
+    identity_service = None,
+    trust_store = None,
+    content_index: ContentIndex | None = None,
+) -> TransferInfo | None:
+    """
+    Handle an incoming file transfer stream.
 
-                try:
-                    res = await asyncio.wait_for(queue.get(), timeout=1.0)
-                except asyncio.TimeoutError:
-                    continue
+    The stream is either the control stream of a new transfer (starts
+    with METADATA), of a folder transfer (starts with MANIFEST), or an
+    extra stripe of a transfer that is already in progress (starts with
+    STRIPE_JOIN). Member files of an accepted folder arrive as new
+    transfers whose metadata names the folder.
 
-                if isinstance(res[0], Exception):
-                    raise res[0]
+    Args:
+        stream: The session stream opened by the sender.
+        save_dir: Directory to save the received file.
+        accept_callback: async fn(transfer_info) -> bool — prompts user.
+        progress_callback: async fn(transfer_info) called on progress.
+        state_callback: async fn(transfer_info) called on state change.
+        content_index: Files already on disk by digest, for dedup.
 
-                msg_type, payload = res
+    Returns:
+        The TransferInfo of the completed transfer, or None if rejected.
+    """
+    transfer_info: TransferInfo | None = None
+    monitor_task: asyncio.Task | None = None
+    group: _StripeGroup | None = None
+    target: PositionalFile | None = None
+    resumable: _Resumable | None = None
+    previous: _Resumable | None = None
+    completed = False
+    lost = False
 
-                if msg_type == MessageType.TRANSFER_COMPLETE:
-                    break
-                elif msg_type == MessageType.CANCEL:
-                    transfer_info.state = TransferState.CANCELLED
+    session = stream.session
+
+    try:
+        # 1. Receive metadata (the session already did the handshake)
+        msg_type, metadata_raw = await stream.recv()
+        if msg_type == MessageType.STRIPE_JOIN:
+            await _join_stripe(stream, metadata_raw, state_callback)
+            return None
+        if msg_type == MessageType.MANIFEST:
+            return await _receive_folder(
+                stream, metadata_raw, save_dir, accept_callback, progress_callback,
+                state_callback, identity_service, trust_store,
+            )
+        if msg_type != MessageType.METADATA:
+            raise ConnectionError(f"Expected METADATA, got {msg_type:#x}")
+
+        metadata = FileMetadata(**json.loads(metadata_raw.decode("utf-8")))
+
+        folder = None
+        if metadata.folder_id:
+            # A member of an accepted folder: no prompt of its own, and its
+            # state and progress roll up into the folder
+            folder = _claim_member(session, metadata)
+            if folder is None:
+                await stream.send(MessageType.REJECT)
+                return None
+            progress_callback = folder.progress.on_progress
+            state_callback = folder.progress.on_state
+            trust_store = None
+
+        peer_identity, real_sender_name = _sender_identity(session, metadata, trust_store)
+
+        transfer_info = TransferInfo(
+            transfer_id=metadata.transfer_id,
+            file_name=metadata.file_name,
+            file_size=metadata.file_size,
+            direction=TransferDirection.RECEIVING,
+            peer_device_id=metadata.sender_device_id,
+            peer_device_name=real_sender_name,
+            state=TransferState.AWAITING_ACCEPTANCE,
+            cipher_suite=session.cipher.suite,
+        )
+        await state_callback(transfer_info)
+
+        # 2. Ask user to accept/reject, unless the sender is resuming a
+        # transfer that lost its connection
+        if folder:
+            file_path = safe_join(folder.root, metadata.relative_path)
+        else:
+            previous = await _take_over(session, metadata)
+            if previous:
+                logger.info(f"{metadata.file_name}: sender reconnected, resuming")
+                file_path = previous.path
+            else:
+                accepted = await accept_callback(transfer_info)
+                if not accepted:
+                    await stream.send(MessageType.REJECT)
+                    transfer_info.state = TransferState.REJECTED
                     await state_callback(transfer_info)
                     return transfer_info
-                elif msg_type == MessageType.PAUSE:
-                    transfer_info.state = TransferState.PAUSED_BY_PEER
-                    await state_callback(transfer_info)
-                    continue
-                elif msg_type == MessageType.RESUME:
-                    transfer_info.state = TransferState.TRANSFERRING
-                    await state_callback(transfer_info)
-                    continue
-                elif msg_type == MessageType.DATA_CHUNK:
-                    try:
-                        # Security limit: Aggressively drop if decryption hangs or fails
-                        decrypted = await asyncio.wait_for(
-                            asyncio.to_thread(decrypt_chunk, session_key, payload),
-                            timeout=5.0
-                        )
-                    except Exception as e:
-                        decryption_failures += 1
-                        if decryption_failures >= 3:
-                            raise RuntimeError("Multiple decryption failures. Potential malformed chunk DoS attack.") from e
-                        continue
-
-                    await asyncio.to_thread(f.write, decrypted)
-
-                    transfer_info.transferred_bytes += len(decrypted)
-                    tracker.record(len(decrypted))
-
-                    now = time.monotonic()
-                    if now - last_progress_time >= 0.2:
-                        transfer_info.speed_bps = tracker.get_speed()
-                        transfer_info.progress_percent = (
-                            transfer_info.transferred_bytes
-                            / transfer_info.file_size
-                            * 100
-                            if transfer_info.file_size > 0
-                            else 100
-                        )
-                        remaining = transfer_info.file_size - transfer_info.transferred_bytes
-                        transfer_info.eta_seconds = (
-                            remaining / transfer_info.speed_bps
-                            if transfer_info.speed_bps > 0
-                            else 0
-                        )
-                        await progress_callback(transfer_info)
-                        last_progress_time = now
-                else:
-                    logger.warning(f"Unexpected message type during receive: {msg_type:#x}")
-
-        # 6. Complete
-        if peer_identity and trust_store:
-            trust_store.add_trusted_peer(*peer_identity)
-            
-        transfer_info.state = TransferState.COMPLETED
-        transfer_info.progress_percent = 100.0
-        transfer_info.speed_bps = 0
-        transfer_info.eta_seconds = 0
+
+                file_path = os.path.join(save_dir, metadata.file_name)
+            resumable = _Resumable(session, metadata, file_path)
+            if previous:
+                resumable.reconnects = transfer_info.reconnects = previous.reconnects + 1
+            _resumables[transfer_info.transfer_id] = resumable
+
+        # 3. Content we already have is linked into place, not received
+        if DEDUP_ENABLED and content_index and metadata.content_digest:
+            existing = content_index.find(metadata.content_digest, metadata.file_size)
+            if existing and await asyncio.to_thread(link_file, existing, file_path):
+                logger.info(f"{metadata.file_name}: already have it as {existing}")
+                try:
+                    os.unlink(file_path + PART_SUFFIX)  # Leftover of an earlier attempt
+                except OSError:
+                    pass
+                accept_payload = {"deduplicated": True}
+                if identity_service:
+                    accept_payload["device_name"] = DEVICE_NAME
+                await stream.send(MessageType.ACCEPT, json.dumps(accept_payload).encode('utf-8'))
+                transfer_info.deduplicated = True
+                transfer_info.transferred_bytes = metadata.file_size
+                transfer_info.resumed_bytes = metadata.file_size
+                transfer_info.digest = metadata.content_digest
+                await _finish_transfer(
+                    transfer_info, state_callback, file_path, peer_identity, trust_store, content_index
+                )
+                return transfer_info
+
+        # 4. Check for partial data (resume support). Data is received
+        # into a .part file, whose contents are not trusted: they are
+        # verified block by block against the sender's.
+        part_path = file_path + PART_SUFFIX
+        existing_size = await asyncio.to_thread(_prepare_part, file_path)
+        resume_length = min(existing_size, metadata.file_size)
+        free = (await asyncio.to_thread(shutil.disk_usage, os.path.dirname(part_path))).free
+        if metadata.file_size - resume_length > free:
+            raise RuntimeError(
+                f"Not enough disk space: need {metadata.file_size - resume_length} bytes, {free} free"
+            )
+        # One block grid for resume and for the file digest
+        block_size = choose_block_size(metadata.file_size)
+        # Leaves kept from before a reconnect; checked before preallocation touches the file
+        leaves = previous.hashes(part_path, resume_length, block_size) if previous else None
+
+        # Register the stripe group before ACCEPT so extra streams
+        # that race ahead of RESUME_PLAN can find it.
+        stripe_count = max(1, min(metadata.stripes, MAX_STRIPES))
+        target = PositionalFile(part_path, truncate=resume_length == 0)
+        if existing_size > metadata.file_size:
+            target.truncate(metadata.file_size)
+        await asyncio.to_thread(target.preallocate, metadata.file_size)
+        progress = ProgressReporter(transfer_info, progress_callback)
+        group = _StripeGroup(transfer_info, session.session_key, stripe_count, target, progress)
+        if metadata.compression:
+            group.compression = CompressionStats(transfer_info, metadata.compression)
+        _stripe_groups[transfer_info.transfer_id] = group
+        transfer_info.stripes = stripe_count
+        transfer_info.chunk_size = CHUNK_SIZE
+        transfer_info.pipeline_depth = STREAM_QUEUE_DEPTH
+
+        accept_payload = {
+            "stripes": stripe_count,
+            "max_chunk_size": MAX_CHUNK_SIZE,
+            "max_depth": MAX_PIPELINE_DEPTH,
+            # Lets the sender hash its copy while we hash ours
+            "resume_length": resume_length,
+            "block_size": block_size,
+        }
+        if identity_service:
+            accept_payload["device_name"] = DEVICE_NAME
+        await stream.send(MessageType.ACCEPT, json.dumps(accept_payload).encode('utf-8'))
+
+        hashes = b""
+        if leaves is not None:
+            hashes = await asyncio.to_thread(fill_blocks, part_path, leaves, resume_length, block_size)
+        elif resume_length:
+            hashes = await asyncio.to_thread(hash_blocks, part_path, resume_length, block_size)
+        group.digest = FileDigest(metadata.file_size, block_size, hashes)
+        await stream.send(MessageType.BLOCK_HASHES, hashes)
+        msg_type, plan_data = await stream.recv()
+        if msg_type != MessageType.RESUME_PLAN:
+            raise ConnectionError(f"Expected RESUME_PLAN, got {msg_type:#x}")
+        resumed = struct.unpack("!Q", plan_data)[0]
+
+        # 5. Start receiving chunks
+        transfer_info.state = TransferState.TRANSFERRING
+        transfer_info.transferred_bytes = resumed
+        transfer_info.resumed_bytes = resumed
         await state_callback(transfer_info)
+
+        if not folder:
+            # START MONITORING FOR LOCAL STATE CHANGES (Pause/Resume from UI)
+            monitor_task = asyncio.create_task(
+                _monitor_local_state(stream, transfer_info)
+            )
+
+        # The control stream doubles as stripe 0
+        completed = await _receive_stripe(stream, group, 0, state_callback)
+        group.finish(0, completed)
+        if completed:
+            completed = await group.wait_extra_stripes()
+        if not completed:
+            return transfer_info
+
+        # 6. Verify the whole file against the sender's digest
+        root = group.digest.root()
+        if root is None or root != group.expected_digest:
+            raise RuntimeError("File digest mismatch: received data differs from the sender's file")
+        transfer_info.digest = root.hex()
+
+        # Only a verified file takes the real name, and the rename is atomic
+        await asyncio.to_thread(target.sync)
+        target.close()
+        target = None
+        await asyncio.to_thread(os.replace, part_path, file_path)
+        await stream.send(MessageType.TRANSFER_COMPLETE)
+
+        # 7. Complete
+        await _finish_transfer(
+            transfer_info, state_callback, file_path, peer_identity, trust_store, content_index
+        )
         return transfer_info
 
     except asyncio.CancelledError:
@@ -615,20 +2324,48 @@ async def receive_file(
             transfer_info.state = TransferState.CANCELLED
             await state_callback(transfer_info)
     except Exception as e:
-        logger.error(f"Receive error: {e}")
-        if transfer_info and transfer_info.state != TransferState.CANCELLED:
-            transfer_info.state = TransferState.FAILED
-            transfer_info.error_message = str(e)
-            await state_callback(transfer_info)
+        if resumable and session.is_closed and transfer_info.state not in _STOPPED_STATES:
+            # Held for the sender to reconnect, once torn down below
+            logger.warning(f"Lost connection receiving {transfer_info.file_name}: {e}")
+            lost = True
+        else:
+            logger.error(f"Receive error: {e}")
+            if transfer_info and transfer_info.state != TransferState.CANCELLED:
+                transfer_info.state = TransferState.FAILED
+                transfer_info.error_message = str(e)
+                await state_callback(transfer_info)
+                await _notify_peer(stream, MessageType.ERROR, str(e).encode("utf-8"))
     finally:
         if monitor_task:
             monitor_task.cancel()
-        
-        if writer:
-            writer.close()
-            try:
-                await writer.wait_closed()
-            except Exception:
-                pass
+
+        if group:
+            _stripe_groups.pop(group.transfer_info.transfer_id, None)
+        try:
+            if group and not completed:
+                # A partial file may have holes where stripes fell behind;
+                # the next resume finds them by their block hashes.
+                await group.settle()
+        finally:
+            # Close even if we were cancelled while settling (shutdown)
+            if target:
+                try:
+                    # Drop the preallocated tail, so the next resume only
+                    # hashes what was actually written
+                    target.truncate(target.written_end)
+                except OSError:
+                    pass
+                target.close()
+
+            stream.close()
+            if resumable:
+                if lost:
+                    await _hold_for_reconnect(
+                        transfer_info.transfer_id, resumable, transfer_info, state_callback,
+                        group.digest if group else None,
+                    )
+                elif _resumables.get(transfer_info.transfer_id) is resumable:
+                    del _resumables[transfer_info.transfer_id]
+                resumable.released.set()
 
     return transfer_info
@@ -0,0 +1,649 @@
+"""
+Persistent peer sessions.
+
+A session is one TCP connection that has completed the X25519 key
+exchange and the Ed25519 identity exchange. Any number of file transfers
+are multiplexed over it as independent streams, each identified by the
+stream ID carried in every frame header, so a batch of files pays for
+the connection, handshake and signatures once instead of once per file.
+
+Both ends send a PING on the control stream whenever they have sent
+nothing for HEARTBEAT_INTERVAL, and drop the session once nothing at all
+has arrived from the peer for HEARTBEAT_TIMEOUT while we were reading. A
+peer that vanished without closing its connection (a laptop leaving the
+Wi-Fi) then fails its streams within seconds instead of leaving them
+blocked in recv().
+"""
+
+import asyncio
+import errno
+import json
+import logging
+import os
+import struct
+import time
+
+from cryptography.hazmat.primitives.asymmetric import ed25519
+
+from config import (
+    CONNECT_TIMEOUT,
+    HEARTBEAT_INTERVAL,
+    HEARTBEAT_TIMEOUT,
+    MAX_PIPELINE_BYTES,
+    MAX_STRIPES,
+    SESSION_IDLE_TIMEOUT,
+    STREAM_QUEUE_DEPTH,
+)
+from security.crypto import (
+    AES_256_GCM,
+    CIPHER_SUITES,
+    SessionCipher,
+    choose_cipher_suite,
+    cipher_speeds,
+    derive_shared_key,
+    generate_keypair,
+)
+from transfer.compression import supported_codecs
+from transfer.models import MessageType
+from transfer.protocol import FRAME_HEADER_FORMAT, BufferPool, FrameProtocol
+from transfer.tuner import PipelineWindow
+
+logger = logging.getLogger(__name__)
+
+# --- Framing ---
+
+# Stream 0 carries session-level messages (handshake, identity, PING/PONG)
+CONTROL_STREAM = 0
+
+# Frames that use up a stream's credit (see SessionStream)
+_FLOW_CONTROLLED = (MessageType.DATA_CHUNK, MessageType.PACKED)
+# CREDIT payload: how many more such frames the peer may send
+_CREDIT_FORMAT = "!I"
+
+# Domain separation for the identity signatures over the handshake transcript
+_INITIATOR_CONTEXT = b"transfer-booth-v1-initiator:"
+_RESPONDER_CONTEXT = b"transfer-booth-v1-responder:"
+
+
+async def write_frame(writer, msg_type: int, stream_id: int, *parts: bytes) -> None:
+    """
+    Send a type-stream-length-payload frame.
+
+    The payload may be given as several buffers; they are passed to the
+    transport as one vectored write (sendmsg on Python 3.12+) instead of
+    being concatenated, so large chunks are never copied to be framed.
+    ``writer`` is a FrameProtocol or an asyncio.StreamWriter.
+    """
+    length = sum(len(part) for part in parts)
+    header = struct.pack(FRAME_HEADER_FORMAT, msg_type, stream_id, length)
+    writer.writelines((header, *parts))
+    await writer.drain()
+
+
+async def _expect_frame(conn: FrameProtocol, expected: int) -> bytes:
+    msg_type, _, payload = await conn.read_frame()
+    if msg_type != expected:
+        raise ConnectionError(f"Expected {expected:#x}, got {msg_type:#x}")
+    return payload
+
+
+def _new_connection(on_connect=None) -> FrameProtocol:
+    # Enough idle buffers for one stream's full pipeline of frames
+    return FrameProtocol(BufferPool(max_free_bytes=MAX_PIPELINE_BYTES), on_connect)
+
+
+async def start_session_server(handler, host: str, port: int) -> asyncio.Server:
+    """Listen for sessions; ``handler`` is an async fn(conn) per connection."""
+    loop = asyncio.get_running_loop()
+    return await loop.create_server(lambda: _new_connection(handler), host, port)
+
+
+# --- Handshake ---
+
+# X25519 public key at the start of each HANDSHAKE_PUBKEY payload. The
+# initiator follows it with its cipher speeds (JSON), the responder with
+# the suite it picked. A bare key means AES-256-GCM.
+_PUBKEY_SIZE = 32
+
+
+async def perform_handshake_sender(conn: FrameProtocol) -> tuple[bytes, bytes, str]:
+    """
+    Perform ECDH handshake as the sender (initiator).
+    Returns (session_key, transcript, cipher_suite) where the transcript
+    is both HANDSHAKE_PUBKEY payloads, initiator first, so the identity
+    signatures also cover the suite negotiation.
+    """
+    private_key, pub_bytes = generate_keypair()
+
+    # Send our public key and how fast we run each cipher
+    offer = pub_bytes + json.dumps({"ciphers": cipher_speeds()}).encode("utf-8")
+    await write_frame(conn, MessageType.HANDSHAKE_PUBKEY, CONTROL_STREAM, offer)
+
+    # Receive peer's public key and its choice
+    reply = await _expect_frame(conn, MessageType.HANDSHAKE_PUBKEY)
+    suite = reply[_PUBKEY_SIZE:].decode("utf-8") or AES_256_GCM
+    if suite not in cipher_speeds():
+        raise ConnectionError(f"Peer chose unsupported cipher {suite!r}")
+
+    return derive_shared_key(private_key, reply[:_PUBKEY_SIZE]), offer + reply, suite
+
+
+async def perform_handshake_receiver(conn: FrameProtocol) -> tuple[bytes, bytes, str]:
+    """
+    Perform ECDH handshake as the receiver.
+    Returns (session_key, transcript, cipher_suite) where the transcript
+    is both HANDSHAKE_PUBKEY payloads, initiator first.
+    """
+    private_key, pub_bytes = generate_keypair()
+
+    # Receive peer's public key and cipher speeds
+    offer = await _expect_frame(conn, MessageType.HANDSHAKE_PUBKEY)
+    suite = choose_cipher_suite(cipher_speeds(), _offered_ciphers(offer[_PUBKEY_SIZE:]))
+
+    # Send our public key and the suite that is fastest for both of us
+    reply = pub_bytes + (suite.encode("utf-8") if suite != AES_256_GCM else b"")
+    await write_frame(conn, MessageType.HANDSHAKE_PUBKEY, CONTROL_STREAM, reply)
+
+    return derive_shared_key(private_key, offer[:_PUBKEY_SIZE]), offer + reply, suite
+
+
+def _offered_ciphers(payload: bytes) -> dict[str, float]:
+    """Cipher speeds the initiator advertised; a peer that sent none gets AES-256-GCM."""
+    if not payload:
+        return {AES_256_GCM: 0.0}
+    try:
+        ciphers = json.loads(payload.decode("utf-8")).get("ciphers", {})
+        return {str(name): float(speed) for name, speed in ciphers.items() if name in CIPHER_SUITES}
+    except (ValueError, AttributeError, TypeError):
+        return {AES_256_GCM: 0.0}
+
+
+def _build_hello(identity_service, transcript: bytes, context: bytes) -> bytes:
+    """
+    Sign the handshake transcript with our long-term identity key and
+    advertise the compression codecs we can decode and the credit each
+    stream starts with.
+    """
+    hello = {"codecs": supported_codecs(), "stream_credit": STREAM_QUEUE_DEPTH}
+    if identity_service:
+        hello["identity_public_key"] = identity_service.get_public_bytes().hex()
+        hello["identity_signature"] = identity_service.sign(context + transcript).hex()
+    return json.dumps(hello).encode("utf-8")
+
+
+def _hello_codecs(payload: bytes) -> list[str]:
+    """Codec names the peer advertised in its SESSION_HELLO."""
+    try:
+        codecs = json.loads(payload.decode("utf-8")).get("codecs", [])
+        return [str(name) for name in codecs] if isinstance(codecs, list) else []
+    except ValueError:
+        return []
+
+
+def _hello_credit(payload: bytes) -> int | None:
+    """Initial credit per stream the peer grants, or None if it predates CREDIT."""
+    try:
+        credit = json.loads(payload.decode("utf-8")).get("stream_credit")
+        return int(credit) if credit is not None and int(credit) > 0 else None
+    except (ValueError, TypeError):
+        return None
+
+
+def _verify_hello(payload: bytes, transcript: bytes, context: bytes) -> str:
+    """Return the peer's verified identity key (hex), or "" if absent/invalid."""
+    try:
+        hello = json.loads(payload.decode("utf-8"))
+        pk = hello.get("identity_public_key")
+        sig = hello.get("identity_signature")
+        if not pk or not sig:
+            return ""
+        pub_key_obj = ed25519.Ed25519PublicKey.from_public_bytes(bytes.fromhex(pk))
+        pub_key_obj.verify(bytes.fromhex(sig), context + transcript)
+        return pk
+    except Exception as e:
+        logger.warning(f"Failed to verify peer identity: {e}")
+        return ""
+
+
+# --- Sessions ---
+
+class SessionStream:
+    """
+    One logical file transfer inside a PeerSession.
+
+    Control messages are queued without limit. DATA_CHUNK and PACKED
+    frames are flow controlled per stream: each side may only send as
+    many as the other has granted credit for, and every one the consumer
+    takes off the queue is granted again with a CREDIT message. A slow
+    consumer therefore holds up its own sender only, never the session's
+    reader, its heartbeats or the other streams. With a peer that
+    predates CREDIT the reader still waits for a free DATA_CHUNK slot.
+    """
+
+    def __init__(self, session: "PeerSession", stream_id: int):
+        self.session = session
+        self.stream_id = stream_id
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._depth = STREAM_QUEUE_DEPTH
+        # Receiving: frames the peer was granted, has sent and we have consumed
+        self._granted = STREAM_QUEUE_DEPTH
+        self._received = 0
+        self._consumed = 0
+        self._data_slots = PipelineWindow(STREAM_QUEUE_DEPTH)  # Peers without CREDIT
+        # Sending: frames the peer will still take, None if it grants no credit
+        self._credit = session.peer_credit
+        self._credit_changed = asyncio.Event()
+        self._error: Exception | None = None
+
+    @property
+    def has_credit(self) -> bool:
+        """Whether a DATA_CHUNK or PACKED frame can be sent without waiting for the peer."""
+        return self._credit is None or self._credit > 0
+
+    async def wait_for_credit(self) -> None:
+        """Wait until the peer takes another DATA_CHUNK or PACKED frame."""
+        while not self.has_credit:
+            if self._error:
+                raise self._error
+            self._credit_changed.clear()
+            await self._credit_changed.wait()
+
+    async def send(self, msg_type: int, *parts: bytes) -> None:
+        if msg_type in _FLOW_CONTROLLED and self._credit is not None:
+            await self.wait_for_credit()
+            self._credit -= 1
+        await self.session.send(self.stream_id, msg_type, *parts)
+
+    async def recv(self) -> tuple[int, bytes]:
+        """
+        Receive the next message on this stream. Returns (type, payload).
+
+        A DATA_CHUNK payload is a memoryview over a pooled buffer; pass it
+        to ``session.release()`` once it has been decrypted.
+        """
+        item = await self._queue.get()
+        if isinstance(item, Exception):
+            # Leave the error in place for any later recv() as well
+            self._queue.put_nowait(item)
+            raise item
+        msg_type, payload = item
+        if msg_type in _FLOW_CONTROLLED:
+            self._consumed += 1
+            if self.session.peer_credit is None:
+                if msg_type == MessageType.DATA_CHUNK:
+                    self._data_slots.release()
+            else:
+                self._grant()
+        return msg_type, payload
+
+    def set_depth(self, depth: int) -> None:
+        """Change how many data frames may wait in this stream's queue."""
+        self._depth = depth
+        self._data_slots.resize(depth)
+        if self.session.peer_credit is not None:
+            self._grant()
+
+    def close(self) -> None:
+        """Detach from the session; late frames for this stream are dropped."""
+        self.session._streams.pop(self.stream_id, None)
+        self.session.cipher.forget(self.stream_id)
+        if not self.session._streams:
+            # Don't pin chunk buffers while the session idles
+            self.session.buffers.clear()
+
+    def _grant(self) -> None:
+        """Top the peer's credit back up to the queue depth, half a queue at a time."""
+        credit = self._consumed + self._depth - self._granted
+        if credit >= max(1, self._depth // 2):
+            self._granted += credit
+            self.session._send_nowait(
+                self.stream_id, MessageType.CREDIT, struct.pack(_CREDIT_FORMAT, credit)
+            )
+
+    def _add_credit(self, payload: bytes) -> None:
+        if self._credit is None:
+            return
+        try:
+            (credit,) = struct.unpack(_CREDIT_FORMAT, payload)
+        except struct.error:
+            raise ConnectionError(f"Malformed CREDIT on stream {self.stream_id}") from None
+        self._credit += credit
+        self._credit_changed.set()
+
+    def _deliver(self, msg_type: int, payload: bytes) -> None:
+        if msg_type in _FLOW_CONTROLLED and self.session.peer_credit is not None:
+            if self._received >= self._granted:
+                raise ConnectionError(f"Peer overran the credit of stream {self.stream_id}")
+            self._received += 1
+        self._queue.put_nowait((msg_type, payload))
+
+    def _fail(self, error: Exception) -> None:
+        self._error = error
+        self._credit_changed.set()
+        self._queue.put_nowait(error)
+
+
+class PeerSession:
+    """An authenticated connection to one peer, multiplexing many streams."""
+
+    def __init__(
+        self,
+        conn: FrameProtocol,
+        session_key: bytes,
+        peer_public_key: str,
+        initiator: bool,
+        peer_codecs: list[str] | None = None,
+        cipher_suite: str = AES_256_GCM,
+        peer_credit: int | None = None,
+    ):
+        self.session_key = session_key
+        # One AEAD context per handshake, with per-stream counter nonces
+        self.cipher = SessionCipher(session_key, initiator, cipher_suite)
+        # Verified Ed25519 identity of the peer (hex), "" if unverified
+        self.peer_public_key = peer_public_key
+        # Compression codecs the peer can decode, from its SESSION_HELLO
+        self.peer_codecs = peer_codecs or []
+        # Initial credit per stream from the peer's SESSION_HELLO, None if it predates CREDIT
+        self.peer_credit = peer_credit
+        self.last_active = time.monotonic()
+        self._last_sent = self.last_active
+        self._conn = conn
+        self._streams: dict[int, SessionStream] = {}
+        # Initiator opens odd stream IDs, responder even ones
+        self._next_stream_id = 1 if initiator else 2
+        self._last_remote_stream_id = 0
+        self._on_stream = None
+        self._handler_tasks: set[asyncio.Task] = set()
+        self._reader_task: asyncio.Task | None = None
+        self._heartbeat_task: asyncio.Task | None = None
+        self._close_error: Exception | None = None
+        self._pings: dict[bytes, asyncio.Future] = {}
+        self._closed = asyncio.Event()
+
+    @classmethod
+    async def connect(cls, peer_ip: str, peer_port: int, identity_service=None) -> "PeerSession":
+        """Open and authenticate a new session to a peer."""
+        loop = asyncio.get_running_loop()
+        try:
+            _, conn = await asyncio.wait_for(
+                loop.create_connection(_new_connection, peer_ip, peer_port), CONNECT_TIMEOUT
+            )
+        except asyncio.TimeoutError:
+            raise TimeoutError(errno.ETIMEDOUT, f"No answer from {peer_ip}:{peer_port}") from None
+        try:
+            session_key, transcript, suite = await perform_handshake_sender(conn)
+            await write_frame(
+                conn, MessageType.SESSION_HELLO, CONTROL_STREAM,
+                _build_hello(identity_service, transcript, _INITIATOR_CONTEXT),
+            )
+            hello = await _expect_frame(conn, MessageType.SESSION_HELLO)
+        except BaseException:
+            conn.close()
+            raise
+        session = cls(
+            conn, session_key,
+            _verify_hello(hello, transcript, _RESPONDER_CONTEXT),
+            initiator=True,
+            peer_codecs=_hello_codecs(hello),
+            cipher_suite=suite,
+            peer_credit=_hello_credit(hello),
+        )
+        session.start()
+        return session
+
+    @classmethod
+    async def accept(cls, conn: FrameProtocol, identity_service=None) -> "PeerSession":
+        """Authenticate an incoming connection as the responder."""
+        session_key, transcript, suite = await perform_handshake_receiver(conn)
+        hello = await _expect_frame(conn, MessageType.SESSION_HELLO)
+        await write_frame(
+            conn, MessageType.SESSION_HELLO, CONTROL_STREAM,
+            _build_hello(identity_service, transcript, _RESPONDER_CONTEXT),
+        )
+        return cls(
+            conn, session_key,
+            _verify_hello(hello, transcript, _INITIATOR_CONTEXT),
+            initiator=False,
+            peer_codecs=_hello_codecs(hello),
+            cipher_suite=suite,
+            peer_credit=_hello_credit(hello),
+        )
+
+    @property
+    def is_closed(self) -> bool:
+        return self._closed.is_set()
+
+    @property
+    def active_streams(self) -> int:
+        return len(self._streams)
+
+    def start(self, on_stream=None) -> None:
+        """
+        Start demultiplexing incoming frames.
+
+        Args:
+            on_stream: async fn(stream) run for every stream the peer
+                opens. Without it, peer-opened streams are ignored.
+        """
+        self._on_stream = on_stream
+        self._reader_task = asyncio.create_task(self._read_loop())
+        self._heartbeat_task = asyncio.create_task(self._heartbeat())
+
+    def open_stream(self) -> SessionStream:
+        if self.is_closed:
+            raise ConnectionError("Session closed")
+        stream = SessionStream(self, self._next_stream_id)
+        self._next_stream_id += 2
+        self._streams[stream.stream_id] = stream
+        return stream
+
+    async def send(self, stream_id: int, msg_type: int, *parts: bytes) -> None:
+        if self.is_closed:
+            raise ConnectionError("Session closed")
+        self.last_active = self._last_sent = time.monotonic()
+        await write_frame(self._conn, msg_type, stream_id, *parts)
+
+    def _send_nowait(self, stream_id: int, msg_type: int, *parts: bytes) -> None:
+        """
+        Send a small frame without waiting for drain(), for frames that
+        must not stall on a full send buffer (heartbeats, credit).
+        """
+        if self.is_closed:
+            return
+        self._last_sent = time.monotonic()
+        length = sum(len(part) for part in parts)
+        self._conn.writelines((struct.pack(FRAME_HEADER_FORMAT, msg_type, stream_id, length), *parts))
+
+    @property
+    def send_backlog(self) -> int:
+        """Bytes written but still queued in our transport, not yet handed to the kernel."""
+        return self._conn.write_buffer_size
+
+    @property
+    def buffers(self) -> BufferPool:
+        """Pool the session's chunk frames are received into."""
+        return self._conn.pool
+
+    def release(self, payload: memoryview) -> None:
+        """Hand a received DATA_CHUNK payload's buffer back for reuse."""
+        self._conn.release(payload)
+
+    async def ping(self, timeout: float = 5.0) -> float:
+        """Measure the round-trip time to the peer, in seconds."""
+        token = os.urandom(8)
+        waiter = asyncio.get_running_loop().create_future()
+        self._pings[token] = waiter
+        try:
+            start = time.monotonic()
+            await self.send(CONTROL_STREAM, MessageType.PING, token)
+            await asyncio.wait_for(waiter, timeout)
+            return time.monotonic() - start
+        finally:
+            self._pings.pop(token, None)
+
+    async def wait_closed(self) -> None:
+        await self._closed.wait()
+
+    def close(self, error: Exception | None = None) -> None:
+        """
+        Close the connection. With an ``error``, which its streams then
+        fail with, the peer is given up on: unsent data is dropped, so
+        writers blocked on a full send buffer fail at once.
+        """
+        self._close_error = self._close_error or error
+        self._closed.set()
+        if self._reader_task:
+            self._reader_task.cancel()
+        if error:
+            self._conn.abort()
+        else:
+            self._conn.close()
+
+    async def _read_loop(self) -> None:
+        error: Exception = ConnectionError("Session closed")
+        try:
+            while True:
+                msg_type, stream_id, payload = await self._conn.read_frame()
+
+                if stream_id == CONTROL_STREAM:
+                    # Heartbeats don't keep an idle session out of the reaper
+                    self._handle_control(msg_type, payload)
+                    continue
+                self.last_active = time.monotonic()
+
+                stream = self._streams.get(stream_id)
+                if msg_type == MessageType.CREDIT:
+                    if stream is not None:
+                        stream._add_credit(payload)
+                    continue
+                if stream is None:
+                    if not self._accepts_remote_stream(stream_id):
+                        # Late frame for a stream that has already ended
+                        if msg_type == MessageType.DATA_CHUNK:
+                            self.release(payload)
+                        continue
+                    self._last_remote_stream_id = stream_id
+                    stream = SessionStream(self, stream_id)
+                    self._streams[stream_id] = stream
+                    task = asyncio.create_task(self._on_stream(stream))
+                    self._handler_tasks.add(task)
+                    task.add_done_callback(self._handler_tasks.discard)
+
+                if msg_type == MessageType.DATA_CHUNK and self.peer_credit is None:
+                    # A peer without CREDIT: hold the reader until the stream has room
+                    await stream._data_slots.acquire()
+                stream._deliver(msg_type, payload)
+        except (asyncio.IncompleteReadError, ConnectionError, OSError) as e:
+            error = ConnectionError(f"Session lost: {e}")
+        except asyncio.CancelledError:
+            error = self._close_error or error
+        finally:
+            self._closed.set()
+            if self._heartbeat_task:
+                self._heartbeat_task.cancel()
+            for stream in list(self._streams.values()):
+                stream._fail(error)
+            self._conn.close()
+
+    async def _heartbeat(self) -> None:
+        while not self.is_closed:
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            now = time.monotonic()
+            silent = self._conn.silence
+            if silent > HEARTBEAT_TIMEOUT:
+                logger.warning(f"Peer silent for {silent:.0f}s; dropping its session")
+                self.close(ConnectionError(f"Peer stopped responding ({silent:.0f}s without data)"))
+                return
+            if now - self._last_sent >= HEARTBEAT_INTERVAL:
+                # A stalled transport must not stall the timer
+                self._send_nowait(CONTROL_STREAM, MessageType.PING)
+
+    def _handle_control(self, msg_type: int, payload: bytes) -> None:
+        if msg_type == MessageType.PING:
+            # Reply from a task: the read loop must never wait on our send buffer
+            task = asyncio.create_task(self._send_pong(payload))
+            self._handler_tasks.add(task)
+            task.add_done_callback(self._handler_tasks.discard)
+        elif msg_type == MessageType.PONG:
+            waiter = self._pings.get(bytes(payload))
+            if waiter and not waiter.done():
+                waiter.set_result(None)
+
+    async def _send_pong(self, token: bytes) -> None:
+        if self.is_closed:
+            return
+        try:
+            self._last_sent = time.monotonic()
+            await write_frame(self._conn, MessageType.PONG, CONTROL_STREAM, token)
+        except (ConnectionError, OSError):
+            pass
+
+    def _accepts_remote_stream(self, stream_id: int) -> bool:
+        return (
+            self._on_stream is not None
+            and stream_id != CONTROL_STREAM
+            and stream_id % 2 != self._next_stream_id % 2
+            and stream_id > self._last_remote_stream_id
+        )
+
+
+class SessionPool:
+    """
+    Keeps a few warm sessions per peer.
+
+    Transfers to the same peer share the least busy session; striped
+    transfers ask for several distinct ones. Sessions with no streams
+    are closed after SESSION_IDLE_TIMEOUT.
+    """
+
+    def __init__(self, identity_service=None, max_per_peer: int = MAX_STRIPES):
+        self._identity_service = identity_service
+        self._max_per_peer = max_per_peer
+        self._sessions: dict[tuple[str, int], list[PeerSession]] = {}
+        self._locks: dict[tuple[str, int], asyncio.Lock] = {}
+        self._reaper_task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        self._reaper_task = asyncio.create_task(self._reap_idle())
+
+    async def acquire(self, peer_ip: str, peer_port: int, count: int = 1) -> list[PeerSession]:
+        """
+        Return up to ``count`` distinct live sessions to a peer, least busy
+        first, opening new ones only when fewer than ``count`` exist.
+        """
+        key = (peer_ip, peer_port)
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            live = [s for s in self._sessions.get(key, []) if not s.is_closed]
+            wanted = min(count, self._max_per_peer)
+            try:
+                while len(live) < wanted:
+                    live.append(await PeerSession.connect(peer_ip, peer_port, self._identity_service))
+            finally:
+                self._sessions[key] = live
+            return sorted(live, key=lambda s: s.active_streams)[:count]
+
+    async def close(self) -> None:
+        if self._reaper_task:
+            self._reaper_task.cancel()
+        for sessions in self._sessions.values():
+            for session in sessions:
+                session.close()
+        self._sessions.clear()
+
+    async def _reap_idle(self) -> None:
+        try:
+            while True:
+                await asyncio.sleep(SESSION_IDLE_TIMEOUT / 2)
+                now = time.monotonic()
+                for key, sessions in list(self._sessions.items()):
+                    keep = []
+                    for session in sessions:
+                        idle = session.active_streams == 0 and now - session.last_active > SESSION_IDLE_TIMEOUT
+                        if idle:
+                            session.close()
+                        elif not session.is_closed:
+                            keep.append(session)
+                    self._sessions[key] = keep
+        except asyncio.CancelledError:
+            pass
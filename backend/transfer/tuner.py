@@ -0,0 +1,185 @@
+"""
+Adaptive chunk size and pipeline depth.
+
+A TransferTuner watches how long each pipeline stage (disk read,
+compression, encryption, network send) takes per byte and what the round-trip time to
+the peer is, and periodically re-picks:
+
+* the chunk size, so a chunk crosses the slowest stage in about
+  CHUNK_TARGET_SECONDS: small chunks on Wi-Fi keep pause latency and the
+  cost of a lost chunk low, large chunks on 10GbE keep per-chunk overhead
+  from starving the link;
+* the pipeline depth, so the chunks in flight on a stream cover the
+  bandwidth-delay product plus double buffering.
+
+The sender owns the tuner; each decision is announced to the receiver
+with a TUNE message so it can resize its own per-stream buffering.
+"""
+
+import asyncio
+import json
+import math
+import time
+
+from config import (
+    CHUNK_SIZE,
+    CHUNK_TARGET_SECONDS,
+    MAX_CHUNK_SIZE,
+    MAX_PIPELINE_BYTES,
+    MAX_PIPELINE_DEPTH,
+    MIN_CHUNK_SIZE,
+    MIN_PIPELINE_DEPTH,
+    STREAM_QUEUE_DEPTH,
+    TUNE_INTERVAL,
+)
+from transfer.models import TransferInfo
+
+STAGES = ("read", "compress", "encrypt", "send")
+
+
+class PipelineWindow:
+    """A counting semaphore whose size can change while it is in use."""
+
+    def __init__(self, size: int):
+        self._size = size
+        self._used = 0
+        self._waiters: list[asyncio.Future] = []
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    async def acquire(self) -> None:
+        while self._used >= self._size:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            finally:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+        self._used += 1
+
+    def try_acquire(self) -> bool:
+        """Take a slot only if one is free right now."""
+        if self._used >= self._size:
+            return False
+        self._used += 1
+        return True
+
+    def release(self) -> None:
+        self._used -= 1
+        self._wake()
+
+    def resize(self, size: int) -> None:
+        self._size = size
+        self._wake()
+
+    def _wake(self) -> None:
+        # Waiters re-check the window, so waking all of them is safe
+        for waiter in self._waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+        self._waiters.clear()
+
+
+class _StageRate:
+    """Bytes per second of one stage, smoothed across tuning intervals."""
+
+    def __init__(self):
+        self.rate = 0.0
+        self._bytes = 0
+        self._seconds = 0.0
+
+    def record(self, byte_count: int, seconds: float) -> None:
+        self._bytes += byte_count
+        self._seconds += seconds
+
+    def roll(self) -> None:
+        if self._bytes and self._seconds > 0:
+            sample = self._bytes / self._seconds
+            self.rate = sample if not self.rate else 0.5 * self.rate + 0.5 * sample
+        self._bytes = 0
+        self._seconds = 0.0
+
+
+class TransferTuner:
+    """
+    (Sender side) Picks chunk size and pipeline depth for one transfer.
+
+    Rates are per stream: every stripe runs its own pipeline, so they all
+    share one set of decisions. ``version`` increases with every change,
+    letting each stripe notice when it has to resize and tell the peer.
+    """
+
+    def __init__(
+        self,
+        transfer_info: TransferInfo,
+        max_chunk_size: int = MAX_CHUNK_SIZE,
+        max_depth: int = MAX_PIPELINE_DEPTH,
+    ):
+        self.transfer_info = transfer_info
+        self.max_chunk_size = max(MIN_CHUNK_SIZE, min(max_chunk_size, MAX_CHUNK_SIZE))
+        self.max_depth = max(MIN_PIPELINE_DEPTH, min(max_depth, MAX_PIPELINE_DEPTH))
+        self.chunk_size = min(CHUNK_SIZE, self.max_chunk_size)
+        self.depth = min(STREAM_QUEUE_DEPTH, self.max_depth)
+        self.rtt: float | None = None
+        self.version = 0
+        self._stages = {stage: _StageRate() for stage in STAGES}
+        self._last_tune = time.monotonic()
+        self._publish()
+
+    def record(self, stage: str, byte_count: int, seconds: float) -> None:
+        """Account ``seconds`` spent moving ``byte_count`` bytes through a stage."""
+        self._stages[stage].record(byte_count, seconds)
+
+    def observe_rtt(self, seconds: float) -> None:
+        # Keep the minimum: later pings queue behind our own data
+        self.rtt = seconds if self.rtt is None else min(self.rtt, seconds)
+        self.transfer_info.rtt_ms = round(self.rtt * 1000, 2)
+
+    def maybe_retune(self) -> bool:
+        """Re-pick chunk size and depth once per TUNE_INTERVAL. True if they changed."""
+        now = time.monotonic()
+        if now - self._last_tune < TUNE_INTERVAL:
+            return False
+        self._last_tune = now
+
+        for stage in self._stages.values():
+            stage.roll()
+        # Stages that never ran (e.g. compression off) don't count
+        rates = [stage.rate for stage in self._stages.values() if stage.rate]
+        if not self._stages["send"].rate:
+            return False
+        bottleneck = min(rates)
+
+        # Move one power of two at a time, and only when the ideal size is
+        # at least a factor of two away, so noisy rates don't flap.
+        chunk_size = self.chunk_size
+        ideal = bottleneck * CHUNK_TARGET_SECONDS
+        if ideal >= 2 * chunk_size and chunk_size * 2 <= self.max_chunk_size:
+            chunk_size *= 2
+        elif ideal < chunk_size / 2 and chunk_size // 2 >= MIN_CHUNK_SIZE:
+            chunk_size //= 2
+
+        depth = self.depth
+        if self.rtt is not None:
+            in_flight = math.ceil(bottleneck * self.rtt / chunk_size)
+            depth = in_flight + 2
+        depth_cap = max(MIN_PIPELINE_DEPTH, MAX_PIPELINE_BYTES // chunk_size)
+        depth = max(MIN_PIPELINE_DEPTH, min(depth, self.max_depth, depth_cap))
+
+        if (chunk_size, depth) == (self.chunk_size, self.depth):
+            return False
+        self.chunk_size, self.depth = chunk_size, depth
+        self.version += 1
+        self._publish()
+        return True
+
+    def describe(self) -> bytes:
+        """TUNE message payload."""
+        return json.dumps({"chunk_size": self.chunk_size, "depth": self.depth}).encode("utf-8")
+
+    def _publish(self) -> None:
+        self.transfer_info.chunk_size = self.chunk_size
+        self.transfer_info.pipeline_depth = self.depth
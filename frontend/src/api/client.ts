@@ -2,7 +2,15 @@
    REST API client
    ============================ */
 
-import type { Peer, TransferInfo, Settings } from '../types';
+import type {
+    Peer,
+    TransferInfo,
+    TransferPriority,
+    Settings,
+    HistoryPage,
+    HistoryQuery,
+    HistoryStats,
+} from '../types';
 
 const BASE = '/api';
 
@@ -30,9 +38,29 @@ export async function getTransfers(): Promise<TransferInfo[]> {
     return data.transfers;
 }
 
-export async function getHistory(): Promise<any[]> {
-    const data = await request<{ history: any[] }>('/history');
-    return data.history;
+function historyParams(query: Omit<HistoryQuery, 'status'> & { status?: string[]; group?: string }) {
+    const params = new URLSearchParams();
+    Object.entries(query).forEach(([key, value]) => {
+        if (Array.isArray(value)) value.forEach((v) => params.append(key, v));
+        else if (value !== undefined && value !== '') params.append(key, String(value));
+    });
+    const qs = params.toString();
+    return qs ? `?${qs}` : '';
+}
+
+// Responses carry an ETag; the browser revalidates cached pages, so unchanged ones cost a 304
+export async function getHistory(query: HistoryQuery = {}): Promise<HistoryPage> {
+    return request<HistoryPage>(`/history${historyParams(query)}`);
+}
+
+export async function getHistoryStats(
+    group: 'peer' | 'day',
+    query: Omit<HistoryQuery, 'cursor' | 'limit' | 'status'> = {},
+): Promise<HistoryStats[]> {
+    const data = await request<{ stats: HistoryStats[] }>(
+        `/history/stats${historyParams({ ...query, group })}`,
+    );
+    return data.stats;
 }
 
 export async function selectFiles(): Promise<string[]> {
@@ -40,14 +68,20 @@ export async function selectFiles(): Promise<string[]> {
     return data.files;
 }
 
+export async function selectFolder(): Promise<string[]> {
+    const data = await request<{ files: string[] }>('/select-folder', { method: 'POST' });
+    return data.files;
+}
+
 export async function createTransfer(
     peerId: string,
     filePaths: string[],
+    priority: TransferPriority = 'normal',
 ): Promise<TransferInfo[]> {
     const res = await fetch(`${BASE}/transfers`, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ peer_id: peerId, file_paths: filePaths }),
+        body: JSON.stringify({ peer_id: peerId, file_paths: filePaths, priority }),
     });
     if (!res.ok) {
         const err = await res.json().catch(() => ({ detail: res.statusText }));
@@ -69,6 +103,16 @@ export async function cancelTransfer(id: string): Promise<void> {
     await request(`/transfers/${id}/cancel`, { method: 'POST' });
 }
 
+export async function setTransferPriority(
+    id: string,
+    priority: TransferPriority,
+): Promise<void> {
+    await request(`/transfers/${id}/priority`, {
+        method: 'POST',
+        body: JSON.stringify({ priority }),
+    });
+}
+
 export async function acceptTransfer(id: string): Promise<void> {
     await request(`/transfers/${id}/accept`, { method: 'POST' });
 }
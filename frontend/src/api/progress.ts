@@ -0,0 +1,60 @@
+/* ============================
+   Binary progress ticks
+   ============================ */
+
+import type { ProgressTick, TransferInfo } from '../types';
+
+// Must match PROGRESS_FIELDS in backend/transfer/progress.py
+const FIELDS: [keyof TransferInfo, 'Q' | 'd' | 'f' | 'I'][] = [
+    ['transferred_bytes', 'Q'],
+    ['speed_bps', 'd'],
+    ['progress_percent', 'f'],
+    ['eta_seconds', 'f'],
+    ['chunk_size', 'I'],
+    ['pipeline_depth', 'I'],
+    ['rtt_ms', 'f'],
+    ['compression_ratio', 'f'],
+    ['compression_cpu_seconds', 'f'],
+    ['resumed_bytes', 'Q'],
+    ['files_done', 'I'],
+    ['stripes', 'I'],
+];
+
+const SIZES = { Q: 8, d: 8, f: 4, I: 4 };
+
+export const TICK_KIND = 1;
+
+const decoder = new TextDecoder();
+
+/**
+ * Decode a binary `transfer_tick`: a (kind, seq, count) header, then per
+ * transfer its length-prefixed id, a field mask, and the masked values.
+ * All big-endian.
+ */
+export function decodeTick(buffer: ArrayBuffer): ProgressTick {
+    const view = new DataView(buffer);
+    const seq = view.getUint32(1);
+    const count = view.getUint32(5);
+    let offset = 9;
+
+    const transfers: ProgressTick['transfers'] = {};
+    for (let i = 0; i < count; i++) {
+        const idLength = view.getUint8(offset);
+        const id = decoder.decode(new Uint8Array(buffer, offset + 1, idLength));
+        offset += 1 + idLength;
+        const mask = view.getUint16(offset);
+        offset += 2;
+
+        const delta: Record<string, number> = {};
+        FIELDS.forEach(([name, code], bit) => {
+            if (!(mask & (1 << bit))) return;
+            if (code === 'Q') delta[name] = Number(view.getBigUint64(offset));
+            else if (code === 'd') delta[name] = view.getFloat64(offset);
+            else if (code === 'f') delta[name] = view.getFloat32(offset);
+            else delta[name] = view.getUint32(offset);
+            offset += SIZES[code];
+        });
+        transfers[id] = delta as Partial<TransferInfo>;
+    }
+    return { seq, transfers };
+}
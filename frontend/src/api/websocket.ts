@@ -4,23 +4,37 @@
 
 import { useEffect, useRef, useCallback, useState } from 'react';
 import type { WSMessage } from '../types';
+import { decodeTick } from './progress';
 
 type EventHandler = (data: Record<string, unknown>) => void;
 
 /**
  * Custom hook for WebSocket connection with auto-reconnect.
+ *
+ * Progress arrives as binary ticks with sequence numbers; the server
+ * sends a snapshot on every (re)connect, and a gap in the ticks asks
+ * it for another one.
  */
 export function useWebSocket() {
     const wsRef = useRef<WebSocket | null>(null);
     const handlersRef = useRef<Map<string, Set<EventHandler>>>(new Map());
     const [connected, setConnected] = useState(false);
     const reconnectTimer = useRef<ReturnType<typeof setTimeout>>();
+    const seqRef = useRef(0); // Last progress tick applied
+
+    const dispatch = (event: string, data: Record<string, unknown>) => {
+        const eventHandlers = handlersRef.current.get(event);
+        if (eventHandlers) {
+            eventHandlers.forEach((handler) => handler(data));
+        }
+    };
 
     const connect = useCallback(() => {
         if (wsRef.current?.readyState === WebSocket.OPEN) return;
 
         const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
-        const ws = new WebSocket(`${protocol}//${window.location.host}/ws`);
+        const ws = new WebSocket(`${protocol}//${window.location.host}/ws?encoding=binary`);
+        ws.binaryType = 'arraybuffer';
 
         ws.onopen = () => {
             setConnected(true);
@@ -29,11 +43,21 @@ export function useWebSocket() {
 
         ws.onmessage = (evt) => {
             try {
-                const msg: WSMessage = JSON.parse(evt.data);
-                const eventHandlers = handlersRef.current.get(msg.event);
-                if (eventHandlers) {
-                    eventHandlers.forEach((handler) => handler(msg.data));
+                const msg: WSMessage =
+                    evt.data instanceof ArrayBuffer
+                        ? { event: 'transfer_tick', data: { ...decodeTick(evt.data) } }
+                        : JSON.parse(evt.data);
+                if (msg.event === 'snapshot') {
+                    seqRef.current = msg.data.seq as number;
+                } else if (msg.event === 'transfer_tick') {
+                    const seq = msg.data.seq as number;
+                    if (seq <= seqRef.current) return; // Already in the snapshot
+                    if (seq !== seqRef.current + 1) {
+                        ws.send(JSON.stringify({ request: 'snapshot' }));
+                    }
+                    seqRef.current = seq;
                 }
+                dispatch(msg.event, msg.data);
             } catch (e) {
                 console.warn('[WS] Failed to parse message', e);
             }
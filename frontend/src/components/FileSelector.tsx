@@ -2,7 +2,7 @@ import { useState } from 'react';
 import { motion, AnimatePresence } from 'framer-motion';
 import { X, File as FileIcon, Send, FolderOpen } from 'lucide-react';
 import type { Peer } from '../types';
-import { selectFiles } from '../api/client';
+import { selectFiles, selectFolder } from '../api/client';
 
 interface Props {
     peer: Peer;
@@ -26,6 +26,18 @@ export default function FileSelector({ peer, onSend, onClose }: Props) {
         }
     };
 
+    const handleBrowseFolder = async () => {
+        setIsLoading(true);
+        try {
+            const paths = await selectFolder();
+            setFilePaths((prev) => [...prev, ...paths]);
+        } catch (err) {
+            console.error('Failed to select folder:', err);
+        } finally {
+            setIsLoading(false);
+        }
+    };
+
     const removeFile = (index: number) => {
         setFilePaths((prev) => prev.filter((_, i) => i !== index));
     };
@@ -70,14 +82,29 @@ export default function FileSelector({ peer, onSend, onClose }: Props) {
                             <button className="btn btn-secondary" disabled={isLoading}>
                                 {isLoading ? 'Opening...' : 'Browse Files'}
                             </button>
+                            <button
+                                className="btn btn-ghost btn-sm"
+                                disabled={isLoading}
+                                onClick={(e) => {
+                                    e.stopPropagation();
+                                    handleBrowseFolder();
+                                }}
+                            >
+                                Send a Folder
+                            </button>
                         </div>
                     ) : (
                         <div className="selected-files-list">
                             <div className="list-header">
                                 <span>Selected Files ({filePaths.length})</span>
-                                <button className="btn btn-ghost btn-sm" onClick={handleBrowse}>
-                                    + Add More
-                                </button>
+                                <div>
+                                    <button className="btn btn-ghost btn-sm" onClick={handleBrowse}>
+                                        + Add More
+                                    </button>
+                                    <button className="btn btn-ghost btn-sm" onClick={handleBrowseFolder}>
+                                        + Add Folder
+                                    </button>
+                                </div>
                             </div>
                             <div className="files-scroll-area">
                                 <AnimatePresence>
@@ -1,5 +1,5 @@
 /* ============================
-   Settings — device name + save directory
+   Settings — device name, save directory, bandwidth limits
    ============================ */
 
 import { useState, useEffect } from 'react';
@@ -11,10 +11,23 @@ interface Props {
     onClose: () => void;
 }
 
+const MB = 1024 * 1024;
+
+const LIMITS = [
+    ['rate_limit_global', 'Upload Limit — Total (MB/s)'],
+    ['rate_limit_peer', 'Upload Limit — Per Device (MB/s)'],
+    ['rate_limit_transfer', 'Upload Limit — Per Transfer (MB/s)'],
+] as const;
+
 export default function Settings({ onClose }: Props) {
     const [settings, setSettings] = useState<SettingsType>({
         device_name: '',
         save_dir: '',
+        rate_limit_global: 0,
+        rate_limit_peer: 0,
+        rate_limit_transfer: 0,
+        background_mode: false,
+        progress_interval: 0.25,
     });
     const [saving, setSaving] = useState(false);
 
@@ -64,6 +77,57 @@ export default function Settings({ onClose }: Props) {
                 />
             </div>
 
+            {LIMITS.map(([key, label]) => (
+                <div className="settings-group" key={key}>
+                    <label>{label}</label>
+                    <input
+                        className="settings-input"
+                        type="number"
+                        min={0}
+                        step={0.5}
+                        value={settings[key] / MB}
+                        onChange={(e) =>
+                            setSettings({
+                                ...settings,
+                                [key]: Math.max(0, Math.round(Number(e.target.value) * MB)),
+                            })
+                        }
+                        placeholder="0 = unlimited"
+                    />
+                </div>
+            ))}
+
+            <div className="settings-group">
+                <label className="settings-toggle">
+                    <input
+                        type="checkbox"
+                        checked={settings.background_mode}
+                        onChange={(e) =>
+                            setSettings({ ...settings, background_mode: e.target.checked })
+                        }
+                    />
+                    Background Mode — yield to other traffic
+                </label>
+            </div>
+
+            <div className="settings-group">
+                <label>Progress Update Interval (s)</label>
+                <input
+                    className="settings-input"
+                    type="number"
+                    min={0.05}
+                    max={5}
+                    step={0.05}
+                    value={settings.progress_interval}
+                    onChange={(e) =>
+                        setSettings({
+                            ...settings,
+                            progress_interval: Math.min(5, Math.max(0.05, Number(e.target.value))),
+                        })
+                    }
+                />
+            </div>
+
             <div className="file-selector-actions">
                 <button className="btn btn-secondary" onClick={onClose}>
                     Cancel
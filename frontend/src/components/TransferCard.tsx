@@ -55,7 +55,7 @@ function formatETA(seconds: number): string {
 }
 
 const isActive = (state: string) =>
-    ['transferring', 'paused', 'paused_by_peer', 'connecting', 'pending', 'awaiting_acceptance'].includes(state);
+    ['transferring', 'paused', 'paused_by_peer', 'connecting', 'reconnecting', 'pending', 'awaiting_acceptance'].includes(state);
 
 export default function TransferCard({
     transfer,
@@ -92,6 +92,8 @@ export default function TransferCard({
                     <div className="transfer-peer">
                         {isSending ? 'To' : 'From'} {transfer.peer_device_name} ·{' '}
                         {formatSize(transfer.file_size)}
+                        {transfer.is_folder &&
+                            ` · ${transfer.files_done} / ${transfer.file_count} files`}
                     </div>
                 </div>
 
@@ -128,7 +130,9 @@ export default function TransferCard({
                     )}
                     {!showCancelConfirm && (
                         <span className={`state-badge ${transfer.state}`}>
-                            {transfer.state.replace(/_/g, ' ')}
+                            {transfer.state === 'pending' && transfer.queue_position > 0
+                                ? `queued #${transfer.queue_position}`
+                                : transfer.state.replace(/_/g, ' ')}
                         </span>
                     )}
                 </div>
@@ -198,6 +202,16 @@ export default function TransferCard({
                         </div>
                     )}
 
+                    {/* Connection lost; the transfer resumes once it is back */}
+                    {transfer.state === 'reconnecting' && (
+                        <div className="transfer-stats" title={transfer.error_message ?? undefined}>
+                            <div className="transfer-stat">
+                                <Clock size={12} />
+                                <span>Connection lost, reconnecting…</span>
+                            </div>
+                        </div>
+                    )}
+
                     {/* Success State */}
                     {transfer.state === 'completed' && (
                         <motion.div
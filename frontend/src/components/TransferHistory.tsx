@@ -2,18 +2,36 @@ import { useState, useEffect } from 'react';
 import { Clock, Download, Upload } from 'lucide-react';
 import { getHistory } from '../api/client';
 import { motion, AnimatePresence } from 'framer-motion';
+import type { HistoryRecord } from '../types';
 
 export default function TransferHistory() {
-    const [history, setHistory] = useState<any[]>([]);
+    const [history, setHistory] = useState<HistoryRecord[]>([]);
+    const [nextCursor, setNextCursor] = useState<string | null>(null);
     const [isLoading, setIsLoading] = useState(true);
+    const [isLoadingMore, setIsLoadingMore] = useState(false);
+
+    const loadMore = async () => {
+        if (!nextCursor) return;
+        setIsLoadingMore(true);
+        try {
+            const page = await getHistory({ cursor: nextCursor });
+            setHistory((prev) => [...prev, ...page.history]);
+            setNextCursor(page.next_cursor);
+        } catch (err) {
+            console.error('Failed to fetch history:', err);
+        } finally {
+            setIsLoadingMore(false);
+        }
+    };
 
     useEffect(() => {
         let mounted = true;
         const fetchHistory = async () => {
             try {
-                const data = await getHistory();
+                const page = await getHistory();
                 if (mounted) {
-                    setHistory(data);
+                    setHistory(page.history);
+                    setNextCursor(page.next_cursor);
                 }
             } catch (err) {
                 console.error('Failed to fetch history:', err);
@@ -71,7 +89,7 @@ export default function TransferHistory() {
                         className="transfer-card"
                         initial={{ opacity: 0, y: 10 }}
                         animate={{ opacity: 1, y: 0 }}
-                        transition={{ delay: i * 0.05 }}
+                        transition={{ delay: Math.min(i, 10) * 0.05 }}
                     >
                         <div className="transfer-header">
                             <div className={`transfer-direction-icon ${record.direction}`}>
@@ -98,6 +116,15 @@ export default function TransferHistory() {
                     </motion.div>
                 ))}
             </AnimatePresence>
+            {nextCursor && (
+                <button
+                    className="btn btn-secondary"
+                    onClick={loadMore}
+                    disabled={isLoadingMore}
+                >
+                    {isLoadingMore ? 'Loading…' : 'Load more'}
+                </button>
+            )}
         </div>
     );
 }
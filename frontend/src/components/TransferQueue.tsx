@@ -21,7 +21,7 @@ export default function TransferQueue({
     onCancel,
 }: Props) {
     const active = transfers.filter((t) =>
-        ['pending', 'connecting', 'transferring', 'paused', 'awaiting_acceptance'].includes(t.state),
+        ['pending', 'connecting', 'reconnecting', 'transferring', 'paused', 'awaiting_acceptance'].includes(t.state),
     );
     const completed = transfers.filter((t) =>
         ['completed', 'failed', 'cancelled', 'rejected'].includes(t.state),
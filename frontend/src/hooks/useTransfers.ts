@@ -3,7 +3,7 @@
    ============================ */
 
 import { useState, useEffect } from 'react';
-import type { TransferInfo, Notification } from '../types';
+import type { TransferInfo, Notification, ProgressTick, Snapshot } from '../types';
 import { getTransfers } from '../api/client';
 
 let notifCounter = 0;
@@ -24,10 +24,16 @@ export function useTransfers(
 
     // Subscribe to real-time updates
     useEffect(() => {
-        const unsub1 = subscribe('transfer_progress', (data) => {
-            const info = data as unknown as TransferInfo;
+        const unsubSnapshot = subscribe('snapshot', (data) => {
+            setTransfers((data as unknown as Snapshot).transfers);
+        });
+
+        const unsub1 = subscribe('transfer_tick', (data) => {
+            const { transfers: deltas } = data as unknown as ProgressTick;
             setTransfers((prev) =>
-                prev.map((t) => (t.transfer_id === info.transfer_id ? info : t)),
+                prev.map((t) =>
+                    t.transfer_id in deltas ? { ...t, ...deltas[t.transfer_id] } : t,
+                ),
             );
         });
 
@@ -44,6 +50,17 @@ export function useTransfers(
             });
         });
 
+        const unsubQueue = subscribe('transfer_queue', (data) => {
+            const positions = data.positions as Record<string, number>;
+            setTransfers((prev) =>
+                prev.map((t) =>
+                    t.transfer_id in positions
+                        ? { ...t, queue_position: positions[t.transfer_id] }
+                        : t,
+                ),
+            );
+        });
+
         const unsub3 = subscribe('transfer_request', (data) => {
             const info = data as unknown as TransferInfo;
             setPendingRequests((prev) => [...prev, info]);
@@ -68,8 +85,10 @@ export function useTransfers(
         });
 
         return () => {
+            unsubSnapshot();
             unsub1();
             unsub2();
+            unsubQueue();
             unsub3();
             unsub4();
         };
@@ -19,6 +19,7 @@ export type TransferState =
     | 'awaiting_acceptance'
     | 'rejected'
     | 'connecting'
+    | 'reconnecting'
     | 'transferring'
     | 'paused'
     | 'paused_by_peer'
@@ -28,6 +29,8 @@ export type TransferState =
 
 export type TransferDirection = 'sending' | 'receiving';
 
+export type TransferPriority = 'high' | 'normal' | 'low';
+
 export interface TransferInfo {
     transfer_id: string;
     file_name: string;
@@ -41,6 +44,60 @@ export interface TransferInfo {
     progress_percent: number;
     eta_seconds: number;
     error_message: string | null;
+    stripes: number;
+    chunk_size: number;
+    pipeline_depth: number;
+    rtt_ms: number;
+    compression: string;
+    compression_ratio: number;
+    compression_cpu_seconds: number;
+    resumed_bytes: number;
+    digest: string;
+    deduplicated: boolean;
+    cipher_suite: string;
+    is_folder: boolean;
+    file_count: number;
+    files_done: number;
+    reconnects: number; // Times the transfer resumed over a new connection
+    priority: TransferPriority;
+    queue_position: number; // 1-based place in the send queue while pending, else 0
+}
+
+// --- History ---
+export interface HistoryRecord {
+    id: string;
+    file_name: string;
+    file_size: number;
+    peer_name: string;
+    direction: TransferDirection;
+    status: TransferState;
+    timestamp: string;
+    digest: string | null;
+    cipher_suite: string | null;
+}
+
+export interface HistoryQuery {
+    cursor?: string; // next_cursor of the previous page
+    limit?: number;
+    peer?: string;
+    direction?: TransferDirection;
+    status?: TransferState[];
+    since?: string; // ISO 8601
+    until?: string;
+}
+
+export interface HistoryPage {
+    history: HistoryRecord[];
+    next_cursor: string | null; // null on the last page
+}
+
+export interface HistoryStats {
+    peer?: string; // Set when grouped by peer
+    day?: string; // Set when grouped by day, YYYY-MM-DD
+    transfers: number;
+    bytes: number;
+    completed: number;
+    failed: number;
 }
 
 // --- WebSocket events ---
@@ -48,8 +105,10 @@ export type WSEventType =
     | 'peer_discovered'
     | 'peer_lost'
     | 'transfer_request'
-    | 'transfer_progress'
+    | 'snapshot'
+    | 'transfer_tick'
     | 'transfer_state'
+    | 'transfer_queue'
     | 'notification';
 
 export interface WSMessage {
@@ -57,6 +116,18 @@ export interface WSMessage {
     data: Record<string, unknown>;
 }
 
+// Full state sent on connect, and on request after a missed tick
+export interface Snapshot {
+    seq: number; // Last progress tick already included
+    transfers: TransferInfo[];
+}
+
+// Batched progress: only the transfers and fields that changed
+export interface ProgressTick {
+    seq: number;
+    transfers: Record<string, Partial<TransferInfo>>;
+}
+
 export interface Notification {
     id: string;
     type: 'success' | 'error' | 'warning' | 'info';
@@ -68,4 +139,9 @@ export interface Notification {
 export interface Settings {
     device_name: string;
     save_dir: string;
+    rate_limit_global: number; // Outgoing bytes/s, 0 = unlimited
+    rate_limit_peer: number;
+    rate_limit_transfer: number;
+    background_mode: boolean; // Back off when other traffic competes
+    progress_interval: number; // Seconds between progress updates
 }